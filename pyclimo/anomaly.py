@@ -0,0 +1,293 @@
+"""
+This file hosts all the functions responsible for PRISM anomaly products:
+    1) Reading the 1991-2020 PRISM normals and the base period standard deviations from the packed normals (see normals.py)
+    2) Computing the departure from normal, percent of normal and standardized departure of observed grids
+
+    A normal that is not in the packed normals yet is fetched from the PRISM Climate Group server the first time it is
+    needed and added to them. After that it is memory-mapped, so an anomaly for a new day costs one observed fetch and
+    one vectorized subtraction.
+
+    (C) Meteorologist Eric J. Drewitz
+
+"""
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import warnings
+warnings.filterwarnings('ignore')
+
+from rasterio.transform import Affine
+from pyclimo.prism_data import get_prism_dataarray, get_prism_dates, get_window_from_bounds, get_transform_coordinates, convert_units
+from pyclimo.prism_store import open_prism_store, get_store_dates
+from pyclimo.prism_stats import RunningStats
+from pyclimo.coords import get_region_info
+from pyclimo.normals import get_normal_key, get_packed_normal, add_packed_normals, add_packed_grid
+
+def grid_to_dataarray(values, transform, name, western_bound=None, eastern_bound=None, southern_bound=None, northern_bound=None):
+
+    """
+    This function wraps a (memory-mapped) grid in a 2-D xarray data array, optionally cut to the pixel window covering a set of bounds.
+    Only the pixels of the window are read from the memory-mapped file.
+
+    Required Arguments:
+
+    1) values (Array) - The 2-D grid values.
+
+    2) transform (Affine) - The affine transform of the grid.
+
+    3) name (String) - The name of the data array.
+
+    Optional Arguments: western_bound, eastern_bound, southern_bound, northern_bound (Float or Integer) - Default = None.
+    The window is only cut when all four bounds are passed in.
+
+    Returns: A 2-D (lat, lon) xarray data array with a 'transform' attribute
+    """
+
+    if western_bound == None or eastern_bound == None or southern_bound == None or northern_bound == None:
+        pass
+    else:
+        window = get_window_from_bounds(transform, values.shape[0], values.shape[1], western_bound, eastern_bound, southern_bound, northern_bound)
+        (row_start, row_stop), (col_start, col_stop) = window.toranges()
+        values = values[row_start:row_stop, col_start:col_stop]
+        transform = transform * Affine.translation(col_start, row_start)
+
+    lon, lat = get_transform_coordinates(transform, values.shape[0], values.shape[1])
+
+    da = xr.DataArray(values, coords={'lat':lat, 'lon':lon}, dims=('lat', 'lon'), name=name)
+    da.attrs['transform'] = tuple(transform)[:6]
+
+    return da
+
+
+def get_normal(variable, normal_type, month, day=None, western_bound=None, eastern_bound=None, southern_bound=None, northern_bound=None):
+
+    """
+    This function returns a 1991-2020 PRISM normal from the packed normals (see normals.pack_prism_normals).
+    If the normal is not packed yet, it is fetched once and added to the packed normals.
+
+    Required Arguments:
+
+    1) variable (String) - The variable name (i.e. 'tmax').
+
+    2) normal_type (String) - Daily or Monthly normals.
+
+    3) month (String) - 2 digit abbreviation for month (MM)
+
+    Optional Arguments:
+
+    1) day (String) - Default = None. For daily normals only - 2 digit abbreviation for day (DD)
+
+    2) western_bound, eastern_bound, southern_bound, northern_bound (Float or Integer) - Default = None.
+       When all four bounds are passed in, only the pixel window covering the bounds is read.
+
+    Returns: A 2-D (lat, lon) xarray data array of the normal in the native units
+    """
+
+    variable = variable.lower()
+    name = get_normal_key(variable, normal_type, month, day)
+
+    values, transform = get_packed_normal(name)
+
+    if values is None:
+        add_packed_normals([(variable, normal_type.lower(), month, day)], replace=False)
+        values, transform = get_packed_normal(name)
+
+    return grid_to_dataarray(values, transform, variable, western_bound=western_bound, eastern_bound=eastern_bound, southern_bound=southern_bound, northern_bound=northern_bound)
+
+
+def preload_normals(variable, normal_type, months=None):
+
+    """
+    This function fetches every normal of a variable into the packed normals ahead of time.
+    Normals that are already packed are not fetched again.
+
+    Required Arguments:
+
+    1) variable (String) - The variable name (i.e. 'tmax').
+
+    2) normal_type (String) - Daily or Monthly normals.
+
+    Optional Arguments:
+
+    1) months (List) - Default = None. The months (MM) to preload. When set to None, all 12 months are preloaded.
+
+    Returns: The normals are added to f:PRISM Cache/normals/packed_normals.dat
+    """
+
+    if months == None:
+        months = [f"{m:02d}" for m in range(1, 13)]
+
+    variable = variable.lower()
+
+    entries = []
+    if normal_type.lower() == 'daily':
+        # 2020 is a leap year so February 29th is included
+        for date in pd.date_range('2020-01-01', '2020-12-31', freq='D'):
+            if date.strftime('%m') in months:
+                entries.append((variable, 'daily', date.strftime('%m'), date.strftime('%d')))
+    else:
+        for month in months:
+            entries.append((variable, 'monthly', month, None))
+
+    add_packed_normals(entries, replace=False)
+
+
+def get_standard_deviation(variable, dtype, month, day=None, start_year=1991, end_year=2020, day_window=7):
+
+    """
+    This function returns the per-pixel standard deviation of PRISM data for a day (or month) of the year over a
+    base period, computed from the cube store (see prism_store.update_prism_store). The result is added to the packed normals.
+    The store must hold every date of the base period.
+
+    Required Arguments:
+
+    1) variable (String) - The variable name (i.e. 'tmax').
+
+    2) dtype (String) - Data Type: Daily or Monthly
+
+    3) month (String) - 2 digit abbreviation for month (MM)
+
+    Optional Arguments:
+
+    1) day (String) - Default = None. For daily data only - 2 digit abbreviation for day (DD)
+
+    2) start_year (Integer) - Default = 1991. The first year of the base period.
+
+    3) end_year (Integer) - Default = 2020. The last year of the base period.
+
+    4) day_window (Integer) - Default = 7. For daily data only - the number of days on each side of the day included in the sample.
+
+    Returns: A 2-D (lat, lon) xarray data array of the standard deviation in the native units
+    """
+
+    variable = variable.lower()
+
+    if dtype == 'Daily' or dtype == 'daily':
+        name = f"{variable}_daily_std_{month}{day}_{start_year}_{end_year}_{day_window}"
+    else:
+        name = f"{variable}_monthly_std_{month}_{start_year}_{end_year}"
+
+    values, transform = get_packed_normal(name)
+
+    if values is None:
+        # A standard deviation over part of the base period would be saved and reused as if it were complete
+        expected = get_prism_dates(dtype, f"{start_year}-01-01", f"{end_year}-12-31")
+        stored = get_store_dates(dtype, variable)
+        missing = [date for date in expected if date not in stored]
+        if len(stored) == 0:
+            raise ValueError(f"There is no {dtype.lower()} {variable} cube store. Fill it with update_prism_store('{variable}', '{start_year}-01-01', '{end_year}-12-31', '{dtype}') first.")
+        if len(missing) > 0:
+            raise ValueError(f"The {dtype.lower()} {variable} cube store is missing {len(missing)} of the {len(expected)} dates of the {start_year}-{end_year} base period (first missing: {missing[0].strftime('%Y-%m-%d')}). Fill it with update_prism_store('{variable}', '{start_year}-01-01', '{end_year}-12-31', '{dtype}') first.")
+
+        store = open_prism_store(variable, dtype, start_date=f"{start_year}-01-01", end_date=f"{end_year}-12-31")
+        times = pd.DatetimeIndex(store['time'].values)
+
+        if dtype == 'Daily' or dtype == 'daily':
+            dates = []
+            for year in range(start_year, end_year + 1):
+                try:
+                    center = pd.Timestamp(f"{year}-{month}-{day}")
+                except ValueError:
+                    # February 29th in a non-leap year
+                    center = pd.Timestamp(f"{year}-{month}-28")
+                dates.extend(pd.date_range(center - pd.Timedelta(days=day_window), center + pd.Timedelta(days=day_window), freq='D'))
+            selected = times.isin(dates)
+        else:
+            selected = times.month == int(month)
+
+        stats = RunningStats()
+        for i in np.nonzero(selected)[0]:
+            stats.update(store.isel(time=i).load().drop_vars('time'))
+
+        da = stats.result('std')
+        add_packed_grid(name, da)
+        values, transform = get_packed_normal(name)
+
+    return grid_to_dataarray(values, transform, variable)
+
+
+def get_prism_anomaly(variable, year, month, day=None, dtype='daily', anomaly_type='departure', std=None, to_fahrenheit=False, to_inches=False, western_bound=None, eastern_bound=None, southern_bound=None, northern_bound=None, region=None):
+
+    """
+    This function computes an anomaly of observed PRISM data against the 1991-2020 PRISM normals.
+
+    Required Arguments:
+
+    1) variable (String) - The variable name (i.e. 'tmax').
+
+    2) year (String) - Year
+
+    3) month (String) - 2 digit abbreviation for month (MM)
+
+    Optional Arguments:
+
+    1) day (String) - Default = None. For daily data only - 2 digit abbreviation for day (DD)
+
+    2) dtype (String) - Default = 'daily'. Data Type: Daily (compared with the daily normal) or Monthly (compared with the monthly normal)
+
+    3) anomaly_type (String) - Default = 'departure'. The type of anomaly:
+       - 'departure' = observed - normal (in the units of the variable)
+       - 'percent' = observed / normal * 100 (percent of normal, NaN where the normal is 0)
+       - 'standardized' = (observed - normal) / standard deviation
+
+    4) std (DataArray) - Default = None. The standard deviation used for standardized departures. It must be on the same
+       grid (and window) as the observed data. When set to None, it is computed from the cube store with get_standard_deviation.
+
+    5) to_fahrenheit (Boolean) - Default = False. When set to True, temperature departures are in Fahrenheit degrees.
+
+    6) to_inches (Boolean) - Default = False. When set to True, precipitation departures are in inches.
+
+    7) western_bound, eastern_bound, southern_bound, northern_bound (Float or Integer) - Default = None.
+       When all four bounds are passed in, only the pixel window covering the bounds is read.
+
+    8) region (String) - Default = None. A region abbreviation from coords.get_region_info (i.e. 'CA').
+       The bounds of the region are used when the bounds above are None.
+
+    Returns: A 2-D (lat, lon) xarray data array of the anomaly
+    """
+
+    variable = variable.lower()
+    anomaly_type = anomaly_type.lower()
+
+    if region != None and western_bound == None and eastern_bound == None and southern_bound == None and northern_bound == None:
+        western_bound, eastern_bound, southern_bound, northern_bound = get_region_info(region)[:4]
+    else:
+        pass
+
+    if dtype == 'Daily' or dtype == 'daily':
+        normal_type = 'daily'
+    else:
+        normal_type = 'monthly'
+
+    observed = get_prism_dataarray(dtype, variable, year, month, day, normal_type, western_bound=western_bound, eastern_bound=eastern_bound, southern_bound=southern_bound, northern_bound=northern_bound)
+    normal = get_normal(variable, normal_type, month, day, western_bound=western_bound, eastern_bound=eastern_bound, southern_bound=southern_bound, northern_bound=northern_bound)
+
+    # The windows only line up pixel for pixel when the observed and normal grids share the same grid definition
+    if observed.shape != normal.shape or not np.allclose(observed.attrs['transform'], normal.attrs['transform']):
+        raise ValueError(f"The observed {variable} grid {observed.shape} {observed.attrs['transform']} does not match the normal grid {normal.shape} {normal.attrs['transform']}.")
+
+    obs = observed.values
+    norm = np.asarray(normal.values)
+
+    if anomaly_type == 'departure':
+        scale = convert_units(1.0, variable, to_fahrenheit, to_inches) - convert_units(0.0, variable, to_fahrenheit, to_inches)
+        values = (obs - norm) * np.float32(scale)
+    elif anomaly_type == 'percent':
+        values = np.divide(obs, norm, out=np.full(obs.shape, np.nan, dtype='float32'), where=norm != 0) * 100
+    elif anomaly_type == 'standardized':
+        if std is None:
+            std = get_standard_deviation(variable, dtype, month, day)
+            sd = np.asarray(grid_to_dataarray(std.values, Affine(*std.attrs['transform'][:6]), variable, western_bound=western_bound, eastern_bound=eastern_bound, southern_bound=southern_bound, northern_bound=northern_bound).values)
+        else:
+            sd = np.asarray(std.values)
+        if sd.shape != obs.shape:
+            raise ValueError(f"The standard deviation grid {sd.shape} does not match the observed {variable} grid {obs.shape}.")
+        values = np.divide(obs - norm, sd, out=np.full(obs.shape, np.nan, dtype='float32'), where=sd > 0)
+    else:
+        raise ValueError(f"{anomaly_type} is not a valid anomaly type. Valid types: 'departure', 'percent', 'standardized'")
+
+    da = xr.DataArray(values, coords=observed.coords, dims=observed.dims, name=variable, attrs=observed.attrs)
+    da.attrs['anomaly_type'] = anomaly_type
+
+    return da
@@ -0,0 +1,194 @@
+"""
+This file hosts the asyncio entry points for applications running an event loop (i.e. a dashboard backend):
+    1) async_get_prism_dataarray - Awaits the download of a PRISM zip file and decodes it in a process pool
+    2) async_plot_prism_data - Awaits the download of a PRISM zip file and renders the plot in a process pool
+    3) async_plot_ncar_reanalysis_data_period_mean_eof1_eof2 - Runs the reanalysis period mean and EOF plot in a process pool
+
+    Downloads run in the default thread pool through asyncio.to_thread (using the pooled sessions of the download layer)
+    and the CPU-bound decoding and rendering run in a shared process pool, so the event loop is never blocked.
+    The number of requests in flight is limited by a semaphore (see set_max_concurrency).
+
+    On Windows and macOS, the process pool starts new Python processes, so the event loop must be started from inside an
+    if __name__ == '__main__': block.
+
+    (C) Meteorologist Eric J. Drewitz
+
+"""
+
+import asyncio
+import threading
+import weakref
+import warnings
+warnings.filterwarnings('ignore')
+
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from pyclimo.prism_data import get_prism_file_info, get_prism_dataarray
+from pyclimo.cache import retrieve_prism_file
+from pyclimo.prism import plot_prism_data
+from pyclimo.noaa_psl import plot_ncar_reanalysis_data_period_mean_eof1_eof2
+
+max_concurrency = 8
+
+max_process_workers = 2
+
+# The semaphores by event loop. Loops that are garbage collected drop out on their own
+semaphores = weakref.WeakKeyDictionary()
+
+process_pool = None
+
+pool_lock = threading.Lock()
+
+def set_max_concurrency(max_requests=8, max_workers=2):
+
+    """
+    This function sets the concurrency limits of the async entry points. It should be called before the first request.
+
+    Optional Arguments:
+
+    1) max_requests (Integer) - Default = 8. The maximum number of requests in flight per event loop.
+
+    2) max_workers (Integer) - Default = 2. The number of processes decoding and rendering.
+
+    Returns: None
+    """
+
+    global max_concurrency, max_process_workers, process_pool
+
+    with pool_lock:
+        max_concurrency = max_requests
+        max_process_workers = max_workers
+        semaphores.clear()
+        if process_pool != None:
+            process_pool.shutdown(wait=False)
+            process_pool = None
+
+
+def get_semaphore():
+
+    """
+    This function returns the semaphore limiting the requests in flight on the running event loop.
+
+    Required Arguments: None
+
+    Returns: An asyncio Semaphore
+    """
+
+    loop = asyncio.get_running_loop()
+
+    with pool_lock:
+        # A semaphore that had waiters refers to its loop, which keeps the loop alive as a key, so closed loops are dropped here
+        for closed in [other for other in semaphores.keys() if other.is_closed()]:
+            del semaphores[closed]
+        if loop not in semaphores:
+            semaphores[loop] = asyncio.Semaphore(max_concurrency)
+        return semaphores[loop]
+
+
+def get_process_pool():
+
+    """
+    This function returns the process pool shared by every async entry point.
+
+    Required Arguments: None
+
+    Returns: A ProcessPoolExecutor
+    """
+
+    global process_pool
+
+    with pool_lock:
+        if process_pool == None:
+            process_pool = ProcessPoolExecutor(max_workers=max_process_workers)
+        return process_pool
+
+
+async def run_in_process(func, *args, **kwargs):
+
+    """
+    This function runs a CPU-bound function in the shared process pool and awaits the result.
+    """
+
+    loop = asyncio.get_running_loop()
+
+    return await loop.run_in_executor(get_process_pool(), partial(func, *args, **kwargs))
+
+
+async def async_prefetch_prism_file(dtype, variable, year, month, day, normal_type):
+
+    """
+    This function awaits the download of a PRISM zip file into the f:PRISM Cache folder.
+    The download runs in the default thread pool so the event loop keeps serving other requests.
+
+    Required Arguments: dtype, variable, year, month, day and normal_type are the same as in prism_data.get_prism_dataarray.
+
+    Returns: The path to the cached zip file
+    """
+
+    url, fname, geotif, date, cache_normal_type = get_prism_file_info(dtype, variable, year, month, day, normal_type)
+
+    return await asyncio.to_thread(retrieve_prism_file, f"{url}/{fname}", fname, dtype, variable, date, cache_normal_type, '4km')
+
+
+async def async_get_prism_dataarray(dtype, variable, year, month, day, normal_type, **kwargs):
+
+    """
+    This function is the async counterpart of prism_data.get_prism_dataarray.
+
+    Required Arguments: dtype, variable, year, month, day and normal_type are the same as in prism_data.get_prism_dataarray.
+
+    Optional Arguments: Any keyword argument of prism_data.get_prism_dataarray.
+
+    Returns: A 2-D xarray data array (lat, lon) of PRISM Climate Data
+    """
+
+    async with get_semaphore():
+        if kwargs.get('use_cache', True) == True:
+            await async_prefetch_prism_file(dtype, variable, year, month, day, normal_type)
+        else:
+            pass
+
+        return await run_in_process(get_prism_dataarray, dtype, variable, year, month, day, normal_type, **kwargs)
+
+
+async def async_plot_prism_data(dtype, variable, year, month, day, normal_type, **kwargs):
+
+    """
+    This function is the async counterpart of prism.plot_prism_data. The zip file is downloaded in a thread and
+    the plot is rendered in the process pool from the f:PRISM Cache folder.
+
+    clear_data_in_folder defaults to False here since several plots may be rendering at once.
+
+    Required Arguments: dtype, variable, year, month, day and normal_type are the same as in prism.plot_prism_data.
+
+    Optional Arguments: Any keyword argument of prism.plot_prism_data.
+
+    Returns: None once the graphic is saved to the f:Climate Analysis Graphics folder
+    """
+
+    kwargs.setdefault('clear_data_in_folder', False)
+
+    async with get_semaphore():
+        if kwargs.get('use_cache', True) == True:
+            await async_prefetch_prism_file(dtype, variable, year, month, day, normal_type)
+        else:
+            pass
+
+        return await run_in_process(plot_prism_data, dtype, variable, year, month, day, normal_type, **kwargs)
+
+
+async def async_plot_ncar_reanalysis_data_period_mean_eof1_eof2(variable, level_type, western_bound, eastern_bound, southern_bound, northern_bound, start_date, end_date, **kwargs):
+
+    """
+    This function is the async counterpart of noaa_psl.plot_ncar_reanalysis_data_period_mean_eof1_eof2.
+    The OPENDAP subset is streamed while the data is reduced, so the fetch and the EOF fit run together in the process pool.
+
+    Required Arguments: The same as noaa_psl.plot_ncar_reanalysis_data_period_mean_eof1_eof2.
+
+    Optional Arguments: Any keyword argument of noaa_psl.plot_ncar_reanalysis_data_period_mean_eof1_eof2.
+
+    Returns: None once the graphics are saved to the f:Climate Analysis Graphics/NOAA PSL folder
+    """
+
+    async with get_semaphore():
+        return await run_in_process(plot_ncar_reanalysis_data_period_mean_eof1_eof2, variable, level_type, western_bound, eastern_bound, southern_bound, northern_bound, start_date, end_date, **kwargs)
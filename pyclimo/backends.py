@@ -0,0 +1,219 @@
+"""
+This file hosts the data-source backends every PRISM and NOAA PSL request goes through:
+    1) HTTPBackend - The PRISM Climate Group server and the NOAA PSL THREDDS Server (the default)
+    2) LocalMirrorBackend - A local (or NFS) directory mirroring the layout of those servers
+
+    Paths passed to a backend are relative to the root of the server (i.e. 'time_series/us/an/4km/tmax/daily/2024/prism_tmax_us_25m_20240701.zip'
+    for PRISM and 'Aggregations/ncep.reanalysis/pressure/hgt.nc' for PSL), so a mirror is a plain copy of the server folders.
+
+    The active backend is set with set_backend:
+
+        from pyclimo.backends import set_backend, LocalMirrorBackend
+        set_backend(LocalMirrorBackend('/mnt/mirror/prism', psl_directory='/mnt/mirror/psl'))
+
+    (C) Meteorologist Eric J. Drewitz
+
+"""
+
+import os
+import shutil
+import threading
+import requests
+import warnings
+warnings.filterwarnings('ignore')
+
+from pyclimo.download import download_file, get_session, DownloadError
+
+class HTTPBackend:
+
+    """
+    This class serves files from the PRISM Climate Group server and the NOAA PSL THREDDS Server.
+
+    Optional Arguments:
+
+    1) prism_url (String) - Default = 'https://data.prism.oregonstate.edu'. The root URL of the PRISM server.
+
+    2) psl_url (String) - Default = 'http://psl.noaa.gov/thredds/dodsC'. The root URL of the PSL OPENDAP service.
+    """
+
+    def __init__(self, prism_url='https://data.prism.oregonstate.edu', psl_url='http://psl.noaa.gov/thredds/dodsC'):
+
+        self.prism_root = prism_url.rstrip('/')
+        self.psl_root = psl_url.rstrip('/')
+
+    def prism_location(self, path):
+
+        """
+        Returns the URL of a file on the PRISM server.
+        """
+
+        return f"{self.prism_root}/{path}"
+
+    def psl_location(self, path):
+
+        """
+        Returns the OPENDAP URL of a dataset on the PSL THREDDS Server.
+        """
+
+        return f"{self.psl_root}/{path}"
+
+    def fetch(self, location, file_path):
+
+        """
+        Downloads a file to file_path.
+        """
+
+        return download_file(location, file_path)
+
+    def probe(self, location, timeout=(3, 5)):
+
+        """
+        Returns the HTTP status code of the DDS (the few hundred byte structure description) of an OPENDAP dataset.
+        """
+
+        response = get_session().get(f"{location}.dds", timeout=timeout, stream=True)
+        response.close()
+
+        return response.status_code
+
+    def stat(self, location, timeout=(3, 10)):
+
+        """
+        Returns the validators (ETag, Last-Modified and size) of a file on the server or None if the server can not be reached.
+        """
+
+        try:
+            response = get_session().head(location, headers={'Accept-Encoding':'identity'}, timeout=timeout, allow_redirects=True)
+        except requests.RequestException:
+            return None
+
+        if response.status_code != 200:
+            return None
+
+        size = response.headers.get('Content-Length')
+
+        return {'etag':response.headers.get('ETag'), 'last_modified':response.headers.get('Last-Modified'), 'size':int(size) if size != None else None}
+
+
+class LocalMirrorBackend:
+
+    """
+    This class serves files from local directories mirroring the layout of the PRISM server and the PSL THREDDS Server.
+    Files are read at disk speed and nothing touches the network.
+
+    Required Arguments:
+
+    1) prism_directory (String) - The directory mirroring https://data.prism.oregonstate.edu.
+
+    Optional Arguments:
+
+    1) psl_directory (String) - Default = None. The directory mirroring http://psl.noaa.gov/thredds/dodsC.
+       The datasets are netCDF files at the same relative paths as on the server.
+    """
+
+    def __init__(self, prism_directory, psl_directory=None):
+
+        self.prism_root = os.path.abspath(prism_directory)
+        if psl_directory == None:
+            self.psl_root = None
+        else:
+            self.psl_root = os.path.abspath(psl_directory)
+
+    def prism_location(self, path):
+
+        """
+        Returns the path of a file in the PRISM mirror.
+        """
+
+        return os.path.join(self.prism_root, *path.split('/'))
+
+    def psl_location(self, path):
+
+        """
+        Returns the path of a dataset in the PSL mirror.
+        """
+
+        if self.psl_root == None:
+            raise ValueError("This LocalMirrorBackend has no psl_directory.")
+
+        return os.path.join(self.psl_root, *path.split('/'))
+
+    def fetch(self, location, file_path):
+
+        """
+        Copies a file from the mirror to file_path. The mirror itself is never modified so it can be mounted read-only.
+        """
+
+        if os.path.exists(location):
+            pass
+        else:
+            raise DownloadError(f"{location} is not in the mirror.")
+
+        shutil.copyfile(location, f"{file_path}.part")
+        os.replace(f"{file_path}.part", file_path)
+
+        return file_path
+
+    def probe(self, location, timeout=None):
+
+        """
+        Returns 200 if a location is in the mirror and 404 if it is not.
+        """
+
+        if os.path.exists(location):
+            return 200
+        else:
+            return 404
+
+    def stat(self, location, timeout=None):
+
+        """
+        Returns the validators (modification time and size) of a file in the mirror or None if it is not in the mirror.
+        """
+
+        if os.path.exists(location):
+            pass
+        else:
+            return None
+
+        info = os.stat(location)
+
+        return {'etag':None, 'last_modified':str(info.st_mtime_ns), 'size':info.st_size}
+
+
+backend = HTTPBackend()
+
+backend_lock = threading.Lock()
+
+def set_backend(new_backend):
+
+    """
+    This function sets the backend used for every PRISM and PSL request.
+
+    Required Arguments:
+
+    1) new_backend (HTTPBackend or LocalMirrorBackend) - The backend.
+
+    Returns: The previous backend
+    """
+
+    global backend
+
+    with backend_lock:
+        previous = backend
+        backend = new_backend
+
+    return previous
+
+
+def get_backend():
+
+    """
+    This function returns the backend used for every PRISM and PSL request.
+
+    Required Arguments: None
+
+    Returns: The active backend
+    """
+
+    return backend
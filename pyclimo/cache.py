@@ -0,0 +1,712 @@
+"""
+This file hosts all the functions responsible for the local on-disk data cache:
+    1) Building the cache directory and the cache manifest
+    2) Looking up previously downloaded files by their cache key
+    3) Storing newly downloaded files in the cache
+    4) Registering other cached assets (i.e. NOAA PSL subsets, overviews, normals, zone labels and the cube store) in the manifest
+    5) Querying, evicting and validating the cached assets
+
+    PRISM files are stored by the SHA-256 checksum of their contents in the f:PRISM Cache/objects folder.
+    The manifest (f:PRISM Cache/manifest.sqlite) is an SQLite database with one row per cached asset holding its path,
+    source URL, dataset, variable, date, size, checksum, fetch time and last access time, so lookups, eviction and
+    validation are single indexed queries instead of folder scans.
+
+    Files written next to an asset that share its name up to the extension (i.e. the overviews {zip}.2x.npy of a zip file
+    or the .json transform of a .npy grid) are its sidecars: they are deleted together with the asset.
+
+    Assets that are expensive to rebuild (the cube store, the climatologies and the packed normals) are pinned: they are
+    listed in the manifest but never evicted.
+
+    PRISM replaces recent grids in place as they go from early to provisional to stable, so cached files of recent dates
+    are revalidated against the server (ETag, Last-Modified or size) once their last check is older than a day and are
+    fetched again when the server has a newer version. Older files and the normals are final and never revalidated.
+
+    (C) Meteorologist Eric J. Drewitz
+
+"""
+
+import os
+import glob
+import json
+import sqlite3
+import hashlib
+import threading
+import pandas as pd
+import warnings
+warnings.filterwarnings('ignore')
+
+from datetime import datetime, timedelta
+from pyclimo.backends import get_backend
+
+cache_directory = f"PRISM Cache"
+
+manifest_lock = threading.Lock()
+
+download_locks = {}
+
+connections = threading.local()
+
+columns = ['key', 'path', 'sha256', 'size', 'url', 'dataset', 'variable', 'date', 'normal_type', 'resolution', 'fetched', 'last_access', 'etag', 'last_modified', 'validated', 'pinned']
+
+def insert_asset(connection, row, replace=True):
+
+    """
+    This function writes a row (a dictionary by column name) to the assets table of the manifest.
+    """
+
+    names = [name for name in columns if name in row]
+    verb = 'INSERT OR REPLACE' if replace == True else 'INSERT OR IGNORE'
+
+    connection.execute(f"{verb} INTO assets ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})", [row[name] for name in names])
+
+
+def build_cache_key(dataset, variable, date, normal_type, resolution):
+
+    """
+    This function builds the key a file is stored under in the cache manifest.
+
+    Required Arguments:
+
+    1) dataset (String) - Data Type: Daily, Monthly, Normals
+
+    2) variable (String) - The variable name (i.e. 'tmax').
+
+    3) date (String) - The date of the data (YYYYMMDD for daily data, YYYYMM for monthly data, MM or MMDD for normals).
+
+    4) normal_type (String) - Daily or Monthly normals. Pass None for daily and monthly data.
+
+    5) resolution (String) - The resolution of the data (i.e. '4km').
+
+    Returns: The cache key as a string
+    """
+
+    if normal_type == None:
+        normal_type = 'none'
+
+    return f"{dataset.lower()}/{variable.lower()}/{date}/{normal_type.lower()}/{resolution.lower()}"
+
+
+def file_checksum(file_path):
+
+    """
+    This function returns the SHA-256 checksum of a file.
+
+    Required Arguments:
+
+    1) file_path (String) - The path to the file.
+
+    Returns: The hexadecimal SHA-256 checksum as a string
+    """
+
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+def get_timestamp():
+
+    """
+    This function returns the current UTC time in the format used by the manifest.
+    """
+
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def build_cache_directory():
+
+    """
+    This function builds the cache directory if it does not exist yet.
+
+    Required Arguments: None
+
+    Returns: The f:PRISM Cache and f:PRISM Cache/objects folders
+    """
+
+    if os.path.exists(f"{cache_directory}/objects"):
+        pass
+    else:
+        os.makedirs(f"{cache_directory}/objects", exist_ok=True)
+
+
+def migrate_json_manifest(connection):
+
+    """
+    This function imports the entries of a manifest.json file written by an older version of pyclimo into the SQLite manifest.
+    The JSON manifest is renamed to manifest.json.migrated afterwards.
+
+    Required Arguments:
+
+    1) connection (sqlite3.Connection) - The connection to the SQLite manifest.
+
+    Returns: None
+    """
+
+    json_path = f"{cache_directory}/manifest.json"
+
+    if os.path.exists(json_path):
+        pass
+    else:
+        return
+
+    with open(json_path, 'r') as f:
+        manifest = json.load(f)
+
+    with connection:
+        for key, entry in manifest.items():
+            dataset, variable, date, normal_type, resolution = key.split('/')
+            path = f"{cache_directory}/objects/{entry['sha256'][:2]}/{entry['sha256']}{entry['extension']}"
+            insert_asset(connection, {'key':key, 'path':path, 'sha256':entry['sha256'], 'size':entry['size'], 'url':entry['url'], 'dataset':dataset,
+                                      'variable':variable, 'date':date, 'normal_type':normal_type, 'resolution':resolution,
+                                      'fetched':entry['fetched'], 'last_access':entry['fetched']}, replace=False)
+
+    os.replace(json_path, f"{json_path}.migrated")
+
+
+def get_connection():
+
+    """
+    This function returns the connection of the current thread to the SQLite manifest and builds the manifest if it does not exist yet.
+
+    Required Arguments: None
+
+    Returns: An sqlite3 Connection to f:PRISM Cache/manifest.sqlite
+    """
+
+    try:
+        return connections.connection
+    except AttributeError:
+        pass
+
+    build_cache_directory()
+
+    connection = sqlite3.connect(f"{cache_directory}/manifest.sqlite", timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+
+    with manifest_lock:
+        with connection:
+            connection.execute("""CREATE TABLE IF NOT EXISTS assets (
+                key TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                sha256 TEXT,
+                size INTEGER,
+                url TEXT,
+                dataset TEXT,
+                variable TEXT,
+                date TEXT,
+                normal_type TEXT,
+                resolution TEXT,
+                fetched TEXT,
+                last_access TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                validated TEXT,
+                pinned INTEGER DEFAULT 0)""")
+            # Manifests written before the validators were recorded
+            existing = [row[1] for row in connection.execute("PRAGMA table_info(assets)").fetchall()]
+            for name, kind in [('etag', 'TEXT'), ('last_modified', 'TEXT'), ('validated', 'TEXT'), ('pinned', 'INTEGER DEFAULT 0')]:
+                if name not in existing:
+                    connection.execute(f"ALTER TABLE assets ADD COLUMN {name} {kind}")
+            connection.execute("CREATE INDEX IF NOT EXISTS assets_data ON assets (dataset, variable, date)")
+            connection.execute("CREATE INDEX IF NOT EXISTS assets_last_access ON assets (last_access)")
+            connection.execute("CREATE INDEX IF NOT EXISTS assets_path ON assets (path)")
+        migrate_json_manifest(connection)
+
+    connections.connection = connection
+
+    return connection
+
+
+def get_cached_file(key):
+
+    """
+    This function looks up a file in the cache and records the access.
+
+    Required Arguments:
+
+    1) key (String) - The cache key (see build_cache_key).
+
+    Returns: The path to the cached file or None if the file is not in the cache
+    """
+
+    connection = get_connection()
+
+    row = connection.execute("SELECT path FROM assets WHERE key = ?", (key,)).fetchone()
+
+    if row == None:
+        return None
+
+    file_path = row[0]
+
+    if os.path.exists(file_path):
+        with connection:
+            connection.execute("UPDATE assets SET last_access = ? WHERE key = ?", (get_timestamp(), key))
+        return file_path
+    else:
+        return None
+
+
+def touch_cached_asset(file_path):
+
+    """
+    This function records an access to a registered asset (and its registered sidecars) that was read without get_cached_file.
+
+    Required Arguments:
+
+    1) file_path (String) - The path to the file.
+
+    Returns: None
+    """
+
+    prefix = f"{os.path.splitext(file_path)[0]}."
+    connection = get_connection()
+
+    with connection:
+        connection.execute("UPDATE assets SET last_access = ? WHERE path = ? OR substr(path, 1, ?) = ?", (get_timestamp(), file_path, len(prefix), prefix))
+
+
+def delete_cached_file(connection, file_path):
+
+    """
+    This function deletes a file that no asset refers to anymore along with its sidecars and the rows of the sidecars.
+    It must be called with manifest_lock held.
+
+    Required Arguments:
+
+    1) connection (sqlite3.Connection) - The connection to the SQLite manifest.
+
+    2) file_path (String) - The path to the file.
+
+    Returns: The number of bytes deleted from disk
+    """
+
+    prefix = f"{os.path.splitext(file_path)[0]}."
+    freed = 0
+
+    with connection:
+        connection.execute("DELETE FROM assets WHERE path != ? AND substr(path, 1, ?) = ?", (file_path, len(prefix), prefix))
+
+    for path in [file_path] + glob.glob(f"{glob.escape(prefix)}*"):
+        if os.path.isfile(path):
+            freed += os.path.getsize(path)
+            os.remove(path)
+
+    return freed
+
+
+def register_cached_asset(key, file_path, url, dataset, variable, date, normal_type=None, resolution=None, checksum=True, pinned=False):
+
+    """
+    This function records a file that is already in its final place in the manifest (or updates its row).
+    It is used for cached assets that are not content addressed (i.e. the NOAA PSL subsets).
+
+    Required Arguments:
+
+    1) key (String) - The key the asset is stored under.
+
+    2) file_path (String) - The path to the file.
+
+    3) url (String) - The location the data was fetched from.
+
+    4) dataset (String) - The dataset (i.e. 'daily' or 'ncep.reanalysis').
+
+    5) variable (String) - The variable name (i.e. 'tmax' or 'hgt').
+
+    6) date (String) - The date (or period) of the data.
+
+    Optional Arguments:
+
+    1) normal_type (String) - Default = None. Daily or Monthly normals.
+
+    2) resolution (String) - Default = None. The resolution (or level) of the data.
+
+    3) checksum (Boolean) - Default = True. When set to True, the SHA-256 checksum of the file is recorded.
+       Set to False for files that are updated in place.
+
+    4) pinned (Boolean) - Default = False. When set to True, the asset is never evicted by evict_cache.
+       Set to True for assets that are expensive to rebuild (i.e. the cube store, the climatologies and the packed normals).
+
+    Returns: The path to the file
+    """
+
+    if checksum == True:
+        sha = file_checksum(file_path)
+    else:
+        sha = None
+
+    if normal_type == None:
+        normal_type = 'none'
+
+    now = get_timestamp()
+    connection = get_connection()
+
+    with connection:
+        insert_asset(connection, {'key':key, 'path':file_path, 'sha256':sha, 'size':os.path.getsize(file_path), 'url':url, 'dataset':dataset.lower(),
+                                  'variable':variable.lower(), 'date':date, 'normal_type':normal_type.lower(), 'resolution':resolution,
+                                  'fetched':now, 'last_access':now, 'pinned':int(pinned)})
+
+    return file_path
+
+
+def add_file_to_cache(key, file_path, url, validators=None):
+
+    """
+    This function moves a downloaded file into the cache and records it in the manifest.
+    If the key held an older version of the file, the older version is deleted once no other asset refers to it.
+
+    Required Arguments:
+
+    1) key (String) - The cache key (see build_cache_key).
+
+    2) file_path (String) - The path to the downloaded file.
+
+    3) url (String) - The URL the file was downloaded from.
+
+    Optional Arguments:
+
+    1) validators (Dictionary) - Default = None. The ETag, Last-Modified and size of the file on the server (see backends.HTTPBackend.stat),
+       recorded so the file can be revalidated later.
+
+    Returns: The path to the cached file
+    """
+
+    build_cache_directory()
+
+    sha = file_checksum(file_path)
+    extension = os.path.splitext(file_path)[1]
+
+    if os.path.exists(f"{cache_directory}/objects/{sha[:2]}"):
+        pass
+    else:
+        os.makedirs(f"{cache_directory}/objects/{sha[:2]}", exist_ok=True)
+
+    cached_path = f"{cache_directory}/objects/{sha[:2]}/{sha}{extension}"
+    os.replace(file_path, cached_path)
+
+    dataset, variable, date, normal_type, resolution = key.split('/')
+    now = get_timestamp()
+    connection = get_connection()
+
+    if validators == None:
+        validators = {}
+
+    with manifest_lock:
+        previous = connection.execute("SELECT path FROM assets WHERE key = ?", (key,)).fetchone()
+
+        with connection:
+            insert_asset(connection, {'key':key, 'path':cached_path, 'sha256':sha, 'size':os.path.getsize(cached_path), 'url':url, 'dataset':dataset,
+                                      'variable':variable, 'date':date, 'normal_type':normal_type, 'resolution':resolution, 'fetched':now, 'last_access':now,
+                                      'etag':validators.get('etag'), 'last_modified':validators.get('last_modified'), 'validated':now})
+
+        if previous != None and previous[0] != cached_path:
+            shared = connection.execute("SELECT COUNT(*) FROM assets WHERE path = ?", (previous[0],)).fetchone()[0]
+            if shared == 0:
+                delete_cached_file(connection, previous[0])
+
+    return cached_path
+
+
+def is_provisional(dataset, date, provisional_days=183):
+
+    """
+    This function checks whether a PRISM grid is recent enough that PRISM may still replace it (early, provisional or recent stable data).
+
+    Required Arguments:
+
+    1) dataset (String) - Data Type: Daily, Monthly, Normals
+
+    2) date (String) - The date of the data (YYYYMMDD for daily data, YYYYMM for monthly data).
+
+    Optional Arguments:
+
+    1) provisional_days (Integer) - Default = 183. The age in days after which a grid is considered final.
+
+    Returns: True if the grid may still change and False if it is final
+    """
+
+    dataset = dataset.lower()
+
+    if dataset == 'daily':
+        end = pd.to_datetime(date, format='%Y%m%d')
+    elif dataset == 'monthly':
+        end = pd.to_datetime(date, format='%Y%m') + pd.offsets.MonthEnd(1)
+    else:
+        return False
+
+    return (pd.Timestamp(datetime.utcnow()) - end).days <= provisional_days
+
+
+def is_current(key, url, revalidate_hours=24):
+
+    """
+    This function revalidates a cached file against the server. The server is only asked when the last check is
+    older than revalidate_hours. When the server can not be reached, the cached file is treated as current.
+
+    Required Arguments:
+
+    1) key (String) - The cache key (see build_cache_key).
+
+    2) url (String) - The location of the file on the active backend.
+
+    Optional Arguments:
+
+    1) revalidate_hours (Integer or Float) - Default = 24. The number of hours a check is trusted.
+
+    Returns: True if the cached file is the version on the server and False if the server has a newer version
+    """
+
+    connection = get_connection()
+
+    row = connection.execute("SELECT etag, last_modified, size, validated FROM assets WHERE key = ?", (key,)).fetchone()
+    if row == None:
+        return False
+
+    etag, last_modified, size, validated = row
+
+    cutoff = (datetime.utcnow() - timedelta(hours=revalidate_hours)).strftime('%Y-%m-%d %H:%M:%S')
+    if validated != None and validated > cutoff:
+        return True
+
+    validators = get_backend().stat(url)
+    if validators == None:
+        return True
+
+    if etag != None and validators['etag'] != None:
+        current = etag == validators['etag']
+    elif last_modified != None and validators['last_modified'] != None:
+        current = last_modified == validators['last_modified']
+    else:
+        current = size == validators['size']
+
+    if current == True:
+        with connection:
+            connection.execute("UPDATE assets SET validated = ?, etag = COALESCE(etag, ?), last_modified = COALESCE(last_modified, ?) WHERE key = ?",
+                               (get_timestamp(), validators['etag'], validators['last_modified'], key))
+
+    return current
+
+
+def find_cached_assets(dataset=None, variable=None, start_date=None, end_date=None):
+
+    """
+    This function lists the cached assets matching a query.
+
+    Optional Arguments:
+
+    1) dataset (String) - Default = None. The dataset (i.e. 'daily'). None = every dataset.
+
+    2) variable (String) - Default = None. The variable name (i.e. 'tmax'). None = every variable.
+
+    3) start_date (String) - Default = None. The first date in the format of the cache key (i.e. '20240701').
+
+    4) end_date (String) - Default = None. The last date in the format of the cache key (i.e. '20240731').
+
+    Returns: A Pandas DataFrame with one row per cached asset
+    """
+
+    query = "SELECT * FROM assets WHERE 1 = 1"
+    parameters = []
+
+    if dataset != None:
+        query += " AND dataset = ?"
+        parameters.append(dataset.lower())
+    if variable != None:
+        query += " AND variable = ?"
+        parameters.append(variable.lower())
+    if start_date != None:
+        query += " AND date >= ?"
+        parameters.append(start_date)
+    if end_date != None:
+        query += " AND date <= ?"
+        parameters.append(end_date)
+
+    return pd.read_sql_query(f"{query} ORDER BY dataset, variable, date", get_connection(), params=parameters)
+
+
+def remove_cached_assets(keys):
+
+    """
+    This function removes assets from the manifest and deletes each file that no remaining asset refers to,
+    along with its sidecars (see delete_cached_file).
+
+    Required Arguments:
+
+    1) keys (List) - The keys of the assets.
+
+    Returns: The number of bytes deleted from disk
+    """
+
+    connection = get_connection()
+    freed = 0
+
+    with manifest_lock:
+        for key in keys:
+            row = connection.execute("SELECT path FROM assets WHERE key = ?", (key,)).fetchone()
+            if row == None:
+                continue
+            with connection:
+                connection.execute("DELETE FROM assets WHERE key = ?", (key,))
+            shared = connection.execute("SELECT COUNT(*) FROM assets WHERE path = ?", (row[0],)).fetchone()[0]
+            if shared == 0:
+                freed += delete_cached_file(connection, row[0])
+
+    return freed
+
+
+def evict_cache(max_size=None, max_age_days=None):
+
+    """
+    This function evicts the least recently used assets from the cache. The sidecars of an evicted asset are evicted with it.
+    Pinned assets (see register_cached_asset) are never evicted and do not count towards max_size.
+
+    Optional Arguments:
+
+    1) max_size (Integer) - Default = None. The maximum total size of the cache in bytes.
+       The least recently accessed assets are evicted until the cache fits.
+
+    2) max_age_days (Integer or Float) - Default = None. Assets not accessed for more than this many days are evicted.
+
+    Returns: The number of bytes deleted from disk
+    """
+
+    connection = get_connection()
+    rows = connection.execute("SELECT key, path, size, last_access FROM assets WHERE COALESCE(pinned, 0) = 0 ORDER BY last_access").fetchall()
+    sizes = {}
+    for key, path, size, last_access in rows:
+        sizes[path] = size or 0
+
+    if max_age_days != None:
+        cutoff = (datetime.utcnow() - timedelta(days=max_age_days)).strftime('%Y-%m-%d %H:%M:%S')
+    else:
+        cutoff = None
+
+    # The registered sidecars of each file, found by stripping the extensions of every path one at a time
+    sidecars = {}
+    for path in sizes:
+        stem, extension = os.path.splitext(path)
+        while extension != '':
+            sidecars.setdefault(f"{stem}.", []).append(path)
+            stem, extension = os.path.splitext(stem)
+
+    total = sum(sizes.values())
+    keys = []
+    evicted = set()
+
+    for key, path, size, last_access in rows:
+        expired = cutoff != None and last_access < cutoff
+        oversized = max_size != None and total > max_size
+        if expired == False and oversized == False:
+            continue
+        keys.append(key)
+        # A file and its sidecars only count once, however many keys refer to them
+        if path in evicted:
+            continue
+        group = set([path] + sidecars.get(f"{os.path.splitext(path)[0]}.", [])) - evicted
+        total -= sum(sizes[p] for p in group)
+        evicted.update(group)
+
+    return remove_cached_assets(keys)
+
+
+def validate_cache(verify_checksums=False, remove_invalid=True):
+
+    """
+    This function checks that every asset in the manifest is on disk with the recorded size (and checksum).
+
+    Optional Arguments:
+
+    1) verify_checksums (Boolean) - Default = False. When set to True, the SHA-256 checksum of every file is recomputed.
+
+    2) remove_invalid (Boolean) - Default = True. When set to True, the invalid assets are removed from the manifest and disk.
+
+    Returns: A list of the keys of the invalid assets
+    """
+
+    connection = get_connection()
+    invalid = []
+
+    for key, path, sha, size in connection.execute("SELECT key, path, sha256, size FROM assets").fetchall():
+        if os.path.exists(path) == False or os.path.getsize(path) != size:
+            invalid.append(key)
+        elif verify_checksums == True and sha != None and file_checksum(path) != sha:
+            invalid.append(key)
+
+    if remove_invalid == True:
+        remove_cached_assets(invalid)
+
+    return invalid
+
+
+def retrieve_prism_file(url, fname, dataset, variable, date, normal_type, resolution, use_cache=True, provisional_days=183, revalidate_hours=24):
+
+    """
+    This function returns the path to a PRISM zip file. If the file is already in the cache, the cached file is returned
+    without touching the network. Otherwise the file is downloaded and (when use_cache=True) stored in the cache.
+
+    Daily and monthly grids newer than provisional_days may still be replaced by PRISM, so their cached files are
+    revalidated against the server every revalidate_hours (see is_current) and fetched again when they changed.
+
+    Required Arguments:
+
+    1) url (String) - The location of the file on the active backend (see backends.get_backend).
+
+    2) fname (String) - The file name of the zip file.
+
+    3) dataset (String) - Data Type: Daily, Monthly, Normals
+
+    4) variable (String) - The variable name (i.e. 'tmax').
+
+    5) date (String) - The date of the data (YYYYMMDD for daily data, YYYYMM for monthly data, MM or MMDD for normals).
+
+    6) normal_type (String) - Daily or Monthly normals. Pass None for daily and monthly data.
+
+    7) resolution (String) - The resolution of the data (i.e. '4km').
+
+    Optional Arguments:
+
+    1) use_cache (Boolean) - Default = True. When set to True, the file is served from and stored in the f:PRISM Cache folder.
+       When set to False, the file is downloaded to the current working directory and the caller is responsible for removing it.
+
+    2) provisional_days (Integer) - Default = 183. The age in days after which a grid is considered final and never revalidated.
+
+    3) revalidate_hours (Integer or Float) - Default = 24. The number of hours between revalidations of a recent grid.
+
+    Returns: The path to the zip file
+    """
+
+    if use_cache == False:
+        get_backend().fetch(url, fname)
+        return fname
+
+    key = build_cache_key(dataset, variable, date, normal_type, resolution)
+    provisional = is_provisional(dataset, date, provisional_days)
+
+    file_path = get_cached_file(key)
+    if file_path != None and (provisional == False or is_current(key, url, revalidate_hours)):
+        return file_path
+
+    build_cache_directory()
+
+    # The temporary name only depends on the file so an interrupted download is resumed by the next run.
+    # Callers asking for the same file wait for each other instead of writing to the same part file.
+    with manifest_lock:
+        key_lock = download_locks.setdefault(key, threading.Lock())
+
+    with key_lock:
+        file_path = get_cached_file(key)
+        if file_path != None and (provisional == False or is_current(key, url, revalidate_hours)):
+            return file_path
+
+        # The validators are read before the download, so a file replaced during the download is caught by the next revalidation
+        if provisional == True:
+            validators = get_backend().stat(url)
+        else:
+            validators = None
+
+        tmp_path = f"{cache_directory}/{fname}"
+        get_backend().fetch(url, tmp_path)
+
+        return add_file_to_cache(key, tmp_path, url, validators=validators)
@@ -0,0 +1,213 @@
+"""
+This file hosts the expression engine for variables derived from several PRISM grids:
+    1) rh - Relative humidity [%] from tmean and tdmean
+    2) dpd - Dew point depression from tmean and tdmean
+    3) dtr - Diurnal temperature range (tmax - tmin)
+    4) heat_index - Heat index from tmax and tdmean (NWS Rothfusz regression)
+
+    Each derived variable is evaluated one band of rows at a time. The input bands are read straight out of the cached
+    zip files into buffers that are allocated once and reused for every band, and each expression is a fused kernel
+    working in place on those buffers. Memory use is the output grid plus a few bands, however large the grid is.
+
+    (C) Meteorologist Eric J. Drewitz
+
+"""
+
+import rasterio as rio
+import numpy as np
+import xarray as xr
+import warnings
+warnings.filterwarnings('ignore')
+
+from rasterio.windows import Window
+from pyclimo.prism_data import get_prism_file_info, get_zipped_geotiff_path, get_window_from_bounds, get_transform_coordinates
+from pyclimo.cache import retrieve_prism_file
+from pyclimo.coords import get_region_info
+
+def relative_humidity_kernel(inputs, out, scratch):
+
+    """
+    This kernel computes the relative humidity [%] from temperature and dew point [°C] in place.
+    It is calc.relative_humidity_from_temperature_and_dewpoint (Bolton 1980) folded into a single exponential:
+    e / e_s = exp(17.67 * td / (td + 243.5) - 17.67 * t / (t + 243.5))
+    """
+
+    t, td = inputs
+    a = scratch[0]
+
+    np.add(td, 243.5, out=a)
+    np.divide(td, a, out=a)
+    np.add(t, 243.5, out=out)
+    np.divide(t, out, out=out)
+    np.subtract(a, out, out=out)
+    np.multiply(out, 17.67, out=out)
+    np.exp(out, out=out)
+    np.multiply(out, 100, out=out)
+
+
+def difference_kernel(inputs, out, scratch):
+
+    """
+    This kernel computes the difference of two grids in place (i.e. tmean - tdmean or tmax - tmin).
+    """
+
+    np.subtract(inputs[0], inputs[1], out=out)
+
+
+def heat_index_kernel(inputs, out, scratch):
+
+    """
+    This kernel computes the heat index [°F] from temperature and dew point [°C] in place with the NWS Rothfusz regression
+    and its low and high humidity adjustments. The simple Steadman formula is used where the average of its result and
+    the temperature is below 80°F.
+    """
+
+    t, td = inputs
+    T, RH, a = scratch
+
+    relative_humidity_kernel((t, td), RH, [a])
+    np.multiply(t, 1.8, out=T)
+    np.add(T, 32, out=T)
+
+    # Steadman: 0.5 * (T + 61 + (T - 68) * 1.2 + RH * 0.094)
+    np.multiply(T, 2.2, out=out)
+    np.add(out, -20.6, out=out)
+    np.multiply(RH, 0.094, out=a)
+    np.add(out, a, out=out)
+    np.multiply(out, 0.5, out=out)
+    np.add(out, T, out=a)
+    np.multiply(a, 0.5, out=a)
+    steadman = a < 80
+
+    # Rothfusz regression evaluated as a polynomial in RH with coefficients in T
+    c0 = -42.379 + T * (2.04901523 - 0.00683783 * T)
+    c1 = 10.14333127 + T * (-0.22475541 + 0.00122874 * T)
+    c2 = -0.05481717 + T * (0.00085282 - 0.00000199 * T)
+    rothfusz = c0 + RH * (c1 + RH * c2)
+
+    dry = (RH < 13) & (T >= 80) & (T <= 112)
+    rothfusz[dry] -= ((13 - RH[dry]) / 4) * np.sqrt((17 - np.abs(T[dry] - 95)) / 17)
+    humid = (RH > 85) & (T >= 80) & (T <= 87)
+    rothfusz[humid] += ((RH[humid] - 85) / 10) * ((87 - T[humid]) / 5)
+
+    np.copyto(out, rothfusz, where=~steadman)
+
+
+derived_variables = {
+    'rh':{'inputs':['tmean', 'tdmean'], 'kernel':relative_humidity_kernel, 'scratch':1, 'units':'percent'},
+    'dpd':{'inputs':['tmean', 'tdmean'], 'kernel':difference_kernel, 'scratch':0, 'units':'difference'},
+    'dtr':{'inputs':['tmax', 'tmin'], 'kernel':difference_kernel, 'scratch':0, 'units':'difference'},
+    'heat_index':{'inputs':['tmax', 'tdmean'], 'kernel':heat_index_kernel, 'scratch':3, 'units':'fahrenheit'}
+}
+
+def get_derived_variable(name, dtype, year, month, day, normal_type, to_fahrenheit=False, western_bound=None, eastern_bound=None, southern_bound=None, northern_bound=None, region=None, band_rows=64):
+
+    """
+    This function evaluates a derived variable from the PRISM grids it depends on, one band of rows at a time.
+
+    Required Arguments:
+
+    1) name (String) - The derived variable:
+       - 'rh' = Relative Humidity [%] from tmean and tdmean
+       - 'dpd' = Dew Point Depression from tmean and tdmean
+       - 'dtr' = Diurnal Temperature Range from tmax and tmin
+       - 'heat_index' = Heat Index from tmax and tdmean
+
+    2) dtype (String) - Data Type: Daily, Monthly, Normals
+
+    3) year (String) - Year
+
+    4) month (String) - 2 digit abbreviation for month (MM)
+
+    5) day (String) - For daily data only - 2 digit abbreviation for day (DD)
+
+    6) normal_type (String) - Daily or Monthly normals.
+
+    Optional Arguments:
+
+    1) to_fahrenheit (Boolean) - Default = False. When set to True, dpd and dtr are in °F and heat_index is in °F.
+       When set to False, they are in °C. rh is always in %.
+
+    2) western_bound, eastern_bound, southern_bound, northern_bound (Float or Integer) - Default = None. The bounds in decimal degrees.
+       Only the pixel window covering the bounds is read when all four bounds are passed in.
+
+    3) region (String) - Default = None. A region abbreviation from coords.get_region_info (i.e. 'CA').
+
+    4) band_rows (Integer) - Default = 64. The number of rows evaluated at a time.
+
+    Returns: A 2-D float32 xarray data array (lat, lon) with a 'transform' attribute that can be passed to
+             prism_data.prism_dataarray_to_dataframe for the plotting functions
+    """
+
+    name = name.lower()
+
+    try:
+        expression = derived_variables[name]
+    except KeyError:
+        raise ValueError(f"{name} is not a valid derived variable. Valid derived variables: {list(derived_variables.keys())}")
+
+    if region != None and western_bound == None and eastern_bound == None and southern_bound == None and northern_bound == None:
+        western_bound, eastern_bound, southern_bound, northern_bound = get_region_info(region)[:4]
+    else:
+        pass
+
+    paths = []
+    for variable in expression['inputs']:
+        url, fname, geotif, date, cache_normal_type = get_prism_file_info(dtype, variable, year, month, day, normal_type)
+        zip_path = retrieve_prism_file(f"{url}/{fname}", fname, dtype, variable, date, cache_normal_type, '4km')
+        paths.append(get_zipped_geotiff_path(zip_path, geotif))
+
+    sources = [rio.open(path) for path in paths]
+
+    try:
+        src = sources[0]
+        for other in sources[1:]:
+            if other.transform != src.transform or other.shape != src.shape:
+                raise ValueError(f"The inputs of {name} are not on the same grid.")
+
+        if western_bound == None or eastern_bound == None or southern_bound == None or northern_bound == None:
+            window = Window(0, 0, src.width, src.height)
+        else:
+            window = get_window_from_bounds(src.transform, src.height, src.width, western_bound, eastern_bound, southern_bound, northern_bound)
+
+        (row_start, row_stop), (col_start, col_stop) = window.toranges()
+        width = col_stop - col_start
+
+        result = np.full((row_stop - row_start, width), np.nan, dtype='float32')
+
+        # The band buffers are allocated once and reused for every band
+        inputs = [np.empty((band_rows, width), dtype='float32') for source in sources]
+        scratch = [np.empty((band_rows, width), dtype='float32') for i in range(expression['scratch'])]
+        invalid = np.empty((band_rows, width), dtype=bool)
+
+        for row in range(row_start, row_stop, band_rows):
+            rows = min(band_rows, row_stop - row)
+            band = Window(col_start, row, width, rows)
+            invalid[:rows] = False
+            for source, buffer in zip(sources, inputs):
+                source.read(1, window=band, out=buffer[:rows])
+                nodata = source.nodata if source.nodata != None else -9999
+                invalid[:rows] |= buffer[:rows] == nodata
+
+            out = result[row - row_start:row - row_start + rows]
+            expression['kernel']([buffer[:rows] for buffer in inputs], out, [buffer[:rows] for buffer in scratch])
+
+            if expression['units'] == 'difference' and to_fahrenheit == True:
+                np.multiply(out, 1.8, out=out)
+            if expression['units'] == 'fahrenheit' and to_fahrenheit == False:
+                np.subtract(out, 32, out=out)
+                np.divide(out, 1.8, out=out)
+
+            out[invalid[:rows]] = np.nan
+
+        transform = src.window_transform(window)
+    finally:
+        for source in sources:
+            source.close()
+
+    lon, lat = get_transform_coordinates(transform, result.shape[0], result.shape[1])
+
+    da = xr.DataArray(result, coords={'lat':lat, 'lon':lon}, dims=('lat', 'lon'), name=name)
+    da.attrs['transform'] = tuple(transform)[:6]
+
+    return da
@@ -0,0 +1,225 @@
+"""
+This file hosts the shared download layer used for all file downloads (PRISM zip files and shapefiles):
+    1) Pooled HTTP connections (one keep-alive session per thread)
+    2) Timeouts and retries with exponential backoff
+    3) Resuming partial downloads with HTTP Range requests
+    4) Validating the size (and for zip files the CRC) of each download
+    5) Moving the finished download into place with an atomic rename
+
+    A download is written to {file_path}.part until it is complete and valid, so a truncated file never
+    ends up at the destination path.
+
+    (C) Meteorologist Eric J. Drewitz
+
+"""
+
+import os
+import time
+import random
+import threading
+import requests
+import urllib3
+import warnings
+warnings.filterwarnings('ignore')
+
+from zipfile import ZipFile, BadZipFile
+from requests.adapters import HTTPAdapter
+
+sessions = threading.local()
+
+class DownloadError(Exception):
+
+    """
+    This exception is raised when a file could not be downloaded after all retries or the server refused the request.
+    """
+
+    pass
+
+
+def get_session():
+
+    """
+    This function returns the HTTP session of the current thread. Each thread keeps its own session so the
+    connections to the server are reused (keep-alive) between downloads.
+
+    Required Arguments: None
+
+    Returns: A requests Session
+    """
+
+    try:
+        return sessions.session
+    except AttributeError:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        sessions.session = session
+        return session
+
+
+def validate_download(file_path, expected_size, check_zip):
+
+    """
+    This function checks that a downloaded file is complete.
+
+    Required Arguments:
+
+    1) file_path (String) - The path to the downloaded file.
+
+    2) expected_size (Integer or None) - The size reported by the server. Pass None if the server did not report a size.
+
+    3) check_zip (Boolean) - When set to True, the CRC of every member of the zip file is checked.
+
+    Returns: True if the file is complete and False if it is not
+    """
+
+    if expected_size != None and os.path.getsize(file_path) != expected_size:
+        return False
+
+    if check_zip == True:
+        try:
+            with ZipFile(file_path, 'r') as zObject:
+                if zObject.testzip() != None:
+                    return False
+        except BadZipFile:
+            return False
+
+    return True
+
+
+def get_expected_size(response, offset):
+
+    """
+    This function returns the full size of a file from the headers of a download response.
+
+    Required Arguments:
+
+    1) response (Response) - The response of the download request.
+
+    2) offset (Integer) - The number of bytes already downloaded (the start of the Range request).
+
+    Returns: The size of the file in bytes or None if the server did not report it
+    """
+
+    content_range = response.headers.get('Content-Range')
+    if response.status_code == 206 and content_range != None and '/' in content_range:
+        total = content_range.split('/')[-1]
+        if total != '*':
+            return int(total)
+
+    content_length = response.headers.get('Content-Length')
+    if content_length != None:
+        if response.status_code == 206:
+            return offset + int(content_length)
+        else:
+            return int(content_length)
+
+    return None
+
+
+def download_file(url, file_path, retries=5, backoff=1, timeout=(10, 60), chunk_size=1024 * 1024, check_zip=None):
+
+    """
+    This function downloads a file.
+
+    Required Arguments:
+
+    1) url (String) - The URL of the file.
+
+    2) file_path (String) - The path the file is saved to.
+
+    Optional Arguments:
+
+    1) retries (Integer) - Default = 5. The number of times a failed download is retried.
+
+    2) backoff (Integer or Float) - Default = 1. The wait in seconds before the first retry. The wait doubles after each retry.
+
+    3) timeout (Tuple) - Default = (10, 60). The connect and read timeouts in seconds.
+
+    4) chunk_size (Integer) - Default = 1048576. The number of bytes written to disk at a time.
+
+    5) check_zip (Boolean) - Default = None. When set to True, the CRC of every member of the downloaded zip file is checked.
+       When set to None, the CRC is checked when the file name ends in .zip.
+
+    Returns: The path to the downloaded file
+
+    Raises: DownloadError if the file could not be downloaded
+    """
+
+    if check_zip == None:
+        check_zip = file_path.lower().endswith('.zip')
+
+    part_path = f"{file_path}.part"
+    session = get_session()
+
+    for attempt in range(retries + 1):
+
+        if attempt > 0:
+            time.sleep(backoff * (2 ** (attempt - 1)) * (1 + random.random() * 0.1))
+
+        if os.path.exists(part_path):
+            offset = os.path.getsize(part_path)
+        else:
+            offset = 0
+
+        # Ask for the bytes of the file as they are stored, so the sizes in the headers match the bytes written
+        # and a Range request resumes at the right byte
+        headers = {'Accept-Encoding':'identity'}
+        if offset > 0:
+            headers['Range'] = f"bytes={offset}-"
+
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+
+                if response.status_code == 416:
+                    # The part file is already as large as the file on the server (or larger). Start over.
+                    os.remove(part_path)
+                    continue
+
+                if response.status_code == 429 or response.status_code >= 500:
+                    continue
+
+                if response.status_code >= 400:
+                    raise DownloadError(f"Could not download {url}: HTTP {response.status_code}")
+
+                encoded = response.headers.get('Content-Encoding', 'identity').lower() not in ('identity', '')
+
+                if encoded == True and response.status_code == 206:
+                    # A range of a compressed stream can not be appended to the file. Start over.
+                    os.remove(part_path)
+                    continue
+
+                if response.status_code == 206:
+                    mode = 'ab'
+                else:
+                    # The server ignored the Range request so the whole file is coming again
+                    offset = 0
+                    mode = 'wb'
+
+                if encoded == True:
+                    # The server compressed the file anyway. The headers give the compressed size, so only the CRC can be checked.
+                    expected_size = None
+                    blocks = response.iter_content(chunk_size=chunk_size)
+                else:
+                    expected_size = get_expected_size(response, offset)
+                    blocks = response.raw.stream(chunk_size, decode_content=False)
+
+                with open(part_path, mode) as f:
+                    for block in blocks:
+                        f.write(block)
+
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError, urllib3.exceptions.HTTPError):
+            continue
+
+        if validate_download(part_path, expected_size, check_zip) == True:
+            os.replace(part_path, file_path)
+            return file_path
+        else:
+            if expected_size != None and os.path.getsize(part_path) < expected_size:
+                # Truncated, keep the part file so the next attempt resumes from where this one stopped
+                pass
+            else:
+                os.remove(part_path)
+
+    raise DownloadError(f"Could not download {url} after {retries + 1} attempts.")
@@ -324,7 +324,7 @@ def prism_file_directory(dtype, region, variable, year, month, day, resolution,
     region = region.upper()
     variable = variable.upper()
     resolution = resolution.upper() 
-    normal_type = normal_type.upper()
+    normal_type = str(normal_type).upper()
     reference_system = reference_system.upper()
 
     if os.path.exists(f"Climate Analysis Graphics"):
@@ -407,6 +407,31 @@ def prism_file_directory(dtype, region, variable, year, month, day, resolution,
         path = f"Climate Analysis Graphics/PRISM/{dtype}/{region}/{variable}/{year}/{month}/{resolution}/{reference_system}"
         path_print = f"f:Climate Analysis Graphics/PRISM/{dtype}/{region}/{variable}/{year}/{month}/{resolution}/{reference_system}"
 
+    if dtype == 'CLIMATOLOGY':
+
+        if os.path.exists(f"Climate Analysis Graphics/PRISM/{dtype}/{region}/{variable}/{month}"):
+            pass
+        else:
+            os.mkdir(f"Climate Analysis Graphics/PRISM/{dtype}/{region}/{variable}/{month}")
+
+        if os.path.exists(f"Climate Analysis Graphics/PRISM/{dtype}/{region}/{variable}/{month}/{day}"):
+            pass
+        else:
+            os.mkdir(f"Climate Analysis Graphics/PRISM/{dtype}/{region}/{variable}/{month}/{day}")
+
+        if os.path.exists(f"Climate Analysis Graphics/PRISM/{dtype}/{region}/{variable}/{month}/{day}/{resolution}"):
+            pass
+        else:
+            os.mkdir(f"Climate Analysis Graphics/PRISM/{dtype}/{region}/{variable}/{month}/{day}/{resolution}")
+
+        if os.path.exists(f"Climate Analysis Graphics/PRISM/{dtype}/{region}/{variable}/{month}/{day}/{resolution}/{reference_system}"):
+            pass
+        else:
+            os.mkdir(f"Climate Analysis Graphics/PRISM/{dtype}/{region}/{variable}/{month}/{day}/{resolution}/{reference_system}")
+
+        path = f"Climate Analysis Graphics/PRISM/{dtype}/{region}/{variable}/{month}/{day}/{resolution}/{reference_system}"
+        path_print = f"f:Climate Analysis Graphics/PRISM/{dtype}/{region}/{variable}/{month}/{day}/{resolution}/{reference_system}"
+
     if dtype == 'NORMALS':
 
         if os.path.exists(f"Climate Analysis Graphics/PRISM/{dtype}/{region}/{variable}/{month}"):
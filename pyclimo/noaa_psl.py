@@ -18,7 +18,7 @@ warnings.filterwarnings('ignore')
 from dateutil import tz
 from cartopy.util import add_cyclic_point
 from pyclimo.time_funcs import get_timezone_abbreviation, get_timezone, plot_creation_time
-from pyclimo.noaa_psl_data import get_psl_netcdf
+from pyclimo.noaa_psl_data import get_psl_netcdf, chunk_dataset
 from pyclimo.calc import celsius_to_fahrenheit, roundup, rounddown, mm_to_in
 from pyclimo.file_funcs import noaa_psl_directory
 
@@ -40,37 +40,6 @@ tzone = get_timezone()
 from_zone = tz.tzutc()
 to_zone = tz.tzlocal()
 
-def get_level_index(level):
-
-    """
-    This function returns the index for a specific pressure level
-    """
-
-    index = {
-
-        '1000':0,
-        '925':1,
-        '850':2,
-        '700':3,
-        '600':4,
-        '500':5,
-        '400':6,
-        '300':7,
-        '250':8,
-        '200':9,
-        '150':10,
-        '100':11,
-        '70':12,
-        '50':13,
-        '30':14,
-        '20':15,
-        '10':16
-
-    }
-
-    return index
-
-
 def plot_titles(variable, level_type):
 
     """
@@ -117,7 +86,7 @@ def plot_titles(variable, level_type):
     return titles
 
 
-def plot_ncar_reanalysis_data_period_mean_eof1_eof2(variable, level_type, western_bound, eastern_bound, southern_bound, northern_bound, start_date, end_date, globe=False, to_fahrenheit=True, shrink=1, x1=0.01, y1=-0.03, x2=0.725, y2=-0.025, y3=-0.05, signature_fontsize=6, stamp_fontsize=5, level='500', hemispheric_view=False, hemisphere='N'):
+def plot_ncar_reanalysis_data_period_mean_eof1_eof2(variable, level_type, western_bound, eastern_bound, southern_bound, northern_bound, start_date, end_date, globe=False, to_fahrenheit=True, shrink=1, x1=0.01, y1=-0.03, x2=0.725, y2=-0.025, y3=-0.05, signature_fontsize=6, stamp_fontsize=5, level='500', hemispheric_view=False, hemisphere='N', use_cache=False, lazy=False):
 
     """
     This function plots NCAR Reanalysis netCDF4 data from the NOAA Physical Science Laboratory. 
@@ -263,6 +232,13 @@ def plot_ncar_reanalysis_data_period_mean_eof1_eof2(variable, level_type, wester
 
     13) hemisphere (String) - Default = 'N'. When set to 'N' the hemispheric view will be that of the Northern Hemisphere. Set to 'S' for Southern Hemisphere. 
 
+    14) use_cache (Boolean) - Default = False. When set to True, the data is read from the local reanalysis cache in the f:PRISM Cache/psl folder
+        and only the time steps missing from the cache are fetched from the PSL THREDDS Server. 
+
+    15) lazy (Boolean) - Default = False. When set to True, the data is read in dask chunks while it is reduced: time-contiguous chunks
+        for the period mean and space-contiguous chunks for the EOF fit. Multi-decade global periods then stream through bounded memory
+        on every core. Each chunk plan reads the data once, so pair this with use_cache=True for long periods. Requires dask. 
+
     Returns
     -------
     1) A plot of the mean value for the variable for the period. 
@@ -305,17 +281,24 @@ def plot_ncar_reanalysis_data_period_mean_eof1_eof2(variable, level_type, wester
     
     path, path_print = noaa_psl_directory(variable, level_type, western_bound, eastern_bound, southern_bound, northern_bound, start_date, end_date, 'NCAR Reanalysis', level)
 
-    ds = get_psl_netcdf(variable, level_type, western_bound, eastern_bound, southern_bound, northern_bound, start_date, end_date)
+    if level_type == 'pressure' or level_type == 'pressure level':
+        ds = get_psl_netcdf(variable, level_type, western_bound, eastern_bound, southern_bound, northern_bound, start_date, end_date, level=level, use_cache=use_cache)
+    else:
+        ds = get_psl_netcdf(variable, level_type, western_bound, eastern_bound, southern_bound, northern_bound, start_date, end_date, use_cache=use_cache)
 
-    level_idx = get_level_index(level)
-    level_idx = level_idx[level]
+    if lazy == True:
+        eof_data = chunk_dataset(ds, variable, 'eof')[variable]
+        mean_data = chunk_dataset(ds, variable, 'reduce')[variable]
+    else:
+        eof_data = ds[variable]
+        mean_data = ds[variable]
 
     model = xe.single.EOF(use_coslat=True)
-    model.fit(ds[variable], dim="time")
+    model.fit(eof_data, dim="time")
     model.explained_variance_ratio()
     components = model.components()
     scores = model.scores()
-    avg = ds[variable].mean(dim='time')      
+    avg = mean_data.mean(dim='time').compute()
     
     eof_cmap = cmaps.eof_colormap_1()
 
@@ -440,7 +423,7 @@ def plot_ncar_reanalysis_data_period_mean_eof1_eof2(variable, level_type, wester
         extend = 'both'
 
     if variable == 'hgt':
-        avg = (avg[level_idx, :, :])/10
+        avg = avg/10
         mean_cmap = cmaps.temperature_colormap()
         minima = int(round(np.nanmin(avg), -1))
         maxima = int(round(np.nanmax(avg), -1))
@@ -485,10 +468,7 @@ def plot_ncar_reanalysis_data_period_mean_eof1_eof2(variable, level_type, wester
             plt.title(f"PERIOD OF RECORD: {start_date} - {end_date}", fontsize=7, fontweight='bold', loc='right')
             ax.text(x1, y1, "Plot Created With PyClimo (C) Eric J. Drewitz " +utc_time.strftime('%Y')+" | Data Source: NOAA PSL: psl.noaa.gov", transform=ax.transAxes, fontsize=signature_fontsize, fontweight='bold', bbox=props)
             ax.text(x2, y2, "Image Created: " + local_time.strftime(f'%m/%d/%Y %H:%M {timezone}') + " (" + utc_time.strftime('%H:%M UTC') + ")", transform=ax.transAxes, fontsize=stamp_fontsize, fontweight='bold', bbox=props)
-            try:
-                cs = ax.contourf(cyclic_avg_lon, avg['lat'], cyclic_avg[:, :], levels=mean_levels, transform=datacrs, cmap=mean_cmap, extend=extend)
-            except Exception as e:
-                cs = ax.contourf(cyclic_avg_lon, avg['lat'], cyclic_avg[level_idx, :, :], levels=mean_levels, transform=datacrs, cmap=mean_cmap, extend=extend)
+            cs = ax.contourf(cyclic_avg_lon, avg['lat'], cyclic_avg[:, :], levels=mean_levels, transform=datacrs, cmap=mean_cmap, extend=extend)
             cbar = cbar = fig.colorbar(cs, shrink=shrink, pad=0.01, location='right', ticks=mean_ticks)
             fig.savefig(f"{path}/{fname}", bbox_inches='tight')
             plt.close(fig)
@@ -503,10 +483,7 @@ def plot_ncar_reanalysis_data_period_mean_eof1_eof2(variable, level_type, wester
             plt.title(f"PERIOD OF RECORD: {start_date} - {end_date}", fontsize=7, fontweight='bold', loc='right')
             ax.text(x1, y1, "Plot Created With PyClimo (C) Eric J. Drewitz " +utc_time.strftime('%Y')+" | Data Source: NOAA PSL: psl.noaa.gov", transform=ax.transAxes, fontsize=signature_fontsize, fontweight='bold', bbox=props)
             ax.text(x2, y2, "Image Created: " + local_time.strftime(f'%m/%d/%Y %H:%M {timezone}') + " (" + utc_time.strftime('%H:%M UTC') + ")", transform=ax.transAxes, fontsize=stamp_fontsize, fontweight='bold', bbox=props)
-            try:
-                cs = ax.contourf(cyclic_eof_lon, components['lat'], cyclic_eof[0, :, :], transform=datacrs, cmap=eof_cmap, extend='both')
-            except Exception as e:
-                cs = ax.contourf(cyclic_eof_lon, components['lat'], cyclic_eof[0, level_idx, :, :], transform=datacrs, cmap=eof_cmap, extend='both')
+            cs = ax.contourf(cyclic_eof_lon, components['lat'], cyclic_eof[0, :, :], transform=datacrs, cmap=eof_cmap, extend='both')
             fig.savefig(f"{path}/{fname}", bbox_inches='tight')
             plt.close(fig)
             print(f"Saved {fname} to {path_print}")   
@@ -520,10 +497,7 @@ def plot_ncar_reanalysis_data_period_mean_eof1_eof2(variable, level_type, wester
             plt.title(f"PERIOD OF RECORD: {start_date} - {end_date}", fontsize=7, fontweight='bold', loc='right')
             ax.text(x1, y1, "Plot Created With PyClimo (C) Eric J. Drewitz " +utc_time.strftime('%Y')+" | Data Source: NOAA PSL: psl.noaa.gov", transform=ax.transAxes, fontsize=signature_fontsize, fontweight='bold', bbox=props)
             ax.text(x2, y2, "Image Created: " + local_time.strftime(f'%m/%d/%Y %H:%M {timezone}') + " (" + utc_time.strftime('%H:%M UTC') + ")", transform=ax.transAxes, fontsize=stamp_fontsize, fontweight='bold', bbox=props)
-            try:
-                cs = ax.contourf(cyclic_eof_lon, components['lat'], cyclic_eof[1, :, :], transform=datacrs, cmap=eof_cmap, extend='both')
-            except Exception as e:
-                cs = ax.contourf(cyclic_eof_lon, components['lat'], cyclic_eof[1, level_idx, :, :], transform=datacrs, cmap=eof_cmap, extend='both')
+            cs = ax.contourf(cyclic_eof_lon, components['lat'], cyclic_eof[1, :, :], transform=datacrs, cmap=eof_cmap, extend='both')
             fig.savefig(f"{path}/{fname}", bbox_inches='tight')
             plt.close(fig)
             print(f"Saved {fname} to {path_print}")   
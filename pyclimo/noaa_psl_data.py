@@ -4,14 +4,132 @@ This file has functions for data access from the NOAA Physical Science Laborator
 This file is written by: Eric J. Drewitz
 """
 
+import os
 import xarray as xr
+import pandas as pd
+import numpy as np
+import time
+import threading
 import requests
-import sys
 
 import warnings
 warnings.filterwarnings('ignore')
 
+try:
+    import dask
+    has_dask = True
+except ImportError:
+    has_dask = False
+
 from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from pyclimo.backends import get_backend, set_backend
+from pyclimo.cache import cache_directory, register_cached_asset, touch_cached_asset
+
+psl_cache_directory = f"{cache_directory}/psl"
+
+class PSLServerError(Exception):
+
+    """
+    This exception is raised when the NOAA PSL THREDDS Server is down or refuses a dataset.
+    """
+
+    pass
+
+
+# The health of each server by its location: the time of the last healthy and failed probe, the probe lock,
+# the number of failed checks in a row and the time the circuit breaker closes again
+health = {'checked':{}, 'failed':{}, 'probes':{}, 'failures':{}, 'open_until':{}}
+
+health_lock = threading.Lock()
+
+def check_psl_server(url, timeout=(3, 5), retries=2, backoff=1, status_ttl=60, failure_threshold=3, reset_after=300):
+
+    """
+    This function checks that the NOAA PSL THREDDS Server can serve a dataset before it is opened.
+
+    The probe only requests the DDS of the dataset (a few hundred bytes) with short timeouts. A healthy result is
+    cached for the whole server for status_ttl seconds, so a batch of requests for several variables pays for one probe.
+    Only one thread probes a server at a time: threads arriving while a probe is in flight wait for it and share its result.
+    Failed probes are retried with exponential backoff, and after failure_threshold failed checks in a row the circuit
+    breaker opens: every check fails immediately for reset_after seconds instead of waiting on a server that is down.
+    The health state is kept per server, so switching backends (i.e. to a local mirror) is not affected by an open breaker.
+
+    Required Arguments:
+
+    1) url (String) - The OPENDAP location of the dataset (see backends.get_backend).
+
+    Optional Arguments:
+
+    1) timeout (Tuple) - Default = (3, 5). The connect and read timeouts of the probe in seconds.
+
+    2) retries (Integer) - Default = 2. The number of times a failed probe is retried.
+
+    3) backoff (Integer or Float) - Default = 1. The wait in seconds before the first retry. The wait doubles after each retry.
+
+    4) status_ttl (Integer or Float) - Default = 60. The number of seconds a healthy result is cached.
+
+    5) failure_threshold (Integer) - Default = 3. The number of failed checks in a row that opens the circuit breaker.
+
+    6) reset_after (Integer or Float) - Default = 300. The number of seconds the circuit breaker stays open.
+
+    Returns: None if the server is healthy
+
+    Raises: PSLServerError if the server is down, the circuit breaker is open or the dataset does not exist
+    """
+
+    server = get_backend().psl_location('')
+    arrived = time.monotonic()
+
+    with health_lock:
+        open_until = health['open_until'].get(server, 0)
+        if arrived < open_until:
+            raise PSLServerError(f"NOAA PSL THREDDS Server is currently down (retrying in {int(open_until - arrived)} seconds). Please try again later or contact: psl.data@noaa.gov")
+        if arrived - health['checked'].get(server, -status_ttl) < status_ttl:
+            return
+        probe_lock = health['probes'].setdefault(server, threading.Lock())
+
+    with probe_lock:
+
+        # Another thread may have probed the server while this one was waiting
+        with health_lock:
+            now = time.monotonic()
+            open_until = health['open_until'].get(server, 0)
+            if now < open_until:
+                raise PSLServerError(f"NOAA PSL THREDDS Server is currently down (retrying in {int(open_until - now)} seconds). Please try again later or contact: psl.data@noaa.gov")
+            if now - health['checked'].get(server, -status_ttl) < status_ttl:
+                return
+            if health['failed'].get(server, -1) >= arrived:
+                raise PSLServerError("NOAA PSL THREDDS Server is currently down. Please try again later or contact: psl.data@noaa.gov")
+
+        status_code = None
+        for attempt in range(retries + 1):
+
+            if attempt > 0:
+                time.sleep(backoff * (2 ** (attempt - 1)))
+
+            try:
+                status_code = get_backend().probe(url, timeout=timeout)
+            except requests.RequestException:
+                status_code = None
+                continue
+
+            if status_code == 200:
+                with health_lock:
+                    health['checked'][server] = time.monotonic()
+                    health['failures'][server] = 0
+                return
+
+            if status_code == 404:
+                raise PSLServerError(f"{url} does not exist on the NOAA PSL THREDDS Server.")
+
+        with health_lock:
+            health['failed'][server] = time.monotonic()
+            health['failures'][server] = health['failures'].get(server, 0) + 1
+            if health['failures'][server] >= failure_threshold:
+                health['open_until'][server] = time.monotonic() + reset_after
+
+    raise PSLServerError(f"NOAA PSL THREDDS Server is currently down (status: {status_code}). Please try again later or contact: psl.data@noaa.gov")
 
 def shift_longitude(ds, lon_name='lon'):
     """
@@ -68,7 +186,190 @@ def get_variable_paths(variable, level_type):
 
     return var_paths[variable][0], var_paths[variable][1]
 
-def get_psl_netcdf(variable, level_type, western_bound, eastern_bound, southern_bound, northern_bound, start_date, end_date):
+def select_level(ds, level):
+
+    """
+    This function selects a pressure level (or a list of pressure levels) from a dataset.
+    Datasets without a level dimension are returned unchanged.
+    """
+
+    if level != None and 'level' in ds.dims:
+        if isinstance(level, (list, tuple)):
+            ds = ds.sel(level=[float(l) for l in level])
+        else:
+            ds = ds.sel(level=float(level))
+
+    return ds
+
+def get_psl_cache_path(directory, variable, level, month):
+
+    """
+    This function returns the path of the cached month of a variable (and level) and builds its folder if it does not exist yet.
+
+    The months are saved to f:PRISM Cache/psl/{directory}/{variable}/{level}/{YYYY-mm}.nc
+    """
+
+    if level == None:
+        level_name = 'all'
+    elif isinstance(level, (list, tuple)):
+        level_name = '-'.join([f"{float(l):g}" for l in level])
+    else:
+        level_name = f"{float(level):g}"
+
+    folder = f"{psl_cache_directory}/{directory}/{variable}/{level_name}"
+
+    if os.path.exists(folder):
+        pass
+    else:
+        os.makedirs(folder, exist_ok=True)
+
+    return f"{folder}/{month.strftime('%Y-%m')}.nc", level_name
+
+def update_psl_cache(variable, level_type, start, end, level=None):
+
+    """
+    This function brings the local cache of a variable (and level) up to date for a period. Each month is one netCDF file
+    holding the global grid of every time step fetched so far. Only the time steps of the period missing from the cache
+    are fetched from the OPENDAP server and merged into the month files, so a rolling window only transfers the new days.
+
+    Months that held every time step of the month when they were last written are marked complete and are never checked again.
+
+    Required Arguments:
+
+    1) variable (String) - The variable name (i.e. 'hgt').
+
+    2) level_type (String) - The level type (see get_variable_paths).
+
+    3) start (datetime) - The start of the period.
+
+    4) end (datetime) - The end of the period.
+
+    Optional Arguments:
+
+    1) level (String, Integer or List) - Default = None. The pressure level(s) in hPa.
+
+    Returns: A list of the paths to the month files covering the period (months without any data are left out)
+    """
+
+    directory, file = get_variable_paths(variable, level_type)
+    months = list(pd.date_range(pd.Timestamp(start).replace(day=1), end, freq='MS'))
+
+    paths = {}
+    complete = {}
+    for month in months:
+        path, level_name = get_psl_cache_path(directory, variable, level, month)
+        paths[month] = path
+        if os.path.exists(path):
+            with xr.open_dataset(path, engine='netcdf4') as cached:
+                complete[month] = cached.attrs.get('complete', 0) == 1
+        else:
+            complete[month] = False
+
+    if all(complete.values()):
+        return list(paths.values())
+
+    url = get_backend().psl_location(f"Aggregations/ncep.reanalysis/{directory}/{file}")
+
+    check_psl_server(url)
+
+    remote = select_level(xr.open_dataset(url, engine='netcdf4'), level)
+    remote_times = pd.DatetimeIndex(remote['time'].values)
+
+    for month in months:
+        if complete[month] == True:
+            continue
+
+        path = paths[month]
+        month_end = month + pd.offsets.MonthBegin(1)
+        month_times = remote_times[(remote_times >= month) & (remote_times < month_end)]
+        wanted = month_times[(month_times >= pd.Timestamp(start)) & (month_times <= pd.Timestamp(end))]
+
+        if os.path.exists(path):
+            with xr.open_dataset(path, engine='netcdf4') as cached:
+                old = cached.load()
+            missing = wanted.difference(pd.DatetimeIndex(old['time'].values))
+        else:
+            old = None
+            missing = wanted
+
+        if len(missing) == 0:
+            continue
+
+        new = remote[[variable]].sel(time=missing).load()
+
+        if old is None:
+            merged = new
+        else:
+            merged = xr.concat([old, new], dim='time').sortby('time')
+
+        merged.attrs['complete'] = int(remote_times[-1] >= month_end and month_times.isin(merged['time'].values).all())
+        for var in merged.variables.values():
+            var.encoding = {}
+
+        merged.to_netcdf(f"{path}.tmp", engine='netcdf4', encoding={variable:{'zlib':True, 'complevel':4}})
+        os.replace(f"{path}.tmp", path)
+
+        register_cached_asset(f"psl/ncep.reanalysis/{directory}/{variable}/{level_name}/{month.strftime('%Y-%m')}", path, url, 'ncep.reanalysis', variable, month.strftime('%Y-%m'), resolution=f"{directory}/{level_name}", checksum=False)
+
+    remote.close()
+
+    return [path for path in paths.values() if os.path.exists(path)]
+
+def get_chunk_plan(da, purpose='reduce', target_bytes=64 * 1024 * 1024):
+
+    """
+    This function returns a dask chunk plan for a reanalysis data array so each chunk holds about target_bytes.
+
+    Required Arguments:
+
+    1) da (DataArray) - The data array (time, [level,] lat, lon).
+
+    Optional Arguments:
+
+    1) purpose (String) - Default = 'reduce'.
+       'reduce' - Time-contiguous chunks (every time step, split in latitude) for reductions over time (i.e. the period mean).
+       'eof' - Space-contiguous chunks (the whole grid, split in time) for the EOF fit.
+
+    2) target_bytes (Integer) - Default = 67108864. The target size of each chunk in bytes.
+
+    Returns: A dictionary of chunk sizes by dimension
+    """
+
+    sizes = dict(da.sizes)
+    itemsize = da.dtype.itemsize
+
+    if purpose == 'reduce':
+        chunks = {dim:-1 for dim in sizes}
+        row_bytes = itemsize * int(np.prod([size for dim, size in sizes.items() if dim != 'lat']))
+        chunks['lat'] = int(min(sizes['lat'], max(1, target_bytes // row_bytes)))
+    elif purpose == 'eof':
+        chunks = {dim:-1 for dim in sizes}
+        step_bytes = itemsize * int(np.prod([size for dim, size in sizes.items() if dim != 'time']))
+        chunks['time'] = int(min(sizes['time'], max(1, target_bytes // step_bytes)))
+    else:
+        raise ValueError(f"{purpose} is not a valid purpose. Valid purposes: 'reduce', 'eof'")
+
+    return chunks
+
+def chunk_dataset(ds, variable, chunks):
+
+    """
+    This function chunks a dataset with dask following a chunk plan (see get_chunk_plan).
+    When chunks is None, the dataset is returned unchanged.
+    """
+
+    if chunks == None:
+        return ds
+
+    if has_dask == False:
+        raise ImportError("Chunked datasets require dask. Install dask with: pip install dask")
+
+    if isinstance(chunks, str):
+        chunks = get_chunk_plan(ds[variable], purpose=chunks)
+
+    return ds.chunk(chunks)
+
+def get_psl_netcdf(variable, level_type, western_bound, eastern_bound, southern_bound, northern_bound, start_date, end_date, level=None, use_cache=False, chunks=None):
 
     """
     This function will retrieve NCAR Reanalysis data from the NOAA Physical Science Laboratory's OPENDAP. 
@@ -162,14 +463,24 @@ def get_psl_netcdf(variable, level_type, western_bound, eastern_bound, southern_
 
     8) end_date (String) - The end date of the analysis period in the 'YYYY-mm-dd' format. 
 
-    Returns
-    -------
+    Optional Arguments:
+
+    1) level (String, Integer or List) - Default = None. The pressure level in hPa (i.e. '500') or a list of pressure levels
+       (i.e. ['850', '500', '250']) for the 'pressure' level type. The level is selected on the OPENDAP server before any
+       data is transferred. A single level drops the level dimension and a list keeps it. When set to None, every level is returned.
+
+    2) use_cache (Boolean) - Default = False. When set to True, the data is read from a local cache of the global grid
+       (one netCDF file per month in the f:PRISM Cache/psl folder) and only the time steps missing from the cache are fetched.
 
-    1) An xarray data array for the variable, area and time period.
+    3) chunks (String or Dictionary) - Default = None. When set, the dataset is returned as lazy dask arrays that are only read
+       when computed, so long periods stream through bounded memory and use every core. Requires dask.
+       'reduce' - Time-contiguous chunks for reductions over time (see get_chunk_plan).
+       'eof' - Space-contiguous chunks for the EOF fit (see get_chunk_plan).
+       A dictionary of chunk sizes by dimension is used as is. When set to None, dask is not used.
 
-    OR
+    Returns: An xarray dataset for the variable, area and time period.
 
-    2) An error message if psl.noaa.gov/thredds is down. 
+    Raises: PSLServerError if psl.noaa.gov/thredds is down. ValueError if use_cache=True and the server has no data for the period.
     """
 
     directory, file = get_variable_paths(variable, level_type)
@@ -190,16 +501,117 @@ def get_psl_netcdf(variable, level_type, western_bound, eastern_bound, southern_
     southern_bound = southern_bound - 2
     northern_bound = northern_bound + 2
 
-    response = requests.get(f"http://psl.noaa.gov/thredds/dodsC/Aggregations/ncep.reanalysis/{directory}/{file}")
+    if use_cache == True:
+        months = []
+        for path in update_psl_cache(variable, level_type, start, end, level=level):
+            # Reads count as accesses so eviction keeps the months in use
+            touch_cached_asset(path)
+            if chunks == None:
+                with xr.open_dataset(path, engine='netcdf4') as cached:
+                    months.append(cached.sel(time=slice(start, end)).load())
+            else:
+                # The month files stay open so the chunks are read from disk when they are computed
+                months.append(xr.open_dataset(path, engine='netcdf4').sel(time=slice(start, end)))
 
-    if response.status_code != 503 or response.status_code != 404:
-        ds = xr.open_dataset(f"http://psl.noaa.gov/thredds/dodsC/Aggregations/ncep.reanalysis/{directory}/{file}", engine='netcdf4')
-        ds = shift_longitude(ds)
-        ds = ds.sel(lon=slice(western_bound, eastern_bound, 1), lat=slice(northern_bound, southern_bound, 1), time=slice(start, end))
-    
-        return ds
-    else:
-        print(f"NOAA PSL THREDDS Server is currently down. Please try again later or contact: psl.data@noaa.gov")
-        sys.exit()
+        if len(months) == 0:
+            raise ValueError(f"There is no {variable} data between {start_date} and {end_date} on the NOAA PSL THREDDS Server.")
+
+        ds = shift_longitude(xr.concat(months, dim='time'))
+        ds = ds.sel(lon=slice(western_bound, eastern_bound, 1), lat=slice(northern_bound, southern_bound, 1))
+
+        return chunk_dataset(ds, variable, chunks)
+
+    url = get_backend().psl_location(f"Aggregations/ncep.reanalysis/{directory}/{file}")
+
+    check_psl_server(url)
+
+    ds = xr.open_dataset(url, engine='netcdf4')
+    ds = select_level(ds, level)
+    ds = shift_longitude(ds)
+    ds = ds.sel(lon=slice(western_bound, eastern_bound, 1), lat=slice(northern_bound, southern_bound, 1), time=slice(start, end))
+
+    return chunk_dataset(ds, variable, chunks)
 
     
+
+
+def init_psl_worker(backend, checked):
+
+    """
+    This function sets up a worker process of get_psl_dataset with the backend and the healthy server results of the
+    parent process, so the workers read from the same source and do not probe a server the parent has just probed.
+    """
+
+    set_backend(backend)
+
+    with health_lock:
+        health['checked'].update(checked)
+
+def fetch_psl_variable(variable, level_type, western_bound, eastern_bound, southern_bound, northern_bound, start_date, end_date, level, use_cache):
+
+    """
+    This function fetches and loads one variable for get_psl_dataset in a worker process.
+    """
+
+    ds = get_psl_netcdf(variable, level_type, western_bound, eastern_bound, southern_bound, northern_bound, start_date, end_date, level=level, use_cache=use_cache)
+
+    return ds[[variable]].load()
+
+def get_psl_dataset(variables, level_type, western_bound, eastern_bound, southern_bound, northern_bound, start_date, end_date, level=None, use_cache=False, max_workers=4):
+
+    """
+    This function retrieves several NCAR Reanalysis variables for the same area and period and merges them into one dataset.
+
+    The OPENDAP requests of the variables run concurrently in a process pool, so the time to fetch every variable is close to
+    the time of the slowest one instead of the sum of all of them. Processes are used rather than threads since the netCDF-C
+    library only lets one thread of a process read at a time. The server is probed once before the workers start.
+
+    On Windows and macOS, the process pool starts new Python processes, so this function must be called from inside an
+    if __name__ == '__main__': block.
+
+    Required Arguments:
+
+    1) variables (List) - The variable names (i.e. ['hgt', 'uwnd', 'vwnd', 'air']). See get_psl_netcdf for the variable names.
+
+    2) level_type (String) - The level type of every variable (see get_psl_netcdf).
+
+    3) western_bound (Float or Integer) - The western bound in decimal degrees.
+
+    4) eastern_bound (Float or Integer) - The eastern bound in decimal degrees.
+
+    5) southern_bound (Float or Integer) - The southern bound in decimal degrees.
+
+    6) northern_bound (Float or Integer) - The northern bound in decimal degrees.
+
+    7) start_date (String) - The start date of the analysis period in the 'YYYY-mm-dd' format. 
+
+    8) end_date (String) - The end date of the analysis period in the 'YYYY-mm-dd' format. 
+
+    Optional Arguments:
+
+    1) level (String, Integer or List) - Default = None. The pressure level(s) in hPa for the 'pressure' level type.
+
+    2) use_cache (Boolean) - Default = False. When set to True, the data is read from the local reanalysis cache (see get_psl_netcdf).
+
+    3) max_workers (Integer) - Default = 4. The maximum number of concurrent OPENDAP requests.
+
+    Returns: An xarray dataset with one data array per variable on the shared lat/lon/time (and level) coordinates
+
+    Raises: PSLServerError if psl.noaa.gov/thredds is down.
+    """
+
+    for variable in variables:
+        directory, file = get_variable_paths(variable, level_type)
+        check_psl_server(get_backend().psl_location(f"Aggregations/ncep.reanalysis/{directory}/{file}"))
+
+    with health_lock:
+        checked = dict(health['checked'])
+
+    workers = max(1, min(max_workers, len(variables)))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_psl_worker, initargs=(get_backend(), checked)) as pool:
+        futures = [pool.submit(fetch_psl_variable, variable, level_type, western_bound, eastern_bound, southern_bound, northern_bound, start_date, end_date, level, use_cache) for variable in variables]
+        datasets = [future.result() for future in futures]
+
+    ds = xr.merge(datasets, join='inner', combine_attrs='drop_conflicts')
+
+    return ds
@@ -0,0 +1,326 @@
+"""
+This file hosts all the functions responsible for the packed store of the 1991-2020 PRISM normals:
+    1) Packing every daily (366) and monthly (12) normal of every variable into one memory-mapped file
+    2) Adding single normals and grids computed over the base period (i.e. the standard deviations of
+       anomaly.get_standard_deviation) to the packed store
+    3) Looking up a grid in the packed store with an index
+
+    The normals are static, so they are fetched once and written to f:PRISM Cache/normals/packed_normals.dat
+    (one float32 grid per normal, stacked along the first axis) next to f:PRISM Cache/normals/packed_normals.json
+    (the position of each grid, the number of grids and the transform of the grid). A lookup is a slice of the mapping:
+    no network and no unzip. Every process opening the store shares the same pages of the operating system's file cache.
+
+    New grids are appended to the end of the file and the index is replaced last, so readers never see a position
+    that has not been written yet.
+
+    (C) Meteorologist Eric J. Drewitz
+
+"""
+
+import os
+import json
+import threading
+import numpy as np
+import pandas as pd
+import warnings
+warnings.filterwarnings('ignore')
+
+from concurrent.futures import ThreadPoolExecutor
+from rasterio.transform import Affine
+from pyclimo.prism_data import get_prism_dataarray
+from pyclimo.cache import cache_directory, register_cached_asset, touch_cached_asset
+
+normals_directory = f"{cache_directory}/normals"
+
+packed_path = f"{normals_directory}/packed_normals.dat"
+
+index_path = f"{normals_directory}/packed_normals.json"
+
+normal_variables = ['ppt', 'tdmean', 'tmax', 'tmean', 'tmin', 'vpdmax', 'vpdmin']
+
+packed = {}
+
+packed_lock = threading.Lock()
+
+# Held while grids are added so concurrent writers in a process do not hand out the same positions
+pack_write_lock = threading.Lock()
+
+def get_normal_key(variable, normal_type, month, day):
+
+    """
+    This function returns the name a normal is stored under.
+
+    Required Arguments:
+
+    1) variable (String) - The variable name (i.e. 'tmax').
+
+    2) normal_type (String) - Daily or Monthly normals.
+
+    3) month (String) - 2 digit abbreviation for month (MM)
+
+    4) day (String) - For daily normals only - 2 digit abbreviation for day (DD)
+
+    Returns: The name of the normal as a string
+    """
+
+    normal_type = normal_type.lower()
+
+    if normal_type == 'daily':
+        return f"{variable.lower()}_daily_{month}{day}"
+    else:
+        return f"{variable.lower()}_monthly_{month}"
+
+
+def reserve_packed_grids(names, shape, transform):
+
+    """
+    This function makes room in the packed store for a list of grids. Grids that are already packed keep their position
+    and new grids are given positions at the end of the file. It must be called with pack_write_lock held.
+
+    Required Arguments:
+
+    1) names (List) - The names of the grids (see get_normal_key).
+
+    2) shape (Tuple) - The (rows, columns) shape of the grids.
+
+    3) transform (Tuple or Affine) - The affine transform of the grids.
+
+    Returns
+    -------
+
+    1) The writable memory-mapped float32 array (grid, lat, lon) of the packed store
+    2) The index of the packed store with the positions of the grids (written with commit_packed_grids)
+    """
+
+    os.makedirs(normals_directory, exist_ok=True)
+
+    if os.path.exists(packed_path) and os.path.exists(index_path):
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        if tuple(index['shape']) != tuple(shape):
+            raise ValueError("The packed normals are not on the same grid as the requested normals. Remove f:PRISM Cache/normals/packed_normals.dat to repack them.")
+    else:
+        index = {'transform':list(transform)[:6], 'shape':list(shape), 'count':0, 'index':{}}
+
+    for name in names:
+        if name not in index['index']:
+            index['index'][name] = index['count']
+            index['count'] += 1
+
+    with open(packed_path, 'a+b') as f:
+        size = index['count'] * shape[0] * shape[1] * 4
+        if os.path.getsize(packed_path) < size:
+            f.truncate(size)
+
+    pack = np.memmap(packed_path, dtype='float32', mode='r+', shape=(index['count'],) + tuple(shape))
+
+    return pack, index
+
+
+def commit_packed_grids(pack, index):
+
+    """
+    This function flushes the grids written to the packed store and replaces the index, which makes them visible to readers.
+    It must be called with pack_write_lock held.
+
+    Required Arguments:
+
+    1) pack (Array) - The writable memory-mapped array returned by reserve_packed_grids.
+
+    2) index (Dictionary) - The index returned by reserve_packed_grids.
+
+    Returns: None
+    """
+
+    pack.flush()
+
+    with packed_lock:
+        packed.clear()
+        with open(f"{index_path}.tmp", 'w') as f:
+            json.dump(index, f)
+        os.replace(f"{index_path}.tmp", index_path)
+
+    register_cached_asset('normals/packed', packed_path, None, 'normals', 'packed', 'packed', checksum=False, pinned=True)
+
+
+def add_packed_normals(entries, max_workers=4, replace=True):
+
+    """
+    This function fetches a list of 1991-2020 PRISM normals and writes them to the packed store.
+    The zip files go through the f:PRISM Cache folder, so an interrupted run only fetches what is missing when it is repeated.
+
+    Required Arguments:
+
+    1) entries (List) - The normals as (variable, normal_type, month, day) tuples. day is None for monthly normals.
+
+    Optional Arguments:
+
+    1) max_workers (Integer) - Default = 4. The maximum number of concurrent downloads.
+
+    2) replace (Boolean) - Default = True. When set to True, normals that are already packed are fetched again.
+       When set to False, they are skipped.
+
+    Returns: The path to the packed normals
+    """
+
+    with pack_write_lock:
+        if replace == False:
+            values, index, transform = open_packed_normals()
+            entries = [entry for entry in entries if get_normal_key(*entry) not in index]
+
+        if len(entries) == 0:
+            return packed_path
+
+        first = get_prism_dataarray('Normals', entries[0][0], '2020', entries[0][2], entries[0][3], entries[0][1])
+        shape = first.shape
+
+        names = [get_normal_key(*entry) for entry in entries]
+        pack, index = reserve_packed_grids(names, shape, first.attrs['transform'])
+
+        pack[index['index'][names[0]]] = first.values
+
+        def fill(i):
+            variable, normal_type, month, day = entries[i]
+            da = get_prism_dataarray('Normals', variable, '2020', month, day, normal_type)
+            if da.shape != shape:
+                raise ValueError(f"The {names[i]} normal is not on the same grid as the other normals.")
+            pack[index['index'][names[i]]] = da.values
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            list(pool.map(fill, range(1, len(entries))))
+
+        commit_packed_grids(pack, index)
+        del pack
+
+    return packed_path
+
+
+def add_packed_grid(name, da):
+
+    """
+    This function writes a grid computed over the base period (i.e. a standard deviation) to the packed store.
+
+    Required Arguments:
+
+    1) name (String) - The name the grid is stored under.
+
+    2) da (DataArray) - A 2-D (lat, lon) PRISM data array on the full native grid with a 'transform' attribute.
+
+    Returns: The path to the packed normals
+    """
+
+    with pack_write_lock:
+        pack, index = reserve_packed_grids([name], da.shape, da.attrs['transform'])
+        pack[index['index'][name]] = np.asarray(da.values, dtype='float32')
+        commit_packed_grids(pack, index)
+        del pack
+
+    return packed_path
+
+
+def pack_prism_normals(variables=None, normal_types=['daily', 'monthly'], max_workers=4):
+
+    """
+    This function fetches the 1991-2020 PRISM normals and packs them into one memory-mapped file with an index.
+    The zip files go through the f:PRISM Cache folder, so an interrupted run only fetches what is missing when it is repeated.
+
+    Normals packed by an earlier call are kept, so the store can be built one variable at a time
+    (i.e. pack_prism_normals(['tmax']) and then pack_prism_normals(['tmin'])). Requested normals that are already packed are fetched again.
+
+    Optional Arguments:
+
+    1) variables (List) - Default = None. The variables to pack. When set to None, every PRISM normal variable is packed.
+
+    2) normal_types (List) - Default = ['daily', 'monthly']. The normal types to pack.
+
+    3) max_workers (Integer) - Default = 4. The maximum number of concurrent downloads.
+
+    Returns: The path to the packed normals
+    """
+
+    if variables == None:
+        variables = normal_variables
+
+    entries = []
+    for variable in variables:
+        for normal_type in normal_types:
+            if normal_type.lower() == 'daily':
+                # 2020 is a leap year so February 29th is included
+                for date in pd.date_range('2020-01-01', '2020-12-31', freq='D'):
+                    entries.append((variable.lower(), 'daily', date.strftime('%m'), date.strftime('%d')))
+            else:
+                for month in range(1, 13):
+                    entries.append((variable.lower(), 'monthly', f"{month:02d}", None))
+
+    return add_packed_normals(entries, max_workers=max_workers)
+
+
+def open_packed_normals():
+
+    """
+    This function memory-maps the packed normals. The mapping is kept open and reopened when the index file changes
+    (its inode, modification time or size), so normals packed by another process are picked up.
+
+    Required Arguments: None
+
+    Returns
+    -------
+
+    1) The read-only memory-mapped float32 array (normal, lat, lon) or None if the normals were not packed
+    2) A dictionary of the position of each normal by name
+    3) The affine transform of the grid
+    """
+
+    with packed_lock:
+        # The index is replaced last when grids are added, so it tells when the mapping is out of date
+        try:
+            stat = os.stat(index_path)
+        except FileNotFoundError:
+            packed.clear()
+            return None, {}, None
+
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+        if packed.get('signature') == signature:
+            return packed['values'], packed['index'], packed['transform']
+
+        if os.path.exists(packed_path):
+            pass
+        else:
+            packed.clear()
+            return None, {}, None
+
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+
+        packed['values'] = np.memmap(packed_path, dtype='float32', mode='r', shape=(index['count'],) + tuple(index['shape']))
+        touch_cached_asset(packed_path)
+        packed['index'] = index['index']
+        packed['transform'] = Affine(*index['transform'][:6])
+        packed['signature'] = signature
+
+        return packed['values'], packed['index'], packed['transform']
+
+
+def get_packed_normal(name):
+
+    """
+    This function looks up a normal (or another grid added with add_packed_grid) in the packed normals.
+
+    Required Arguments:
+
+    1) name (String) - The name of the normal (see get_normal_key) or grid.
+
+    Returns
+    -------
+
+    1) The read-only memory-mapped float32 grid or None if the grid is not packed
+    2) The affine transform of the grid or None if the grid is not packed
+    """
+
+    values, index, transform = open_packed_normals()
+
+    try:
+        return values[index[name]], transform
+    except KeyError:
+        return None, None
@@ -11,12 +11,14 @@ warnings.filterwarnings('ignore')
 
 from metpy.plots import USCOUNTIES
 from datetime import datetime, timedelta
-from pyclimo.geometry import get_shapes, get_geo_json 
+from pyclimo.geometry import get_shapes, get_geo_json, import_all_shapefiles
 from pyclimo.file_funcs import prism_file_directory
 from dateutil import tz
 from pyclimo.time_funcs import get_timezone_abbreviation, get_timezone, plot_creation_time
 from pyclimo.coords import get_cwa_coords, get_region_info
-from pyclimo.prism_data import get_geotiff_data
+from pyclimo.prism_data import get_geotiff_data, select_overview_factor, prism_dataarray_to_dataframe, convert_units
+from pyclimo.climatology import get_percentile_climatology
+from pyclimo.derived import get_derived_variable, derived_variables
 from pyclimo.calc import roundup, rounddown, round_to_quarter
 
 mpl.rcParams['font.weight'] = 'bold'
@@ -38,7 +40,7 @@ from_zone = tz.tzutc()
 to_zone = tz.tzlocal()
 
 
-def plot_prism_data(dtype, variable, year, month, day, normal_type, clear_data_in_folder=True, to_fahrenheit=True, to_inches=True, western_bound=None, eastern_bound=None, southern_bound=None, northern_bound=None, reference_system='States & Counties', show_state_borders=False, show_county_borders=False, show_gacc_borders=False, show_psa_borders=False, show_cwa_borders=False, show_nws_firewx_zones=False, show_nws_public_zones=False, state_border_linewidth=1, county_border_linewidth=0.25, gacc_border_linewidth=1, psa_border_linewidth=0.5, cwa_border_linewidth=1, nws_firewx_zones_linewidth=0.25, nws_public_zones_linewidth=0.25, state_border_linestyle='-', county_border_linestyle='-', gacc_border_linestyle='-', psa_border_linestyle='-', cwa_border_linestyle='-', nws_firewx_zones_linestyle='-', nws_public_zones_linestyle='-', region='conus', x1=0.01, y1=-0.03, x2=0.725, y2=-0.025, x3=0.01, y3=0.01, cwa=None, signature_fontsize=6, stamp_fontsize=5, shrink=0.7, custom_geojson=False, geojson_path=None, reference_system_label=None, custom_border_color='black', custom_border_linewidth=1):
+def plot_prism_data(dtype, variable, year, month, day, normal_type, clear_data_in_folder=True, to_fahrenheit=True, to_inches=True, western_bound=None, eastern_bound=None, southern_bound=None, northern_bound=None, reference_system='States & Counties', show_state_borders=False, show_county_borders=False, show_gacc_borders=False, show_psa_borders=False, show_cwa_borders=False, show_nws_firewx_zones=False, show_nws_public_zones=False, state_border_linewidth=1, county_border_linewidth=0.25, gacc_border_linewidth=1, psa_border_linewidth=0.5, cwa_border_linewidth=1, nws_firewx_zones_linewidth=0.25, nws_public_zones_linewidth=0.25, state_border_linestyle='-', county_border_linestyle='-', gacc_border_linestyle='-', psa_border_linestyle='-', cwa_border_linestyle='-', nws_firewx_zones_linestyle='-', nws_public_zones_linestyle='-', region='conus', x1=0.01, y1=-0.03, x2=0.725, y2=-0.025, x3=0.01, y3=0.01, cwa=None, signature_fontsize=6, stamp_fontsize=5, shrink=0.7, custom_geojson=False, geojson_path=None, reference_system_label=None, custom_border_color='black', custom_border_linewidth=1, use_cache=True, extract_files=False, preview=False, preview_width=600, percentile=90, climatology_start_year=1981, climatology_end_year=None, day_window=7):
 
     """
     This function downloads and plots PRISM Climate Data and saves the graphics to a folder. 
@@ -50,6 +52,8 @@ def plot_prism_data(dtype, variable, year, month, day, normal_type, clear_data_i
        - Daily = Daily Data
        - Monthly = Monthly Data
        - Normals = 30-Year Climate Normals
+       - Climatology = Percentile climatology of the daily data for a day of the year
+         (built with climatology.build_percentile_climatology, see the percentile options below)
 
     2) variable (String) - The variable to analyze. 
     
@@ -62,6 +66,12 @@ def plot_prism_data(dtype, variable, year, month, day, normal_type, clear_data_i
        - vpdmax = Daily maximum vapor pressure deficit [averaged over all days in the month] 
        - vpdmin = Daily minimum vapor pressure deficit [averaged over all days in the month] 
        
+       Derived Variables (computed from the PRISM grids above):
+       - rh = Relative humidity [%] from tmean and tdmean
+       - dpd = Dew point depression from tmean and tdmean
+       - dtr = Diurnal temperature range (tmax - tmin)
+       - heat_index = Heat index from tmax and tdmean (NWS Rothfusz regression)
+
        Additional Variables For Normals Only at 800m resolution:
        - solclear = Total daily global shortwave solar radiation received on a horizontal surface under clear sky conditions [averaged over all days in the month] 
        - solslope = Total daily global shortwave solar radiation received on a sloped surface [averaged over all days in the month] 
@@ -256,6 +266,27 @@ def plot_prism_data(dtype, variable, year, month, day, normal_type, clear_data_i
     41) custom_border_color (String) - Default='black'. The color of the border of the custom boundaries (the geometries in the locally hosted geojson).
 
     42) custom_border_linewidth (Integer) - Default = 1. The linewidth of the border of the custom boundaries (the geometries in the locally hosted geojson).
+
+    43) use_cache (Boolean) - Default = True. When set to True, previously downloaded PRISM data is served from the f:PRISM Cache folder
+        instead of being downloaded again. The f:PRISM Cache folder is not affected by clear_data_in_folder. 
+
+    44) extract_files (Boolean) - Default = False. When set to False, the GeoTiff (.tif) file is read directly from the zip file
+        and nothing is extracted to disk. When set to True, the contents of the zip file are extracted to the f:PRISM Data folder first. 
+
+    45) preview (Boolean) - Default = False. When set to True, the coarsest block-averaged overview (8, 16 or 32 km) that still
+        has a pixel for every output pixel across the map is plotted instead of the native 4 km grid. This is much faster for quick looks. 
+
+    46) preview_width (Integer) - Default = 600. The width of the map in output pixels used to pick the overview when preview=True. 
+
+    47) percentile (Integer or Float) - Default = 90. For dtype='Climatology' only. The percentile to plot
+        (must be one the climatology was built with).
+
+    48) climatology_start_year (Integer) - Default = 1981. For dtype='Climatology' only. The first year of the base period of the climatology.
+
+    49) climatology_end_year (Integer) - Default = None. For dtype='Climatology' only. The last year of the base period of the climatology.
+        When set to None, the climatology with the latest end year is used.
+
+    50) day_window (Integer) - Default = 7. For dtype='Climatology' only. The day window of the climatology.
     
 
     Returns
@@ -272,6 +303,8 @@ def plot_prism_data(dtype, variable, year, month, day, normal_type, clear_data_i
     f:Climate Analysis Graphics/PRISM/{dtype}/{region}/{variable}/{year}/{month}/{day}/{resolution}/{normal_type}/{reference_system}    
     """
 
+    import_all_shapefiles()
+
     PSAs = get_shapes(f"PSA Shapefiles/National_PSA_Current.shp")
     
     GACC = get_shapes(f"GACC Boundaries Shapefiles/National_GACC_Current.shp")
@@ -399,7 +432,10 @@ def plot_prism_data(dtype, variable, year, month, day, normal_type, clear_data_i
 
     path, path_print = prism_file_directory(dtype, 'us', variable, year, month, day, '4km', normal_type, reference_system_label)
 
-    fname = f"{variable.upper()}.png"
+    if dtype == 'Climatology' or dtype == 'climatology':
+        fname = f"{variable.upper()}_P{percentile:g}.png"
+    else:
+        fname = f"{variable.upper()}.png"
 
     try:
         western_bound, eastern_bound, southern_bound, northern_bound, x1, y1, x2, y2, x3, y3, signature_fontsize, stamp_fontsize, shrink = get_region_info(region)
@@ -424,7 +460,21 @@ def plot_prism_data(dtype, variable, year, month, day, normal_type, clear_data_i
         y3=y3
         shrink=shrink
 
-    df = get_geotiff_data(dtype, variable, year, month, day, normal_type, clear_data_in_folder, to_fahrenheit, to_inches)
+    if preview == True:
+        overview = select_overview_factor(western_bound, eastern_bound, preview_width)
+    else:
+        overview = 1
+
+    if dtype == 'Climatology' or dtype == 'climatology':
+        da = get_percentile_climatology(variable, month, day, percentile, start_year=climatology_start_year, end_year=climatology_end_year, day_window=day_window, western_bound=western_bound, eastern_bound=eastern_bound, southern_bound=southern_bound, northern_bound=northern_bound)
+        climatology_years = f"{da.attrs['start_year']}-{da.attrs['end_year']}"
+        da = convert_units(da, variable, to_fahrenheit, to_inches)
+        df = prism_dataarray_to_dataframe(da)
+    elif variable in derived_variables:
+        da = get_derived_variable(variable, dtype, year, month, day, normal_type, to_fahrenheit=to_fahrenheit, western_bound=western_bound, eastern_bound=eastern_bound, southern_bound=southern_bound, northern_bound=northern_bound)
+        df = prism_dataarray_to_dataframe(da)
+    else:
+        df = get_geotiff_data(dtype, variable, year, month, day, normal_type, clear_data_in_folder, to_fahrenheit, to_inches, use_cache=use_cache, extract_files=extract_files, western_bound=western_bound, eastern_bound=eastern_bound, southern_bound=southern_bound, northern_bound=northern_bound, overview=overview)
 
     df = df[df['longitude'] <= eastern_bound] 
     df = df[df['longitude'] >= western_bound] 
@@ -565,6 +615,61 @@ def plot_prism_data(dtype, variable, year, month, day, normal_type, clear_data_i
             if normal_type == 'Monthly' or normal_type == 'monthly':
                 title_right = f"Valid: {mon}"
 
+    elif variable == 'rh' or variable == 'dpd' or variable == 'dtr' or variable == 'heat_index':
+        if variable == 'rh':
+            cmap = cmaps.relative_humidity_colormap()
+            vmin = 0
+            vmax = 100
+            levels = np.arange(vmin, (vmax + 1), 1)
+            ticks = levels[::10]
+            units = '%'
+        else:
+            cmap = cmaps.temperature_colormap()
+            vmin = int(round(np.nanmin(var),0))
+            vmax = int(round(np.nanmax(var),0))
+            levels = np.arange(rounddown(vmin), (roundup(vmax) + 1), 1)
+            ticks = levels[::5]
+            if to_fahrenheit == True:
+                units = '°F'
+            else:
+                units = '°C'
+        if variable == 'rh':
+            title_var = 'Relative Humidity'
+        if variable == 'dpd':
+            title_var = 'Dew Point Depression'
+        if variable == 'dtr':
+            title_var = 'Diurnal Temperature Range'
+        if variable == 'heat_index':
+            title_var = 'Heat Index'
+        if dtype == 'Daily' or dtype == 'daily':
+            title_left = f"{title_var.upper()} [{units}]"
+            title_right = f"Valid: {year}-{mon}-{day}"
+        if dtype == 'Monthly' or dtype == 'monthly':
+            title_left = f"{title_var.upper()} [{units}]"
+            title_right = f"Valid: {year}-{mon}"
+        if dtype == 'Normals' or dtype == 'normals':
+            title_left = f"{normal_type.upper()} {title_var.upper()} [{units}] 30-Year (1991-2020) Normal"
+            if normal_type == 'Daily' or normal_type == 'daily':
+                title_right = f"Valid: {mon}-{day}"
+            if normal_type == 'Monthly' or normal_type == 'monthly':
+                title_right = f"Valid: {mon}"
+
+    if dtype == 'Climatology' or dtype == 'climatology':
+        if variable == 'ppt':
+            if to_inches == True:
+                units = '[IN]'
+            else:
+                units = '[MM]'
+        elif variable == 'vpdmax' or variable == 'vpdmin':
+            units = '[hPa]'
+        else:
+            if to_fahrenheit == True:
+                units = '[°F]'
+            else:
+                units = '[°C]'
+        title_left = f"{percentile:g}TH PERCENTILE {title_var.upper()} {units} ({climatology_years} +/- {day_window} DAYS) Climatology"
+        title_right = f"Valid: {mon}-{day}"
+
     fig = plt.figure(figsize=(12,12))
     fig.set_facecolor('aliceblue')
     ax = fig.add_subplot(1, 1, 1, projection=mapcrs)
@@ -2,24 +2,32 @@
 This file hosts all the functions responsible for the following:
     1) Downloading the PRISM Climate Data
     2) Extracting the Zipped PRISM Climate Data to a folder
-    3) Converting the GeoTiff data into a Pandas DataFrame
-    4) Returning the Pandas DataFrame to the user 
+    3) Converting the GeoTiff data into a 2-D xarray data array (or a Pandas DataFrame view of it)
+    4) Returning the data to the user 
 
     (C) Meteorologist Eric J. Drewitz
 
 """
 
-import urllib.request
 import rasterio as rio
 import os
 import pandas as pd
 import numpy as np
+import xarray as xr
 import shutil
+import json
+import multiprocessing
 import warnings
 warnings.filterwarnings('ignore')
 
 from zipfile import ZipFile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from rasterio.windows import Window
+from rasterio.transform import Affine
 from pyclimo.calc import celsius_to_fahrenheit, mm_to_in
+from pyclimo.cache import retrieve_prism_file, register_cached_asset, touch_cached_asset, delete_cached_file, get_connection, manifest_lock
+from pyclimo.backends import get_backend
+from pyclimo.coords import get_region_info
 
 def extract_zipped_files(file_path, extraction_folder):
 
@@ -42,15 +50,643 @@ def extract_zipped_files(file_path, extraction_folder):
     zObject.close()
 
 
-def get_geotiff_data(dtype, variable, year, month, day, normal_type, clear_data_in_folder, to_fahrenheit, to_inches):
+def get_zipped_geotiff_path(file_path, geotif):
+
+    """
+    This function returns the GDAL virtual file system path of a GeoTiff (.tif) file inside a zip file.
+    Rasterio can open this path directly so the zip file does not need to be extracted to disk. 
+
+    Required Arguments:
+
+    1) file_path (String) - The path to the zip file.
+
+    2) geotif (String) - The file name of the GeoTiff (.tif) file inside the zip file.
+
+    Returns: The /vsizip/ path to the GeoTiff file
+    """
+
+    return f"/vsizip/{os.path.abspath(file_path)}/{geotif}"
+
+
+def get_prism_file_info(dtype, variable, year, month, day, normal_type):
+
+    """
+    This function returns the location and file names of a PRISM dataset on the PRISM Climate Group server.
+
+    Required Arguments:
+
+    1) dtype (String) - Data Type: Daily, Monthly, Normals
+
+    2) variable (String) - The variable to analyze (i.e. 'tmax').
+
+    3) year (String) - Year
+
+    4) month (String) - 2 digit abbreviation for month (MM)
+
+    5) day (String) - For daily data only - 2 digit abbreviation for day (DD)
+
+    6) normal_type (String) - Daily or Monthly normals.
+
+    Returns
+    -------
+
+    1) The location of the folder holding the zip file on the active backend (see backends.get_backend)
+    2) The file name of the zip file
+    3) The file name of the GeoTiff (.tif) file inside the zip file
+    4) The date of the data used in the cache key
+    5) The normal type used in the cache key (None for daily and monthly data)
+    """
+
+    variable = variable.lower()
+    normal_type = normal_type.lower()
+
+    if dtype == 'Daily' or dtype == 'daily':
+        url = get_backend().prism_location(f"time_series/us/an/4km/{variable}/daily/{year}")
+        fname = f"prism_{variable}_us_25m_{year}{month}{day}.zip"
+        geotif = f"prism_{variable}_us_25m_{year}{month}{day}.tif"
+        date = f"{year}{month}{day}"
+        cache_normal_type = None
+
+    if dtype == 'Monthly' or dtype == 'monthly':
+        url = get_backend().prism_location(f"time_series/us/an/4km/{variable}/monthly/{year}")
+        fname = f"prism_{variable}_us_25m_{year}{month}.zip"
+        geotif = f"prism_{variable}_us_25m_{year}{month}.tif"
+        date = f"{year}{month}"
+        cache_normal_type = None
+
+    if dtype == 'Normals' or dtype == 'normals':
+        url = get_backend().prism_location(f"normals/us/4km/{variable}/{normal_type}")
+        if normal_type == 'monthly':
+            fname = f"prism_{variable}_us_25m_2020{month}_avg_30y.zip"
+            geotif = f"prism_{variable}_us_25m_2020{month}_avg_30y.tif"
+            date = f"{month}"
+        if normal_type == 'daily':
+            fname = f"prism_{variable}_us_25m_2020{month}{day}_avg_30y.zip"
+            geotif = f"prism_{variable}_us_25m_2020{month}{day}_avg_30y.tif"
+            date = f"{month}{day}"
+        cache_normal_type = normal_type
+
+    return url, fname, geotif, date, cache_normal_type
+
+
+def get_transform_coordinates(transform, height, width):
+
+    """
+    This function returns the 1-D longitude and latitude coordinates of a north-up raster from its affine transform.
+    The coordinates are the upper-left corners of the pixels, which is the same convention the DataFrame view has always used. 
+
+    Required Arguments:
+
+    1) transform (Affine) - The affine transform of the raster.
+
+    2) height (Integer) - The number of rows in the raster.
+
+    3) width (Integer) - The number of columns in the raster.
+
+    Returns
+    -------
+
+    1) A 1-D array of longitudes (one per column)
+    2) A 1-D array of latitudes (one per row)
+    """
+
+    lon = transform.c + transform.a * np.arange(width)
+    lat = transform.f + transform.e * np.arange(height)
+
+    return lon, lat
+
+
+def convert_units(data, variable, to_fahrenheit, to_inches):
+
+    """
+    This function converts PRISM values from Celsius to Fahrenheit or from mm to inches.
+
+    Required Arguments:
+
+    1) data (Array, DataArray or Series) - The PRISM values.
+
+    2) variable (String) - The variable name (i.e. 'tmax').
+
+    3) to_fahrenheit (Boolean) - When set to True, temperature based parameters are converted to Fahrenheit.
+
+    4) to_inches (Boolean) - When set to True, precipitation is converted to inches.
+
+    Returns: The converted values
+    """
+
+    if variable == 'tmax' or variable == 'tmin' or variable == 'tdmean' or variable == 'tmin':
+        if to_fahrenheit == True:
+            data = celsius_to_fahrenheit(data)
+        else:
+            pass
+            
+    if variable == 'ppt':
+        if to_inches == True:
+            data = mm_to_in(data)
+        else:
+            pass
+
+    return data
+
+
+def get_window_from_bounds(transform, height, width, western_bound, eastern_bound, southern_bound, northern_bound):
+
+    """
+    This function returns the pixel window of a north-up raster that covers a set of coordinate bounds.
+    The window is rounded outward so every pixel inside the bounds is included. 
+
+    Required Arguments:
+
+    1) transform (Affine) - The affine transform of the raster.
+
+    2) height (Integer) - The number of rows in the raster.
+
+    3) width (Integer) - The number of columns in the raster.
+
+    4) western_bound (Float or Integer) - The western bound in decimal degrees.
+
+    5) eastern_bound (Float or Integer) - The eastern bound in decimal degrees.
+
+    6) southern_bound (Float or Integer) - The southern bound in decimal degrees.
+
+    7) northern_bound (Float or Integer) - The northern bound in decimal degrees.
+
+    Returns: A rasterio Window clipped to the raster
+    """
+
+    col_start, row_start = ~transform * (western_bound, northern_bound)
+    col_stop, row_stop = ~transform * (eastern_bound, southern_bound)
+
+    col_start = min(max(int(np.floor(col_start)), 0), width)
+    row_start = min(max(int(np.floor(row_start)), 0), height)
+    col_stop = min(max(int(np.ceil(col_stop)) + 1, col_start), width)
+    row_stop = min(max(int(np.ceil(row_stop)) + 1, row_start), height)
+
+    return Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+
+def read_geotiff_dataarray(geotif_path, variable, western_bound=None, eastern_bound=None, southern_bound=None, northern_bound=None):
+
+    """
+    This function reads a PRISM GeoTiff (.tif) file into a 2-D xarray data array. 
+
+    Required Arguments:
+
+    1) geotif_path (String) - The path to the GeoTiff file. A /vsizip/ path to a GeoTiff inside a zip file is also accepted. 
+
+    2) variable (String) - The variable name (i.e. 'tmax'). This is used as the name of the data array. 
+
+    Optional Arguments:
+
+    1) western_bound (Float or Integer) - Default = None. The western bound in decimal degrees.
+
+    2) eastern_bound (Float or Integer) - Default = None. The eastern bound in decimal degrees.
+
+    3) southern_bound (Float or Integer) - Default = None. The southern bound in decimal degrees.
+
+    4) northern_bound (Float or Integer) - Default = None. The northern bound in decimal degrees.
+
+    When all four bounds are passed in, only the pixel window covering the bounds is read and decoded. 
+    When any bound is None, the whole grid is read. 
+
+    Returns: A 2-D float32 xarray data array (lat, lon) (the native dtype of PRISM GeoTiffs) with the nodata pixels set to NaN.
+             The affine transform of the grid is kept in the 'transform' attribute.
+    """
+
+    with rio.open(geotif_path) as src:
+        if western_bound == None or eastern_bound == None or southern_bound == None or northern_bound == None:
+            data = src.read(1)  
+            transform = src.transform
+        else:
+            window = get_window_from_bounds(src.transform, src.height, src.width, western_bound, eastern_bound, southern_bound, northern_bound)
+            if window.width > 0 and window.height > 0:
+                data = src.read(1, window=window)
+            else:
+                data = np.empty((int(window.height), int(window.width)), dtype=src.dtypes[0])
+            transform = src.window_transform(window)
+        nodata = src.nodata
+
+    if nodata == None:
+        nodata = -9999
+
+    data = data.astype('float32', copy=False)
+    data[data == nodata] = np.nan
+
+    height, width = data.shape
+    lon, lat = get_transform_coordinates(transform, height, width)
+
+    da = xr.DataArray(data, coords={'lat':lat, 'lon':lon}, dims=('lat', 'lon'), name=variable)
+    da.attrs['transform'] = tuple(transform)[:6]
+
+    return da
+
+
+def prism_dataarray_to_dataframe(da, dropna=True):
+
+    """
+    This function converts a 2-D PRISM data array into the flat Pandas DataFrame view used by the plotting functions.
+    The longitude and latitude of each row are only generated for the pixels that end up in the DataFrame. 
+
+    Required Arguments:
+
+    1) da (DataArray) - A 2-D (lat, lon) PRISM data array.
+
+    Optional Arguments:
+
+    1) dropna (Boolean) - Default = True. When set to True, the nodata pixels are left out of the DataFrame.
+       When set to False, the DataFrame holds one row per pixel with NaN for the nodata pixels. 
+
+    Returns: A float32 Pandas DataFrame with the columns [variable, 'longitude', 'latitude']
+    """
+
+    lon = da['lon'].values.astype('float32')
+    lat = da['lat'].values.astype('float32')
+    values = da.values
+
+    if dropna == True:
+        rows, cols = np.nonzero(~np.isnan(values))
+        df_data = pd.DataFrame({
+            f'{da.name}': values[rows, cols],
+            f'longitude': lon[cols],
+            f'latitude': lat[rows]
+        })
+    else:
+        df_data = pd.DataFrame({
+            f'{da.name}': values.ravel(),
+            f'longitude': np.tile(lon, len(lat)),
+            f'latitude': np.repeat(lat, len(lon))
+        })
+
+    return df_data
+
+
+overview_factors = [2, 4, 8]
+
+native_resolution = 1 / 24
+
+def block_average(values, factor):
+
+    """
+    This function averages a 2-D grid over blocks of factor x factor pixels. Nodata (NaN) pixels are left out of each block mean
+    and a block is only NaN when none of its pixels are valid. The edge blocks are padded with NaN.
+
+    Required Arguments:
+
+    1) values (Array) - The 2-D grid values.
+
+    2) factor (Integer) - The number of native pixels along each side of a block (i.e. 2 for 8 km from the 4 km grid).
+
+    Returns: A 2-D float32 array of the block means
+    """
+
+    height, width = values.shape
+    rows = -(-height // factor)
+    cols = -(-width // factor)
+
+    padded = np.full((rows * factor, cols * factor), np.nan, dtype='float32')
+    padded[:height, :width] = values
+    blocks = padded.reshape(rows, factor, cols, factor)
+
+    valid = np.isfinite(blocks)
+    total = np.where(valid, blocks, 0).sum(axis=(1, 3), dtype='float64')
+    count = valid.sum(axis=(1, 3))
+
+    return np.divide(total, count, out=np.full((rows, cols), np.nan), where=count > 0).astype('float32')
+
+
+def build_prism_overviews(zip_path, geotif, variable):
+
+    """
+    This function builds the block-averaged overview levels (8, 16 and 32 km) of a PRISM grid and caches them
+    next to the zip file as .npy files with a .json file holding the transform of each level.
+    The overviews are registered in the cache manifest as sidecars of the zip file, so they are evicted with it.
+
+    Required Arguments:
+
+    1) zip_path (String) - The path to the cached zip file.
+
+    2) geotif (String) - The file name of the GeoTiff (.tif) file inside the zip file.
+
+    3) variable (String) - The variable name (i.e. 'tmax').
+
+    Returns: The overview files f:{zip_path}.{factor}x.npy for each factor in overview_factors
+    """
+
+    da = read_geotiff_dataarray(get_zipped_geotiff_path(zip_path, geotif), variable)
+    transform = Affine(*da.attrs['transform'])
+
+    for factor in overview_factors:
+        values = block_average(da.values, factor)
+        with open(f"{zip_path}.{factor}x.json", 'w') as f:
+            json.dump({'transform':list(transform * Affine.scale(factor))[:6]}, f)
+        np.save(f"{zip_path}.{factor}x.tmp.npy", values)
+        os.replace(f"{zip_path}.{factor}x.tmp.npy", f"{zip_path}.{factor}x.npy")
+        register_cached_asset(f"overview/{os.path.basename(zip_path)}/{factor}x", f"{zip_path}.{factor}x.npy", zip_path, 'overview', variable, os.path.basename(zip_path), resolution=f"{factor}x", checksum=False)
+
+
+def read_prism_overview(zip_path, geotif, variable, factor, western_bound=None, eastern_bound=None, southern_bound=None, northern_bound=None):
+
+    """
+    This function reads an overview level of a PRISM grid into a 2-D xarray data array. 
+    The overview levels are built the first time any of them is requested.
+
+    Required Arguments:
+
+    1) zip_path (String) - The path to the cached zip file.
+
+    2) geotif (String) - The file name of the GeoTiff (.tif) file inside the zip file.
+
+    3) variable (String) - The variable name (i.e. 'tmax').
+
+    4) factor (Integer) - The overview factor (2 = 8 km, 4 = 16 km, 8 = 32 km).
+
+    Optional Arguments: western_bound, eastern_bound, southern_bound, northern_bound (Float or Integer) - Default = None.
+    Only the pixel window covering the bounds is read when all four bounds are passed in.
+
+    Returns: A 2-D float32 xarray data array (lat, lon) with a 'transform' attribute
+    """
+
+    if factor not in overview_factors:
+        raise ValueError(f"{factor} is not a valid overview factor. Valid factors: {overview_factors}")
+
+    if os.path.exists(f"{zip_path}.{factor}x.npy") and os.path.exists(f"{zip_path}.{factor}x.json"):
+        touch_cached_asset(f"{zip_path}.{factor}x.npy")
+    else:
+        build_prism_overviews(zip_path, geotif, variable)
+
+    values = np.load(f"{zip_path}.{factor}x.npy", mmap_mode='r')
+    with open(f"{zip_path}.{factor}x.json", 'r') as f:
+        transform = Affine(*json.load(f)['transform'][:6])
+
+    if western_bound == None or eastern_bound == None or southern_bound == None or northern_bound == None:
+        pass
+    else:
+        window = get_window_from_bounds(transform, values.shape[0], values.shape[1], western_bound, eastern_bound, southern_bound, northern_bound)
+        (row_start, row_stop), (col_start, col_stop) = window.toranges()
+        values = values[row_start:row_stop, col_start:col_stop]
+        transform = transform * Affine.translation(col_start, row_start)
+
+    values = np.array(values)
+    lon, lat = get_transform_coordinates(transform, values.shape[0], values.shape[1])
+
+    da = xr.DataArray(values, coords={'lat':lat, 'lon':lon}, dims=('lat', 'lon'), name=variable)
+    da.attrs['transform'] = tuple(transform)[:6]
+
+    return da
+
+
+def select_overview_factor(western_bound, eastern_bound, output_width):
+
+    """
+    This function returns the coarsest overview factor that still has at least one grid pixel per output pixel
+    across the requested extent.
+
+    Required Arguments:
+
+    1) western_bound (Float, Integer or None) - The western bound in decimal degrees. None = the whole PRISM grid.
+
+    2) eastern_bound (Float, Integer or None) - The eastern bound in decimal degrees. None = the whole PRISM grid.
+
+    3) output_width (Integer) - The width of the map in output pixels.
+
+    Returns: The overview factor (1 = the native 4 km grid)
+    """
+
+    if western_bound == None or eastern_bound == None:
+        western_bound = -125.0208333
+        eastern_bound = -66.4791667
+
+    extent = abs(eastern_bound - western_bound)
+
+    factor = 1
+    for level in overview_factors:
+        if extent / (native_resolution * level) >= output_width:
+            factor = level
+
+    return factor
+
+
+class CompactGrid:
+
+    """
+    This class holds a PRISM grid in a compact form:
+
+    1) The values as a float32 array
+    2) The validity (not nodata) mask packed 8 pixels per byte
+    3) The affine transform, from which the longitude and latitude are generated on demand
+
+    A CONUS 4km grid takes about 3.6 MB this way, against about 34 MB for the flat float64 DataFrame view. 
+    """
+
+    def __init__(self, values, packed_mask, transform, name, attrs=None):
+
+        self.values = values
+        self.packed_mask = packed_mask
+        self.transform = transform
+        self.name = name
+        if attrs == None:
+            attrs = {}
+        self.attrs = attrs
+
+    @classmethod
+    def from_dataarray(cls, da):
+
+        """
+        This function builds a compact grid from a 2-D PRISM data array.
+
+        Required Arguments:
+
+        1) da (DataArray) - A 2-D (lat, lon) PRISM data array with a 'transform' attribute.
+
+        Returns: A CompactGrid
+        """
+
+        values = np.asarray(da.values, dtype='float32')
+        packed_mask = np.packbits(~np.isnan(values), axis=None)
+        transform = Affine(*da.attrs['transform'][:6])
+
+        return cls(values, packed_mask, transform, da.name, attrs=dict(da.attrs))
+
+    @property
+    def shape(self):
+
+        return self.values.shape
+
+    @property
+    def mask(self):
+
+        """
+        The unpacked validity mask (True = valid pixel)
+        """
+
+        return np.unpackbits(self.packed_mask, count=self.values.size).reshape(self.values.shape).astype(bool)
+
+    def coordinates(self):
+
+        """
+        This function generates the 1-D longitude and latitude coordinates of the grid from the affine transform. 
+
+        Returns
+        -------
+
+        1) A 1-D float32 array of longitudes (one per column)
+        2) A 1-D float32 array of latitudes (one per row)
+        """
+
+        height, width = self.values.shape
+        lon, lat = get_transform_coordinates(self.transform, height, width)
+
+        return lon.astype('float32'), lat.astype('float32')
+
+    def to_dataarray(self):
+
+        """
+        This function returns the grid as a 2-D (lat, lon) xarray data array. The values are shared, not copied.
+        """
+
+        lon, lat = self.coordinates()
+
+        return xr.DataArray(self.values, coords={'lat':lat, 'lon':lon}, dims=('lat', 'lon'), name=self.name, attrs=self.attrs)
+
+    def to_dataframe(self):
+
+        """
+        This function returns the valid pixels of the grid as the flat Pandas DataFrame view used by the plotting functions. 
+        """
+
+        lon, lat = self.coordinates()
+        rows, cols = np.nonzero(self.mask)
+
+        df_data = pd.DataFrame({
+            f'{self.name}': self.values[rows, cols],
+            f'longitude': lon[cols],
+            f'latitude': lat[rows]
+        })
+
+        return df_data
+
+
+def get_prism_dataarray(dtype, variable, year, month, day, normal_type, clear_data_in_folder=False, to_fahrenheit=False, to_inches=False, use_cache=True, extract_files=False, western_bound=None, eastern_bound=None, southern_bound=None, northern_bound=None, region=None, overview=1):
+
+    """
+    This function downloads PRISM Climate Data and returns it as a 2-D xarray data array. 
+
+    Unlike get_geotiff_data, the data is never flattened: the values stay in the native dtype of the GeoTiff (.tif) file
+    and the longitude and latitude are 1-D coordinates taken from the affine transform. 
+
+    Required Arguments:
+
+    1) dtype (String) - Data Type: Daily, Monthly, Normals
+       - Daily = Daily Data
+       - Monthly = Monthly Data
+       - Normals = 30-Year Climate Normals
+
+    2) variable (String) - The variable to analyze (i.e. 'tmax'). See get_geotiff_data for the list of variables. 
+
+    3) year (String) - Year
+
+    4) month (String) - 2 digit abbreviation for month (MM)
+
+    5) day (String) - For daily data only - 2 digit abbreviation for day (DD)
+
+    6) normal_type (String) - Daily or Monthly normals. 
+
+    Optional Arguments:
+
+    1) clear_data_in_folder (Boolean) - Default = False. When set to True, the user will clear all old data in the f:PRISM Data folder. 
+
+    2) to_fahrenheit (Boolean) - Default = False. When set to True, temperature based parameters are converted to Fahrenheit. 
+
+    3) to_inches (Boolean) - Default = False. When set to True, precipitation is converted to inches. 
+
+    4) use_cache (Boolean) - Default = True. When set to True, the zip file is served from the f:PRISM Cache folder if it
+       was downloaded before and newly downloaded zip files are stored there.
+
+    5) extract_files (Boolean) - Default = False. When set to True, the contents of the zip file are extracted to the f:PRISM Data folder 
+       before the GeoTiff (.tif) file is read. 
+
+    6) western_bound (Float or Integer) - Default = None. The western bound in decimal degrees.
+
+    7) eastern_bound (Float or Integer) - Default = None. The eastern bound in decimal degrees.
+
+    8) southern_bound (Float or Integer) - Default = None. The southern bound in decimal degrees.
+
+    9) northern_bound (Float or Integer) - Default = None. The northern bound in decimal degrees.
+
+    10) region (String) - Default = None. A region abbreviation from coords.get_region_info (i.e. 'CA'). 
+        The bounds of the region are used when the bounds above are None. 
+
+    11) overview (Integer) - Default = 1. The resolution level of the grid. 1 = the native 4 km grid.
+        2, 4 and 8 = the block-averaged 8, 16 and 32 km overviews, built once and cached next to the zip file.
+        See select_overview_factor for picking the coarsest level that suits a map. 
+
+    When bounds (or a region) are passed in, only the pixel window covering the bounds is read and decoded. 
+
+    Returns: A 2-D xarray data array (lat, lon) of PRISM Climate Data with the nodata pixels set to NaN
+    """
+
+    variable = variable.lower()
+    normal_type = normal_type.lower()
+
+    if os.path.exists(f"PRISM Data"):
+        pass
+    else:
+        os.mkdir(f"PRISM Data")
+
+    if clear_data_in_folder == True:
+        for folder in os.listdir(f"PRISM Data"):
+            shutil.rmtree(f"PRISM Data/{folder}")
+    else:
+        pass
+
+    if region != None and western_bound == None and eastern_bound == None and southern_bound == None and northern_bound == None:
+        western_bound, eastern_bound, southern_bound, northern_bound = get_region_info(region)[:4]
+    else:
+        pass
+
+    url, fname, geotif, date, cache_normal_type = get_prism_file_info(dtype, variable, year, month, day, normal_type)
+
+    zip_path = retrieve_prism_file(f"{url}/{fname}", fname, dtype, variable, date, cache_normal_type, '4km', use_cache=use_cache)
+
+    if overview != 1:
+        da = read_prism_overview(zip_path, geotif, variable, overview, western_bound=western_bound, eastern_bound=eastern_bound, southern_bound=southern_bound, northern_bound=northern_bound)
+    else:
+        if extract_files == True:
+            extract_zipped_files(zip_path, f"PRISM Data/{fname}")
+            geotif_path = f"PRISM Data/{fname}/{geotif}"
+        else:
+            geotif_path = get_zipped_geotiff_path(zip_path, geotif)
+
+        da = read_geotiff_dataarray(geotif_path, variable, western_bound=western_bound, eastern_bound=eastern_bound, southern_bound=southern_bound, northern_bound=northern_bound)
+
+    if use_cache == False:
+        # The zip file and its overviews are removed along with the manifest rows of the overviews
+        connection = get_connection()
+        with manifest_lock:
+            delete_cached_file(connection, zip_path)
+    else:
+        pass
+
+    attrs = da.attrs
+    da = convert_units(da, variable, to_fahrenheit, to_inches)
+    da.name = variable
+    da.attrs = attrs
+
+    return da
+
+
+def get_geotiff_data(dtype, variable, year, month, day, normal_type, clear_data_in_folder, to_fahrenheit, to_inches, use_cache=True, extract_files=False, western_bound=None, eastern_bound=None, southern_bound=None, northern_bound=None, overview=1):
 
     """
     This function does the following actions:
 
     1) Builds the data directory if it does not exist yet. 
     2) Downloads the zipped folder holding climate data from the PRISM Climate Group FTP Server
-    3) Unzips the zip file and extracts the contents to an extraction folder
+       (or serves it from the f:PRISM Cache folder if it was downloaded before)
+    3) Reads the GeoTiff (.tif) file straight out of the zip file 
+       (or unzips the zip file and extracts the contents to an extraction folder if extract_files=True)
     4) Extracts the data from the GeoTiff (.tif) file and converts the data to a Pandas DataFrame
+       (see get_prism_dataarray for the 2-D xarray data array this DataFrame is a view of)
 
     Required Arguments:
 
@@ -89,161 +725,329 @@ def get_geotiff_data(dtype, variable, year, month, day, normal_type, clear_data_
     9) to_inches (Boolean) - When set to True, if the user is plotting precipitation, the values will convert to inches. 
        When set to False, the values will remain in mm. 
 
-    Returns: A Pandas DataFrame of PRISM Climate Data
+    Optional Arguments:
+
+    1) use_cache (Boolean) - Default = True. When set to True, the zip file is served from the f:PRISM Cache folder if it
+       was downloaded before and newly downloaded zip files are stored there. The f:PRISM Cache folder is not affected by clear_data_in_folder.
+       When set to False, the zip file is always downloaded and removed after the data is read. 
+
+    2) extract_files (Boolean) - Default = False. When set to False, the GeoTiff (.tif) file is read directly from the zip file
+       and nothing is extracted to disk. When set to True, the contents of the zip file are extracted to the f:PRISM Data folder first. 
+
+    3) western_bound (Float or Integer) - Default = None. The western bound in decimal degrees.
+
+    4) eastern_bound (Float or Integer) - Default = None. The eastern bound in decimal degrees.
+
+    5) southern_bound (Float or Integer) - Default = None. The southern bound in decimal degrees.
+
+    6) northern_bound (Float or Integer) - Default = None. The northern bound in decimal degrees.
+
+    7) overview (Integer) - Default = 1. The resolution level of the grid. 1 = the native 4 km grid.
+       2, 4 and 8 = the block-averaged 8, 16 and 32 km overviews, built once and cached next to the zip file. 
+
+    When all four bounds are passed in, only the pixel window covering the bounds is read and decoded. 
+
+    Returns: A float32 Pandas DataFrame of PRISM Climate Data holding the valid (not nodata) pixels
     """
-    variable = variable.lower()
-    normal_type = normal_type.lower()
 
-    if os.path.exists(f"PRISM Data"):
-        pass
-    else:
-        os.mkdir(f"PRISM Data")
+    da = get_prism_dataarray(dtype, variable, year, month, day, normal_type, clear_data_in_folder=clear_data_in_folder, to_fahrenheit=to_fahrenheit, to_inches=to_inches, use_cache=use_cache, extract_files=extract_files, western_bound=western_bound, eastern_bound=eastern_bound, southern_bound=southern_bound, northern_bound=northern_bound, overview=overview)
 
-    if clear_data_in_folder == True:
-        for folder in os.listdir(f"PRISM Data"):
-            shutil.rmtree(f"PRISM Data/{folder}")
-    else:
-        pass
+    df_data = prism_dataarray_to_dataframe(da)
 
-    if dtype == 'Daily' or dtype == 'daily':
-        url_data = f"https://data.prism.oregonstate.edu/time_series/us/an/4km/{variable}/daily/{year}"
+    return df_data
 
-        fname_data = f"prism_{variable}_us_25m_{year}{month}{day}.zip"
-        geotif_data = f"prism_{variable}_us_25m_{year}{month}{day}.tif"
 
-        urllib.request.urlretrieve(f"{url_data}/{fname_data}", f"{fname_data}")
-    
-        extract_zipped_files(f"{fname_data}", f"PRISM Data/{fname_data}")
-        os.remove(f"{fname_data}")
+def download_prism_zip(dtype, variable, date):
 
-        with rio.open(f"PRISM Data/{fname_data}/{geotif_data}") as src:
-            data = src.read(1)  
-            transform = src.transform
+    """
+    This function downloads (or finds in the f:PRISM Cache folder) the zip file holding PRISM data for a single date. 
+
+    Required Arguments:
 
-        height, width = data.shape
-        cols, rows = np.meshgrid(np.arange(width), np.arange(height))
-        x, y = transform * (cols, rows)
+    1) dtype (String) - Data Type: Daily or Monthly
 
-        df = pd.DataFrame({
-            'x': x.flatten(),
-            'y': y.flatten(),
-            'value': data.flatten()
-        })
+    2) variable (String) - The variable name (i.e. 'tmax').
 
-        df_data = df.loc[:,['value', 'x', 'y']]
-        df_data = df_data.rename(columns={f'value':f'{variable.lower()}', f'x':f'longitude', f'y':f'latitude'})
+    3) date (datetime) - The date of the data. 
+
+    Returns
+    -------
+
+    1) The path to the cached zip file
+    2) The file name of the GeoTiff (.tif) file inside the zip file
+    """
 
-        df_data.replace(-9999, np.nan, inplace=True)
-        df_data.dropna()
+    year = date.strftime('%Y')
+    month = date.strftime('%m')
+    day = date.strftime('%d')
 
+    url, fname, geotif, key_date, cache_normal_type = get_prism_file_info(dtype, variable, year, month, day, '')
+
+    zip_path = retrieve_prism_file(f"{url}/{fname}", fname, dtype, variable, key_date, cache_normal_type, '4km')
+
+    return zip_path, geotif
+
+
+def decode_prism_zip(zip_path, geotif, variable, western_bound, eastern_bound, southern_bound, northern_bound):
+
+    """
+    This function decodes the GeoTiff (.tif) file inside a cached PRISM zip file into a 2-D xarray data array. 
+    It is a module level function so it can be sent to a process pool.
+
+    Required Arguments:
+
+    1) zip_path (String) - The path to the zip file.
+
+    2) geotif (String) - The file name of the GeoTiff (.tif) file inside the zip file.
+
+    3) variable (String) - The variable name (i.e. 'tmax').
+
+    4) western_bound (Float, Integer or None) - The western bound in decimal degrees.
+
+    5) eastern_bound (Float, Integer or None) - The eastern bound in decimal degrees.
+
+    6) southern_bound (Float, Integer or None) - The southern bound in decimal degrees.
+
+    7) northern_bound (Float, Integer or None) - The northern bound in decimal degrees.
+
+    Returns: A 2-D xarray data array (lat, lon)
+    """
+
+    return read_geotiff_dataarray(get_zipped_geotiff_path(zip_path, geotif), variable, western_bound=western_bound, eastern_bound=eastern_bound, southern_bound=southern_bound, northern_bound=northern_bound)
+
+
+def get_prism_dates(dtype, start_date, end_date):
+
+    """
+    This function returns the dates of every PRISM dataset in a period. 
+
+    Required Arguments:
+
+    1) dtype (String) - Data Type: Daily or Monthly
+
+    2) start_date (String) - The start date of the period in the 'YYYY-mm-dd' format. 
+
+    3) end_date (String) - The end date of the period in the 'YYYY-mm-dd' format. 
+
+    Returns: A list of dates (one per day for daily data and one per month for monthly data)
+    """
+
+    if dtype == 'Daily' or dtype == 'daily':
+        dates = pd.date_range(start_date, end_date, freq='D')
     if dtype == 'Monthly' or dtype == 'monthly':
-        url_data = f"https://data.prism.oregonstate.edu/time_series/us/an/4km/{variable}/monthly/{year}"
-        
-        fname_data = f"prism_{variable}_us_25m_{year}{month}.zip"
-        geotif_data = f"prism_{variable}_us_25m_{year}{month}.tif"
+        dates = pd.date_range(pd.Timestamp(start_date).replace(day=1), end_date, freq='MS')
 
-        urllib.request.urlretrieve(f"{url_data}/{fname_data}", f"{fname_data}")
-    
-        extract_zipped_files(f"{fname_data}", f"PRISM Data/{fname_data}")
-        os.remove(f"{fname_data}")
-    
-        with rio.open(f"PRISM Data/{fname_data}/{geotif_data}") as src:
-            data = src.read(1)  
-            transform = src.transform
+    return list(dates)
 
-        height, width = data.shape
-        cols, rows = np.meshgrid(np.arange(width), np.arange(height))
-        x, y = transform * (cols, rows)
 
-        df = pd.DataFrame({
-            'x': x.flatten(),
-            'y': y.flatten(),
-            'value': data.flatten()
-        })
+def get_prism_range(variable, start_date, end_date, dtype, to_fahrenheit=False, to_inches=False, western_bound=None, eastern_bound=None, southern_bound=None, northern_bound=None, region=None, max_download_workers=4, max_decode_workers=2):
 
-        df_data = df.loc[:,['value', 'x', 'y']]
-        df_data = df_data.rename(columns={f'value':f'{variable.lower()}', f'x':f'longitude', f'y':f'latitude'})
+    """
+    This function downloads and decodes PRISM Climate Data for every day (or month) in a period. 
 
-        df_data.replace(-9999, np.nan, inplace=True)
-        df_data.dropna()
-    
-    if dtype == 'Normals' or dtype == 'normals':
-        
-        url = f"https://data.prism.oregonstate.edu/normals/us/4km/{variable.lower()}/{normal_type.lower()}"
+    The downloads run concurrently in a thread pool and, as each download finishes, the GeoTiff (.tif) file is
+    decoded in a process pool. The zip files are stored in the f:PRISM Cache folder so a period that was fetched
+    before is served from disk. 
 
-        if normal_type == 'Monthly' or normal_type == 'monthly':
-            fname = f"prism_{variable}_us_25m_2020{month}_avg_30y.zip"
-            geotif = f"prism_{variable}_us_25m_2020{month}_avg_30y.tif"
-        if normal_type == 'Daily' or normal_type == 'daily':
-            fname = f"prism_{variable}_us_25m_2020{month}{day}_avg_30y.zip"
-            geotif = f"prism_{variable}_us_25m_2020{month}{day}_avg_30y.tif"
+    The decoding processes are started with the forkserver start method (spawn where forkserver is not available) rather than
+    by forking this process while the download threads are running. When max_decode_workers > 0, this function must be
+    called from inside an if __name__ == '__main__': block since the process pool starts new Python processes. 
 
-        urllib.request.urlretrieve(f"{url}/{fname}", f"{fname}")
-    
-        extract_zipped_files(f"{fname}", f"PRISM Data/{fname}")
-        os.remove(f"{fname}")
-    
-        with rio.open(f"PRISM Data/{fname}/{geotif}") as src:
-            data = src.read(1)  
-            transform = src.transform
+    Required Arguments:
 
-        height, width = data.shape
-        cols, rows = np.meshgrid(np.arange(width), np.arange(height))
-        x, y = transform * (cols, rows)
+    1) variable (String) - The variable to analyze (i.e. 'tmax'). See get_geotiff_data for the list of variables. 
 
-        df = pd.DataFrame({
-            'x': x.flatten(),
-            'y': y.flatten(),
-            'value': data.flatten()
-        })
+    2) start_date (String) - The start date of the period in the 'YYYY-mm-dd' format. 
+
+    3) end_date (String) - The end date of the period in the 'YYYY-mm-dd' format. 
 
-        df_data = df.loc[:,['value', 'x', 'y']]
-        df_data = df_data.rename(columns={f'value':f'{variable.lower()}', f'x':f'longitude', f'y':f'latitude'})
+    4) dtype (String) - Data Type: Daily or Monthly
+       Daily Data goes back to 1981
+       Monthly Data goes back to 1895
 
-        df_data.replace(-9999, np.nan, inplace=True)
-        df_data.dropna()
+    Optional Arguments:
 
-    if variable == 'tmax' or variable == 'tmin' or variable == 'tdmean' or variable == 'tmin':
-        if to_fahrenheit == True:
-            df_data[variable] = celsius_to_fahrenheit(df_data[variable])
+    1) to_fahrenheit (Boolean) - Default = False. When set to True, temperature based parameters are converted to Fahrenheit. 
+
+    2) to_inches (Boolean) - Default = False. When set to True, precipitation is converted to inches. 
+
+    3) western_bound (Float or Integer) - Default = None. The western bound in decimal degrees.
+
+    4) eastern_bound (Float or Integer) - Default = None. The eastern bound in decimal degrees.
+
+    5) southern_bound (Float or Integer) - Default = None. The southern bound in decimal degrees.
+
+    6) northern_bound (Float or Integer) - Default = None. The northern bound in decimal degrees.
+
+    7) region (String) - Default = None. A region abbreviation from coords.get_region_info (i.e. 'CA'). 
+       The bounds of the region are used when the bounds above are None. 
+
+    8) max_download_workers (Integer) - Default = 4. The maximum number of concurrent downloads. 
+
+    9) max_decode_workers (Integer) - Default = 2. The maximum number of processes decoding GeoTiff files. 
+       When set to 0, the GeoTiff files are decoded in the download threads instead. 
+
+    Returns: A 3-D xarray data array (time, lat, lon) of PRISM Climate Data in date order
+    """
+
+    variable = variable.lower()
+
+    if region != None and western_bound == None and eastern_bound == None and southern_bound == None and northern_bound == None:
+        western_bound, eastern_bound, southern_bound, northern_bound = get_region_info(region)[:4]
+    else:
+        pass
+
+    dates = get_prism_dates(dtype, start_date, end_date)
+    bounds = (western_bound, eastern_bound, southern_bound, northern_bound)
+
+    if max_decode_workers > 0:
+        # Forking a process whose download threads hold locks (i.e. in the SSL and GDAL libraries) can deadlock the child
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('forkserver')
         else:
-            pass
-            
-    if variable == 'ppt':
-        if to_inches == True:
-            df_data[variable] = mm_to_in(df_data[variable])
+            context = multiprocessing.get_context('spawn')
+        decode_pool = ProcessPoolExecutor(max_workers=max_decode_workers, mp_context=context)
+    else:
+        decode_pool = None
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_download_workers) as download_pool:
+            download_futures = {download_pool.submit(download_prism_zip, dtype, variable, date):i for i, date in enumerate(dates)}
+            decode_futures = [None] * len(dates)
+            for future in as_completed(download_futures):
+                zip_path, geotif = future.result()
+                i = download_futures[future]
+                if decode_pool != None:
+                    decode_futures[i] = decode_pool.submit(decode_prism_zip, zip_path, geotif, variable, *bounds)
+                else:
+                    decode_futures[i] = download_pool.submit(decode_prism_zip, zip_path, geotif, variable, *bounds)
+
+            grids = [future.result() for future in decode_futures]
+    finally:
+        if decode_pool != None:
+            decode_pool.shutdown()
         else:
             pass
 
-    return df_data
+    attrs = grids[0].attrs
+    da = xr.concat(grids, dim=pd.Index(dates, name='time'))
+    da = convert_units(da, variable, to_fahrenheit, to_inches)
+    da.name = variable
+    da.attrs = attrs
+
+    return da
+
+
+def get_prism_compact_grid(dtype, variable, year, month, day, normal_type, to_fahrenheit=False, to_inches=False, western_bound=None, eastern_bound=None, southern_bound=None, northern_bound=None, region=None):
+
+    """
+    This function downloads PRISM Climate Data and returns it as a CompactGrid (float32 values, a packed validity mask and
+    the affine transform). This is the smallest in-memory form of a PRISM grid. 
+
+    Required Arguments:
+
+    1) dtype (String) - Data Type: Daily, Monthly, Normals
 
+    2) variable (String) - The variable to analyze (i.e. 'tmax'). See get_geotiff_data for the list of variables. 
 
+    3) year (String) - Year
 
+    4) month (String) - 2 digit abbreviation for month (MM)
 
+    5) day (String) - For daily data only - 2 digit abbreviation for day (DD)
 
+    6) normal_type (String) - Daily or Monthly normals. 
+
+    Optional Arguments: to_fahrenheit, to_inches, western_bound, eastern_bound, southern_bound, northern_bound and region
+    are the same as in get_prism_dataarray. 
 
+    Returns: A CompactGrid of PRISM Climate Data
+    """
 
+    da = get_prism_dataarray(dtype, variable, year, month, day, normal_type, to_fahrenheit=to_fahrenheit, to_inches=to_inches, western_bound=western_bound, eastern_bound=eastern_bound, southern_bound=southern_bound, northern_bound=northern_bound, region=region)
 
+    return CompactGrid.from_dataarray(da)
 
 
+def get_prism_dataset(variables, dtype, year, month, day, normal_type, to_fahrenheit=False, to_inches=False, use_cache=True, western_bound=None, eastern_bound=None, southern_bound=None, northern_bound=None, region=None, max_workers=6):
 
+    """
+    This function downloads PRISM Climate Data for several variables on the same date and returns them as one xarray dataset. 
 
+    The zip files of every variable are fetched concurrently in a thread pool and the GeoTiff (.tif) files are read straight
+    out of the zip files. Every variable shares one latitude and longitude coordinate definition. 
 
+    Required Arguments:
 
+    1) variables (List) - The variables to analyze (i.e. ['tmax', 'tmin', 'tdmean', 'ppt', 'vpdmax', 'vpdmin']). 
+       See get_geotiff_data for the list of variables. 
 
+    2) dtype (String) - Data Type: Daily, Monthly, Normals
 
+    3) year (String) - Year
 
+    4) month (String) - 2 digit abbreviation for month (MM)
 
+    5) day (String) - For daily data only - 2 digit abbreviation for day (DD)
 
+    6) normal_type (String) - Daily or Monthly normals. 
 
+    Optional Arguments:
 
+    1) to_fahrenheit (Boolean) - Default = False. When set to True, temperature based parameters are converted to Fahrenheit. 
 
+    2) to_inches (Boolean) - Default = False. When set to True, precipitation is converted to inches. 
 
+    3) use_cache (Boolean) - Default = True. When set to True, the zip files are served from and stored in the f:PRISM Cache folder. 
 
+    4) western_bound (Float or Integer) - Default = None. The western bound in decimal degrees.
 
+    5) eastern_bound (Float or Integer) - Default = None. The eastern bound in decimal degrees.
 
+    6) southern_bound (Float or Integer) - Default = None. The southern bound in decimal degrees.
 
+    7) northern_bound (Float or Integer) - Default = None. The northern bound in decimal degrees.
 
+    8) region (String) - Default = None. A region abbreviation from coords.get_region_info (i.e. 'CA'). 
+       The bounds of the region are used when the bounds above are None. 
 
+    9) max_workers (Integer) - Default = 6. The maximum number of concurrent downloads. 
 
-            
+    Returns: An xarray dataset (lat, lon) with one data array per variable and a 'transform' attribute
+    """
+
+    variables = [variable.lower() for variable in variables]
+    normal_type = normal_type.lower()
+
+    if region != None and western_bound == None and eastern_bound == None and southern_bound == None and northern_bound == None:
+        western_bound, eastern_bound, southern_bound, northern_bound = get_region_info(region)[:4]
+    else:
+        pass
+
+    def fetch(variable):
+        url, fname, geotif, date, cache_normal_type = get_prism_file_info(dtype, variable, year, month, day, normal_type)
+        zip_path = retrieve_prism_file(f"{url}/{fname}", fname, dtype, variable, date, cache_normal_type, '4km', use_cache=use_cache)
+        da = read_geotiff_dataarray(get_zipped_geotiff_path(zip_path, geotif), variable, western_bound=western_bound, eastern_bound=eastern_bound, southern_bound=southern_bound, northern_bound=northern_bound)
+        if use_cache == False:
+            os.remove(zip_path)
+        else:
+            pass
+        return da
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(variables)))) as pool:
+        grids = list(pool.map(fetch, variables))
+
+    transform = grids[0].attrs['transform']
+    lat = grids[0]['lat']
+    lon = grids[0]['lon']
+
+    data_vars = {}
+    for variable, da in zip(variables, grids):
+        if da.shape != grids[0].shape or not np.allclose(da.attrs['transform'], transform):
+            raise ValueError(f"The {variable} grid is not on the same grid as the {variables[0]} grid.")
+        da = convert_units(da, variable, to_fahrenheit, to_inches)
+        data_vars[variable] = (('lat', 'lon'), da.values)
+
+    ds = xr.Dataset(data_vars, coords={'lat':lat, 'lon':lon}, attrs={'transform':transform})
+
+    return ds
@@ -0,0 +1,211 @@
+"""
+This file hosts all the functions responsible for sampling PRISM grids at point locations (i.e. RAWS or ASOS stations):
+    1) Computing the pixel index of every point once with the inverse affine transform
+    2) Caching that index for the most recently used grid definitions and lists of points
+    3) Gathering the values of every point for one or many dates in a single vectorized lookup
+
+    (C) Meteorologist Eric J. Drewitz
+
+"""
+
+import hashlib
+import threading
+import numpy as np
+import xarray as xr
+import warnings
+warnings.filterwarnings('ignore')
+
+from collections import OrderedDict
+from rasterio.transform import Affine
+from pyclimo.prism_data import get_prism_range, convert_units
+
+index_cache = OrderedDict()
+
+# The maximum number of indices kept in index_cache. The least recently used index is dropped first.
+max_cached_indices = 32
+
+index_cache_lock = threading.Lock()
+
+def get_pixel_index(transform, shape, latitudes, longitudes, method='nearest'):
+
+    """
+    This function returns the pixel indices (and weights) needed to sample a grid at a list of points.
+    The result is cached for each grid definition (transform and shape), list of points and method, so sampling
+    many grids on the same grid definition only computes the indices once. Only the max_cached_indices most recently
+    used indices are kept, so a long running process sampling changing lists of points does not grow without bound.
+
+    Required Arguments:
+
+    1) transform (Affine or Tuple) - The affine transform of the grid.
+
+    2) shape (Tuple) - The (rows, columns) shape of the grid.
+
+    3) latitudes (Array) - The latitudes of the points in decimal degrees.
+
+    4) longitudes (Array) - The longitudes of the points in decimal degrees.
+
+    Optional Arguments:
+
+    1) method (String) - Default = 'nearest'. 'nearest' uses the pixel each point falls in.
+       'bilinear' weights the 4 pixel centers around each point.
+
+    Returns
+    -------
+
+    1) The row indices (shape (n,) for 'nearest' and (4, n) for 'bilinear')
+    2) The column indices (same shape as the row indices)
+    3) The weights (same shape as the row indices)
+    4) A boolean array (n,) that is True for the points inside the grid
+    """
+
+    method = method.lower()
+    transform = Affine(*tuple(transform)[:6])
+    latitudes = np.asarray(latitudes, dtype='f8')
+    longitudes = np.asarray(longitudes, dtype='f8')
+
+    points_hash = hashlib.sha1(latitudes.tobytes() + longitudes.tobytes()).hexdigest()
+    key = (tuple(transform)[:6], tuple(shape), points_hash, method)
+
+    with index_cache_lock:
+        if key in index_cache:
+            index_cache.move_to_end(key)
+            return index_cache[key]
+
+    height, width = shape
+    cols, rows = ~transform * (longitudes, latitudes)
+
+    if method == 'nearest':
+        rows = np.floor(rows).astype('i8')
+        cols = np.floor(cols).astype('i8')
+        inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+        rows = np.clip(rows, 0, height - 1)
+        cols = np.clip(cols, 0, width - 1)
+        weights = np.ones(rows.shape, dtype='f4')
+
+    elif method == 'bilinear':
+        # Pixel values represent the pixel centers which sit half a pixel from the upper-left corners
+        rows = rows - 0.5
+        cols = cols - 0.5
+        row0 = np.floor(rows).astype('i8')
+        col0 = np.floor(cols).astype('i8')
+        dr = (rows - row0).astype('f4')
+        dc = (cols - col0).astype('f4')
+        inside = (row0 >= -1) & (row0 < height) & (col0 >= -1) & (col0 < width)
+
+        rows = np.clip(np.stack([row0, row0, row0 + 1, row0 + 1]), 0, height - 1)
+        cols = np.clip(np.stack([col0, col0 + 1, col0, col0 + 1]), 0, width - 1)
+        weights = np.stack([(1 - dr) * (1 - dc), (1 - dr) * dc, dr * (1 - dc), dr * dc])
+
+    else:
+        raise ValueError(f"{method} is not a valid method. Valid methods: 'nearest', 'bilinear'")
+
+    index = (rows, cols, weights, inside)
+
+    with index_cache_lock:
+        index_cache[key] = index
+        while len(index_cache) > max_cached_indices:
+            index_cache.popitem(last=False)
+
+    return index
+
+
+def sample_prism_points(da, latitudes, longitudes, method='nearest', station_ids=None):
+
+    """
+    This function samples a 2-D (lat, lon) or 3-D (time, lat, lon) PRISM data array at a list of points.
+    Every date is gathered in one vectorized lookup.
+
+    Required Arguments:
+
+    1) da (DataArray) - A PRISM data array with a 'transform' attribute (i.e. from get_prism_dataarray or get_prism_range).
+
+    2) latitudes (Array) - The latitudes of the points in decimal degrees.
+
+    3) longitudes (Array) - The longitudes of the points in decimal degrees.
+
+    Optional Arguments:
+
+    1) method (String) - Default = 'nearest'. 'nearest' or 'bilinear'. Bilinear interpolation skips nodata neighbors
+       and re-weights the remaining ones, so points near the coast still get a value.
+
+    2) station_ids (List) - Default = None. Names of the points used as the 'station' coordinate.
+       When set to None, the points are numbered from 0.
+
+    Returns: An xarray data array (station) or (time, station) of the sampled values. Points outside the grid are NaN.
+    """
+
+    values = da.values
+    rows, cols, weights, inside = get_pixel_index(da.attrs['transform'], values.shape[-2:], latitudes, longitudes, method=method)
+
+    if method.lower() == 'nearest':
+        samples = values[..., rows, cols]
+    else:
+        neighbors = values[..., rows, cols]
+        valid = np.isfinite(neighbors)
+        numerator = np.where(valid, neighbors * weights, 0).sum(axis=-2)
+        denominator = np.where(valid, weights, 0).sum(axis=-2)
+        samples = np.divide(numerator, denominator, out=np.full(numerator.shape, np.nan, dtype=numerator.dtype), where=denominator > 0)
+
+    samples = np.where(inside, samples, np.nan)
+
+    if station_ids is None:
+        station_ids = np.arange(len(inside))
+
+    dims = tuple(da.dims[:-2]) + ('station',)
+    coords = {dim:da[dim] for dim in da.dims[:-2]}
+    coords['station'] = station_ids
+    coords['latitude'] = ('station', np.asarray(latitudes, dtype='f8'))
+    coords['longitude'] = ('station', np.asarray(longitudes, dtype='f8'))
+
+    return xr.DataArray(samples, coords=coords, dims=dims, name=da.name)
+
+
+def get_prism_points(variable, start_date, end_date, latitudes, longitudes, dtype='daily', method='nearest', station_ids=None, to_fahrenheit=False, to_inches=False, max_download_workers=4, max_decode_workers=2):
+
+    """
+    This function downloads PRISM Climate Data for a period and samples it at a list of points.
+    Only the pixel window covering the points is decoded.
+
+    Required Arguments:
+
+    1) variable (String) - The variable name (i.e. 'tmax').
+
+    2) start_date (String) - The start date of the period in the 'YYYY-mm-dd' format.
+
+    3) end_date (String) - The end date of the period in the 'YYYY-mm-dd' format.
+
+    4) latitudes (Array) - The latitudes of the points in decimal degrees.
+
+    5) longitudes (Array) - The longitudes of the points in decimal degrees.
+
+    Optional Arguments:
+
+    1) dtype (String) - Default = 'daily'. Data Type: Daily or Monthly
+
+    2) method (String) - Default = 'nearest'. 'nearest' or 'bilinear'.
+
+    3) station_ids (List) - Default = None. Names of the points used as the 'station' coordinate.
+
+    4) to_fahrenheit (Boolean) - Default = False. When set to True, temperature based parameters are converted to Fahrenheit.
+
+    5) to_inches (Boolean) - Default = False. When set to True, precipitation is converted to inches.
+
+    6) max_download_workers (Integer) - Default = 4. The maximum number of concurrent downloads.
+
+    7) max_decode_workers (Integer) - Default = 2. The maximum number of processes decoding GeoTiff files.
+
+    Returns: An xarray data array (time, station) of the sampled values
+    """
+
+    latitudes = np.asarray(latitudes, dtype='f8')
+    longitudes = np.asarray(longitudes, dtype='f8')
+
+    # A margin of a few pixels keeps the bilinear neighbors of the edge points inside the window
+    margin = 0.25
+
+    da = get_prism_range(variable, start_date, end_date, dtype, western_bound=np.nanmin(longitudes) - margin, eastern_bound=np.nanmax(longitudes) + margin, southern_bound=np.nanmin(latitudes) - margin, northern_bound=np.nanmax(latitudes) + margin, max_download_workers=max_download_workers, max_decode_workers=max_decode_workers)
+
+    samples = sample_prism_points(da, latitudes, longitudes, method=method, station_ids=station_ids)
+    samples = convert_units(samples, variable.lower(), to_fahrenheit, to_inches)
+
+    return samples
@@ -0,0 +1,253 @@
+"""
+This file hosts all the functions responsible for streaming statistics over a period of PRISM data:
+    1) Iterating over the PRISM grids in a period one grid at a time (from live fetches or the cube store)
+    2) Feeding each grid into running accumulators (sum, count, min, max, mean and variance)
+    3) Returning the period statistic as a 2-D xarray data array
+
+    Only the accumulators and the current grid are held in memory, no matter how long the period is.
+
+    (C) Meteorologist Eric J. Drewitz
+
+"""
+
+import numpy as np
+import xarray as xr
+import warnings
+warnings.filterwarnings('ignore')
+
+from concurrent.futures import ThreadPoolExecutor
+from pyclimo.prism_data import get_prism_dates, download_prism_zip, decode_prism_zip, convert_units
+from pyclimo.prism_store import open_prism_store
+from pyclimo.coords import get_region_info
+
+class RunningStats:
+
+    """
+    This class holds running per-pixel accumulators for a stream of 2-D grids.
+
+    The mean and variance use Welford's algorithm so they stay accurate over long periods.
+    NaN (nodata) pixels are skipped, so the count of each pixel is the number of valid values it received.
+    """
+
+    def __init__(self):
+
+        self.count = None
+        self.total = None
+        self.mean = None
+        self.m2 = None
+        self.minimum = None
+        self.maximum = None
+        self.template = None
+
+    def update(self, da):
+
+        """
+        This function adds one 2-D grid to the accumulators.
+
+        Required Arguments:
+
+        1) da (DataArray) - A 2-D (lat, lon) PRISM data array. Every grid must be on the same grid as the first one.
+
+        Returns: None
+        """
+
+        values = da.values
+
+        if self.template is None:
+            self.template = da
+            self.count = np.zeros(values.shape, dtype='i4')
+            self.total = np.zeros(values.shape, dtype='f8')
+            self.mean = np.zeros(values.shape, dtype='f8')
+            self.m2 = np.zeros(values.shape, dtype='f8')
+            self.minimum = np.full(values.shape, np.nan, dtype=values.dtype)
+            self.maximum = np.full(values.shape, np.nan, dtype=values.dtype)
+
+        valid = np.isfinite(values)
+        self.count += valid
+
+        delta = np.where(valid, values - self.mean, 0)
+        self.total += np.where(valid, values, 0)
+        self.mean += np.divide(delta, self.count, out=np.zeros(values.shape, dtype='f8'), where=valid)
+        self.m2 += delta * np.where(valid, values - self.mean, 0)
+
+        np.fmin(self.minimum, values, out=self.minimum)
+        np.fmax(self.maximum, values, out=self.maximum)
+
+    def result(self, statistic):
+
+        """
+        This function returns a statistic of the grids added so far.
+
+        Required Arguments:
+
+        1) statistic (String) - 'sum', 'count', 'mean', 'min', 'max', 'variance' or 'std'.
+           The variance and standard deviation are the sample (n - 1) values.
+
+        Returns: A 2-D (lat, lon) xarray data array of the statistic
+        """
+
+        statistic = statistic.lower()
+
+        if self.template is None:
+            raise ValueError(f"No grids have been added yet.")
+
+        if statistic == 'sum':
+            values = np.where(self.count > 0, self.total, np.nan)
+        elif statistic == 'count':
+            values = self.count
+        elif statistic == 'mean':
+            values = np.where(self.count > 0, self.mean, np.nan)
+        elif statistic == 'min':
+            values = self.minimum
+        elif statistic == 'max':
+            values = self.maximum
+        elif statistic == 'variance' or statistic == 'std':
+            values = np.divide(self.m2, self.count - 1, out=np.full(self.m2.shape, np.nan), where=self.count > 1)
+            if statistic == 'std':
+                values = np.sqrt(values)
+        else:
+            raise ValueError(f"{statistic} is not a valid statistic. Valid statistics: 'sum', 'count', 'mean', 'min', 'max', 'variance', 'std'")
+
+        da = xr.DataArray(values, coords=self.template.coords, dims=self.template.dims, name=self.template.name, attrs=self.template.attrs)
+
+        return da
+
+
+def iter_prism_grids(variable, start_date, end_date, dtype='daily', source='fetch', western_bound=None, eastern_bound=None, southern_bound=None, northern_bound=None, region=None, max_download_workers=4):
+
+    """
+    This function is a generator that yields the PRISM grids in a period one at a time in date order.
+
+    Required Arguments:
+
+    1) variable (String) - The variable name (i.e. 'tmax').
+
+    2) start_date (String) - The start date of the period in the 'YYYY-mm-dd' format.
+
+    3) end_date (String) - The end date of the period in the 'YYYY-mm-dd' format.
+
+    Optional Arguments:
+
+    1) dtype (String) - Default = 'daily'. Data Type: Daily or Monthly
+
+    2) source (String) - Default = 'fetch'. Where the grids are read from:
+       - 'fetch' = The PRISM Climate Group server (or the f:PRISM Cache folder for zip files downloaded before).
+         Up to max_download_workers downloads run ahead of the grid being yielded.
+       - 'store' = The cube store in the f:PRISM Store folder (see prism_store.update_prism_store).
+
+    3) western_bound (Float or Integer) - Default = None. The western bound in decimal degrees.
+
+    4) eastern_bound (Float or Integer) - Default = None. The eastern bound in decimal degrees.
+
+    5) southern_bound (Float or Integer) - Default = None. The southern bound in decimal degrees.
+
+    6) northern_bound (Float or Integer) - Default = None. The northern bound in decimal degrees.
+
+    7) region (String) - Default = None. A region abbreviation from coords.get_region_info (i.e. 'CA').
+       The bounds of the region are used when the bounds above are None.
+
+    8) max_download_workers (Integer) - Default = 4. The maximum number of concurrent downloads when source='fetch'.
+
+    Yields: The date and the 2-D (lat, lon) xarray data array of each grid
+    """
+
+    variable = variable.lower()
+    source = source.lower()
+
+    if region != None and western_bound == None and eastern_bound == None and southern_bound == None and northern_bound == None:
+        western_bound, eastern_bound, southern_bound, northern_bound = get_region_info(region)[:4]
+    else:
+        pass
+
+    if source == 'store':
+        da = open_prism_store(variable, dtype, start_date=start_date, end_date=end_date, western_bound=western_bound, eastern_bound=eastern_bound, southern_bound=southern_bound, northern_bound=northern_bound)
+        for i in range(len(da['time'])):
+            grid = da.isel(time=i).load()
+            yield grid['time'].values, grid.drop_vars('time')
+
+    elif source == 'fetch':
+        dates = get_prism_dates(dtype, start_date, end_date)
+        with ThreadPoolExecutor(max_workers=max_download_workers) as pool:
+            futures = [pool.submit(download_prism_zip, dtype, variable, date) for date in dates[:max_download_workers]]
+            for i, date in enumerate(dates):
+                zip_path, geotif = futures[i].result()
+                futures[i] = None
+                if i + max_download_workers < len(dates):
+                    futures.append(pool.submit(download_prism_zip, dtype, variable, dates[i + max_download_workers]))
+                yield date, decode_prism_zip(zip_path, geotif, variable, western_bound, eastern_bound, southern_bound, northern_bound)
+
+    else:
+        raise ValueError(f"{source} is not a valid source. Valid sources: 'fetch', 'store'")
+
+
+def aggregate_prism_period(variable, start_date, end_date, statistic, dtype='daily', source='fetch', to_fahrenheit=False, to_inches=False, western_bound=None, eastern_bound=None, southern_bound=None, northern_bound=None, region=None, max_download_workers=4):
+
+    """
+    This function computes a period statistic of PRISM data (i.e. the 30-day precipitation total, the seasonal mean
+    maximum temperature or the monthly maximum of vpdmax) while holding only one grid in memory at a time.
+
+    Required Arguments:
+
+    1) variable (String) - The variable name (i.e. 'tmax').
+
+    2) start_date (String) - The start date of the period in the 'YYYY-mm-dd' format.
+
+    3) end_date (String) - The end date of the period in the 'YYYY-mm-dd' format.
+
+    4) statistic (String) - 'sum', 'count', 'mean', 'min', 'max', 'variance' or 'std'.
+
+    Optional Arguments:
+
+    1) dtype (String) - Default = 'daily'. Data Type: Daily or Monthly
+
+    2) source (String) - Default = 'fetch'. 'fetch' reads the grids from the PRISM Climate Group server (or the f:PRISM Cache folder).
+       'store' reads the grids from the cube store in the f:PRISM Store folder.
+
+    3) to_fahrenheit (Boolean) - Default = False. When set to True, temperature based statistics are converted to Fahrenheit.
+
+    4) to_inches (Boolean) - Default = False. When set to True, precipitation statistics are converted to inches.
+
+    5) western_bound (Float or Integer) - Default = None. The western bound in decimal degrees.
+
+    6) eastern_bound (Float or Integer) - Default = None. The eastern bound in decimal degrees.
+
+    7) southern_bound (Float or Integer) - Default = None. The southern bound in decimal degrees.
+
+    8) northern_bound (Float or Integer) - Default = None. The northern bound in decimal degrees.
+
+    9) region (String) - Default = None. A region abbreviation from coords.get_region_info (i.e. 'CA').
+
+    10) max_download_workers (Integer) - Default = 4. The maximum number of concurrent downloads when source='fetch'.
+
+    Returns: A 2-D (lat, lon) xarray data array of the period statistic
+    """
+
+    variable = variable.lower()
+    statistic = statistic.lower()
+
+    stats = RunningStats()
+
+    for date, da in iter_prism_grids(variable, start_date, end_date, dtype=dtype, source=source, western_bound=western_bound, eastern_bound=eastern_bound, southern_bound=southern_bound, northern_bound=northern_bound, region=region, max_download_workers=max_download_workers):
+        stats.update(da)
+
+    da = stats.result(statistic)
+
+    # The unit conversions are linear (scale * value + offset), so each statistic is converted with the matching rule
+    offset = convert_units(0.0, variable, to_fahrenheit, to_inches)
+    scale = convert_units(1.0, variable, to_fahrenheit, to_inches) - offset
+
+    attrs = da.attrs
+    if statistic == 'count':
+        pass
+    elif statistic == 'sum':
+        da = (da * scale) + (offset * stats.count)
+    elif statistic == 'variance':
+        da = da * (scale ** 2)
+    elif statistic == 'std':
+        da = da * scale
+    else:
+        da = convert_units(da, variable, to_fahrenheit, to_inches)
+    da.name = variable
+    da.attrs = attrs
+
+    return da
@@ -0,0 +1,298 @@
+"""
+This file hosts all the functions responsible for the PRISM time-series cube store:
+    1) Building a chunked and compressed (time, lat, lon) netCDF4 file per variable
+    2) Appending newly fetched days (or months) to the store
+    3) Lazily reading arbitrary time and space slices from the store
+
+    Each store lives in f:PRISM Store/{dtype}/{variable}.nc. The time dimension is unlimited so appending a
+    new day only writes the chunks of that day.
+
+    (C) Meteorologist Eric J. Drewitz
+
+"""
+
+import os
+import threading
+import netCDF4
+import numpy as np
+import pandas as pd
+import xarray as xr
+import warnings
+warnings.filterwarnings('ignore')
+
+from pyclimo.prism_data import get_prism_range, get_prism_dates, convert_units
+from pyclimo.coords import get_region_info
+from pyclimo.cache import register_cached_asset, touch_cached_asset
+
+store_directory = f"PRISM Store"
+
+time_units = f"days since 1895-01-01"
+
+store_lock = threading.Lock()
+
+def get_prism_store_path(dtype, variable):
+
+    """
+    This function returns the path of the cube store for a variable and builds the store directory if it does not exist yet.
+
+    Required Arguments:
+
+    1) dtype (String) - Data Type: Daily or Monthly
+
+    2) variable (String) - The variable name (i.e. 'tmax').
+
+    Returns: The path to the netCDF4 file of the store
+    """
+
+    dtype = dtype.lower()
+    variable = variable.lower()
+
+    if os.path.exists(f"{store_directory}/{dtype}"):
+        pass
+    else:
+        os.makedirs(f"{store_directory}/{dtype}", exist_ok=True)
+
+    return f"{store_directory}/{dtype}/{variable}.nc"
+
+
+def create_prism_store(path, da, time_chunk, spatial_chunk):
+
+    """
+    This function creates an empty cube store on the grid of a PRISM data array.
+
+    Required Arguments:
+
+    1) path (String) - The path to the netCDF4 file of the store.
+
+    2) da (DataArray) - A 2-D (lat, lon) PRISM data array on the full native grid.
+
+    3) time_chunk (Integer) - The number of time steps per chunk.
+
+    4) spatial_chunk (Integer) - The number of pixels along each side of a chunk.
+
+    Returns: The store is written to the path
+    """
+
+    nlat = len(da['lat'])
+    nlon = len(da['lon'])
+
+    with netCDF4.Dataset(f"{path}.tmp", 'w') as nc:
+        nc.createDimension('time', None)
+        nc.createDimension('lat', nlat)
+        nc.createDimension('lon', nlon)
+
+        time = nc.createVariable('time', 'f8', ('time',))
+        time.units = time_units
+        time.calendar = 'standard'
+
+        lat = nc.createVariable('lat', 'f8', ('lat',))
+        lat[:] = da['lat'].values
+        lon = nc.createVariable('lon', 'f8', ('lon',))
+        lon[:] = da['lon'].values
+
+        var = nc.createVariable(da.name, da.dtype, ('time', 'lat', 'lon'), zlib=True, complevel=4, shuffle=True,
+                                chunksizes=(time_chunk, min(spatial_chunk, nlat), min(spatial_chunk, nlon)), fill_value=np.nan)
+        var.transform = np.array(da.attrs['transform'], dtype='f8')
+
+    os.replace(f"{path}.tmp", path)
+
+
+def get_store_dates(dtype, variable):
+
+    """
+    This function returns the dates already held in the cube store of a variable.
+
+    Required Arguments:
+
+    1) dtype (String) - Data Type: Daily or Monthly
+
+    2) variable (String) - The variable name (i.e. 'tmax').
+
+    Returns: A set of the dates (pandas Timestamps) in the store. The set is empty if the store does not exist yet.
+    """
+
+    path = get_prism_store_path(dtype, variable)
+
+    if os.path.exists(path):
+        with netCDF4.Dataset(path, 'r') as nc:
+            values = nc['time'][:]
+            if len(values) == 0:
+                return set()
+            times = netCDF4.num2date(values, time_units, only_use_cftime_datetimes=False, only_use_python_datetimes=True)
+        return set(pd.Timestamp(t) for t in times)
+    else:
+        return set()
+
+
+def append_to_prism_store(da, dtype, date, time_chunk=1, spatial_chunk=256):
+
+    """
+    This function appends a 2-D PRISM grid to the cube store of its variable. If the date is already in the store,
+    the grid for that date is overwritten.
+
+    Required Arguments:
+
+    1) da (DataArray) - A 2-D (lat, lon) PRISM data array on the full native grid (no bounds) in the native units.
+
+    2) dtype (String) - Data Type: Daily or Monthly
+
+    3) date (String or datetime) - The date of the grid.
+
+    Optional Arguments:
+
+    1) time_chunk (Integer) - Default = 1. The number of time steps per chunk. Only used when the store is created.
+       With time_chunk=1 appending a day only writes the chunks of that day.
+
+    2) spatial_chunk (Integer) - Default = 256. The number of pixels along each side of a chunk. Only used when the store is created.
+
+    Returns: The grid is written to f:PRISM Store/{dtype}/{variable}.nc
+             (the store is registered in the cache manifest by update_prism_store)
+    """
+
+    path = get_prism_store_path(dtype, da.name)
+    value = netCDF4.date2num(pd.Timestamp(date).to_pydatetime(), time_units, calendar='standard')
+
+    with store_lock:
+        if os.path.exists(path):
+            pass
+        else:
+            create_prism_store(path, da, time_chunk, spatial_chunk)
+
+        with netCDF4.Dataset(path, 'a') as nc:
+            if nc.dimensions['lat'].size != da.shape[0] or nc.dimensions['lon'].size != da.shape[1]:
+                raise ValueError(f"The grid of {da.name} does not match the grid of the store. Only full grids can be appended.")
+
+            times = nc['time'][:]
+            index = np.where(times == value)[0]
+            if len(index) > 0:
+                i = int(index[0])
+            else:
+                i = len(times)
+                nc['time'][i] = value
+
+            nc[da.name][i, :, :] = da.values
+
+
+def update_prism_store(variable, start_date, end_date, dtype, max_download_workers=4, max_decode_workers=2, batch_size=31):
+
+    """
+    This function fetches every date in a period that is not in the cube store yet and appends it to the store.
+
+    Required Arguments:
+
+    1) variable (String) - The variable name (i.e. 'tmax').
+
+    2) start_date (String) - The start date of the period in the 'YYYY-mm-dd' format.
+
+    3) end_date (String) - The end date of the period in the 'YYYY-mm-dd' format.
+
+    4) dtype (String) - Data Type: Daily or Monthly
+
+    Optional Arguments:
+
+    1) max_download_workers (Integer) - Default = 4. The maximum number of concurrent downloads.
+
+    2) max_decode_workers (Integer) - Default = 2. The maximum number of processes decoding GeoTiff files.
+
+    3) batch_size (Integer) - Default = 31. The maximum number of dates fetched and held in memory at a time.
+       Memory use is about twice batch_size grids however long the period is, so a multi-year backfill stays bounded.
+
+    Returns: The missing dates are written to f:PRISM Store/{dtype}/{variable}.nc
+    """
+
+    variable = variable.lower()
+
+    stored = get_store_dates(dtype, variable)
+    missing = [date for date in get_prism_dates(dtype, start_date, end_date) if date not in stored]
+
+    # Fetch the missing dates in contiguous runs of at most batch_size dates so each run is one parallel get_prism_range call
+    if dtype == 'Daily' or dtype == 'daily':
+        step = 1
+    else:
+        step = 31
+
+    runs = []
+    for date in missing:
+        if len(runs) > 0 and (date - runs[-1][-1]).days <= step and len(runs[-1]) < batch_size:
+            runs[-1].append(date)
+        else:
+            runs.append([date])
+
+    path = get_prism_store_path(dtype, variable)
+
+    try:
+        for run in runs:
+            da = get_prism_range(variable, run[0].strftime('%Y-%m-%d'), run[-1].strftime('%Y-%m-%d'), dtype, max_download_workers=max_download_workers, max_decode_workers=max_decode_workers)
+            for date in run:
+                append_to_prism_store(da.sel(time=date), dtype, date)
+    finally:
+        # The store is updated in place, so it is registered once with its final size (also when a batch failed part way)
+        if len(runs) > 0 and os.path.exists(path):
+            register_cached_asset(f"store/{dtype.lower()}/{variable}", path, None, f"store/{dtype.lower()}", variable, 'all', checksum=False, pinned=True)
+
+
+def open_prism_store(variable, dtype, start_date=None, end_date=None, western_bound=None, eastern_bound=None, southern_bound=None, northern_bound=None, region=None, to_fahrenheit=False, to_inches=False):
+
+    """
+    This function lazily opens the cube store of a variable. Only the values of the selected slice are read
+    from disk and only when they are used.
+
+    Required Arguments:
+
+    1) variable (String) - The variable name (i.e. 'tmax').
+
+    2) dtype (String) - Data Type: Daily or Monthly
+
+    Optional Arguments:
+
+    1) start_date (String) - Default = None. The start date of the slice in the 'YYYY-mm-dd' format.
+
+    2) end_date (String) - Default = None. The end date of the slice in the 'YYYY-mm-dd' format.
+
+    3) western_bound (Float or Integer) - Default = None. The western bound in decimal degrees.
+
+    4) eastern_bound (Float or Integer) - Default = None. The eastern bound in decimal degrees.
+
+    5) southern_bound (Float or Integer) - Default = None. The southern bound in decimal degrees.
+
+    6) northern_bound (Float or Integer) - Default = None. The northern bound in decimal degrees.
+
+    7) region (String) - Default = None. A region abbreviation from coords.get_region_info (i.e. 'CA').
+       The bounds of the region are used when the bounds above are None.
+
+    8) to_fahrenheit (Boolean) - Default = False. When set to True, temperature based parameters are converted to Fahrenheit.
+
+    9) to_inches (Boolean) - Default = False. When set to True, precipitation is converted to inches.
+
+    A unit conversion loads the selected slice into memory, so select the slice you need before converting. 
+
+    Returns: A lazily loaded 3-D xarray data array (time, lat, lon) sorted by time
+    """
+
+    variable = variable.lower()
+    path = get_prism_store_path(dtype, variable)
+
+    if region != None and western_bound == None and eastern_bound == None and southern_bound == None and northern_bound == None:
+        western_bound, eastern_bound, southern_bound, northern_bound = get_region_info(region)[:4]
+    else:
+        pass
+
+    ds = xr.open_dataset(path, engine='netcdf4')
+    touch_cached_asset(path)
+    da = ds[variable].sortby('time')
+    da = da.sel(time=slice(start_date, end_date), lat=slice(northern_bound, southern_bound), lon=slice(western_bound, eastern_bound))
+
+    if da.sizes['time'] == 0 or da.sizes['lat'] == 0 or da.sizes['lon'] == 0:
+        ds.close()
+        raise ValueError(f"The {dtype.lower()} {variable} cube store holds no data for the selection (dates {start_date} to {end_date}, bounds {western_bound}, {eastern_bound}, {southern_bound}, {northern_bound}). Fill it with update_prism_store or widen the selection.")
+
+    # The transform of the slice starts at its own upper-left pixel
+    attrs = dict(da.attrs)
+    transform = attrs['transform']
+    attrs['transform'] = (float(transform[0]), float(transform[1]), float(da['lon'].values[0]), float(transform[3]), float(transform[4]), float(da['lat'].values[0]))
+
+    da = convert_units(da, variable, to_fahrenheit, to_inches)
+    da.name = variable
+    da.attrs = attrs
+
+    return da
@@ -0,0 +1,271 @@
+"""
+This file hosts all the functions responsible for zonal statistics of PRISM grids over the
+PSA, GACC, NWS CWA, NWS Fire Weather Zone and NWS Public Zone shapefiles:
+    1) Rasterizing the zones of a shapefile into a zone-label grid on the PRISM grid (built once and cached)
+    2) Reducing a grid to per-zone statistics (mean, min, max, percentiles, valid-pixel count) with one
+       label-indexed reduction instead of a polygon clip per zone
+
+    (C) Meteorologist Eric J. Drewitz
+
+"""
+
+import os
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import warnings
+warnings.filterwarnings('ignore')
+
+from rasterio.features import rasterize
+from rasterio.transform import Affine
+from pyclimo.geometry import import_shapefiles
+from pyclimo.prism_stats import iter_prism_grids
+from pyclimo.prism_data import convert_units
+from pyclimo.cache import cache_directory, register_cached_asset, touch_cached_asset
+
+label_cache = {}
+
+label_cache_lock = threading.Lock()
+
+def get_zone_shapefile(zones):
+
+    """
+    This function returns the path to the shapefile of a set of zones and makes sure the shapefile is on disk.
+
+    Required Arguments:
+
+    1) zones (String) - The zones:
+       - 'psa' = National Predictive Services Areas
+       - 'gacc' = Geographic Area Coordination Centers
+       - 'cwa' = NWS County Warning Areas
+       - 'fwz' = NWS Fire Weather Zones
+       - 'pz' = NWS Public Zones
+
+    Returns: The path to the .shp file
+    """
+
+    zones = zones.lower()
+
+    paths = {
+        'psa':f"PSA Shapefiles/National_PSA_Current.shp",
+        'gacc':f"GACC Boundaries Shapefiles/National_GACC_Current.shp",
+        'cwa':f"NWS CWA Boundaries/w_05mr24.shp",
+        'fwz':f"NWS Fire Weather Zones/fz05mr24.shp",
+        'pz':f"NWS Public Zones/z_05mr24.shp"
+    }
+
+    try:
+        path = paths[zones]
+    except KeyError:
+        raise ValueError(f"{zones} is not a valid set of zones. Valid zones: 'psa', 'gacc', 'cwa', 'fwz', 'pz'")
+
+    import_shapefiles(path, 'black', zones)
+
+    return path
+
+
+def get_zone_labels(zones, transform, shape):
+
+    """
+    This function returns the zone-label grid of a set of zones on a grid definition. Pixel values are the
+    1-based row number of the zone in the shapefile and 0 outside every zone.
+
+    The label grid is built once per (zones, grid definition) and cached in memory and in the f:PRISM Cache/zones folder.
+
+    Required Arguments:
+
+    1) zones (String) - 'psa', 'gacc', 'cwa', 'fwz' or 'pz'.
+
+    2) transform (Affine or Tuple) - The affine transform of the grid.
+
+    3) shape (Tuple) - The (rows, columns) shape of the grid.
+
+    Returns
+    -------
+
+    1) A 2-D int32 array of zone labels
+    2) A Pandas DataFrame of the zone attributes from the shapefile indexed by label
+    """
+
+    zones = zones.lower()
+    transform = Affine(*tuple(transform)[:6])
+    key = (zones, tuple(transform)[:6], tuple(shape))
+
+    with label_cache_lock:
+        if key in label_cache:
+            return label_cache[key]
+
+    path = get_zone_shapefile(zones)
+    gdf = gpd.read_file(path)
+    if gdf.crs is not None:
+        # PRISM grids are on NAD83 latitude/longitude
+        gdf = gdf.to_crs('EPSG:4269')
+
+    attributes = pd.DataFrame(gdf.drop(columns='geometry'))
+    attributes.index = np.arange(1, len(gdf) + 1)
+    attributes.index.name = 'zone'
+
+    grid_hash = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+    label_path = f"{cache_directory}/zones/{zones}_{grid_hash}.npy"
+
+    if os.path.exists(label_path):
+        labels = np.load(label_path)
+        touch_cached_asset(label_path)
+    else:
+        shapes = ((geom, label) for geom, label in zip(gdf.geometry, attributes.index) if geom is not None)
+        labels = rasterize(shapes, out_shape=tuple(shape), transform=transform, fill=0, dtype='int32')
+
+        os.makedirs(f"{cache_directory}/zones", exist_ok=True)
+        np.save(f"{label_path}.tmp.npy", labels)
+        os.replace(f"{label_path}.tmp.npy", label_path)
+        register_cached_asset(f"zones/{zones}_{grid_hash}", label_path, path, 'zones', zones, grid_hash, checksum=False)
+
+    with label_cache_lock:
+        label_cache[key] = (labels, attributes)
+
+    return labels, attributes
+
+
+def reduce_by_labels(values, labels, nzones, percentiles=None):
+
+    """
+    This function computes the per-zone statistics of a 2-D grid from a zone-label grid.
+
+    Required Arguments:
+
+    1) values (Array) - The 2-D grid values (NaN = nodata).
+
+    2) labels (Array) - The 2-D zone-label grid (0 = outside every zone).
+
+    3) nzones (Integer) - The number of zones.
+
+    Optional Arguments:
+
+    1) percentiles (List) - Default = None. The percentiles (0-100) to compute in each zone.
+
+    Returns: A dictionary of 1-D arrays (one value per zone, index 0 = zone 1) with the keys
+             'count', 'mean', 'min', 'max' and 'p{percentile}' for each percentile
+    """
+
+    values = values.ravel()
+    labels = labels.ravel()
+
+    valid = np.isfinite(values) & (labels > 0)
+    x = values[valid]
+    z = labels[valid]
+
+    count = np.bincount(z, minlength=nzones + 1)[1:]
+    total = np.bincount(z, weights=x, minlength=nzones + 1)[1:]
+
+    # Sorting by zone and then by value puts each zone's values in one ordered run,
+    # so min, max and percentiles are lookups into that run
+    order = np.lexsort((x, z))
+    # A NaN sentinel at the end keeps the lookups of zones without valid pixels inside the array
+    x = np.append(x[order], np.nan)
+    start = np.concatenate([[0], np.cumsum(count)[:-1]])
+    last = start + np.maximum(count - 1, 0)
+    has_data = count > 0
+
+    stats = {}
+    stats['count'] = count
+    stats['mean'] = np.divide(total, count, out=np.full(nzones, np.nan), where=has_data)
+    stats['min'] = np.where(has_data, x[start], np.nan)
+    stats['max'] = np.where(has_data, x[last], np.nan)
+
+    if percentiles != None:
+        for q in percentiles:
+            position = start + (q / 100) * np.maximum(count - 1, 0)
+            lower = np.floor(position).astype('i8')
+            upper = np.minimum(lower + 1, last)
+            fraction = position - lower
+            value = x[lower] + (x[upper] - x[lower]) * fraction
+            stats[f"p{q:g}"] = np.where(has_data, value, np.nan)
+
+    return stats
+
+
+def zonal_statistics(da, zones, percentiles=None):
+
+    """
+    This function computes the statistics of a PRISM grid in every zone of a shapefile.
+
+    Required Arguments:
+
+    1) da (DataArray) - A 2-D (lat, lon) or 3-D (time, lat, lon) PRISM data array with a 'transform' attribute.
+
+    2) zones (String) - 'psa', 'gacc', 'cwa', 'fwz' or 'pz'.
+
+    Optional Arguments:
+
+    1) percentiles (List) - Default = None. The percentiles (0-100) to compute in each zone (i.e. [90, 97]).
+
+    Returns: A Pandas DataFrame with one row per zone (per date for a 3-D data array) holding the zone attributes,
+             the valid-pixel count, mean, min, max and the requested percentiles
+    """
+
+    labels, attributes = get_zone_labels(zones, da.attrs['transform'], da.shape[-2:])
+    nzones = len(attributes)
+
+    if da.ndim == 2:
+        stats = reduce_by_labels(da.values, labels, nzones, percentiles=percentiles)
+        df = attributes.join(pd.DataFrame(stats, index=attributes.index))
+    else:
+        frames = []
+        for i in range(da.shape[0]):
+            stats = reduce_by_labels(da[i].values, labels, nzones, percentiles=percentiles)
+            df = attributes.join(pd.DataFrame(stats, index=attributes.index))
+            df.insert(0, da.dims[0], da[da.dims[0]].values[i])
+            frames.append(df)
+        df = pd.concat(frames)
+
+    return df
+
+
+def get_prism_zonal_statistics(variable, start_date, end_date, zones, dtype='daily', source='fetch', percentiles=None, to_fahrenheit=False, to_inches=False, max_download_workers=4):
+
+    """
+    This function computes the zonal statistics of PRISM data for every day (or month) in a period.
+    The grids are streamed one at a time, so the period can be as long as needed.
+
+    Required Arguments:
+
+    1) variable (String) - The variable name (i.e. 'vpdmax').
+
+    2) start_date (String) - The start date of the period in the 'YYYY-mm-dd' format.
+
+    3) end_date (String) - The end date of the period in the 'YYYY-mm-dd' format.
+
+    4) zones (String) - 'psa', 'gacc', 'cwa', 'fwz' or 'pz'.
+
+    Optional Arguments:
+
+    1) dtype (String) - Default = 'daily'. Data Type: Daily or Monthly
+
+    2) source (String) - Default = 'fetch'. 'fetch' reads the grids from the PRISM Climate Group server (or the f:PRISM Cache folder).
+       'store' reads the grids from the cube store in the f:PRISM Store folder.
+
+    3) percentiles (List) - Default = None. The percentiles (0-100) to compute in each zone.
+
+    4) to_fahrenheit (Boolean) - Default = False. When set to True, temperature based parameters are converted to Fahrenheit.
+
+    5) to_inches (Boolean) - Default = False. When set to True, precipitation is converted to inches.
+
+    6) max_download_workers (Integer) - Default = 4. The maximum number of concurrent downloads when source='fetch'.
+
+    Returns: A Pandas DataFrame with one row per zone per date
+    """
+
+    variable = variable.lower()
+
+    frames = []
+    for date, da in iter_prism_grids(variable, start_date, end_date, dtype=dtype, source=source, max_download_workers=max_download_workers):
+        attrs = da.attrs
+        da = convert_units(da, variable, to_fahrenheit, to_inches)
+        da.attrs = attrs
+        df = zonal_statistics(da, zones, percentiles=percentiles)
+        df.insert(0, 'time', pd.Timestamp(date))
+        frames.append(df)
+
+    return pd.concat(frames)
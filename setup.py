@@ -19,9 +19,13 @@ setup(
         "xeofs>=3.0.4",
         "rasterio>=1.4.3",
         "pytz>=2024.1",
-        "geopandas>=1.1.0"
+        "geopandas>=1.1.0",
+        "requests>=2.31"
       
     ],
+    extras_require={
+        "dask": ["dask>=2023.1.0"]
+    },
     author="Eric J. Drewitz",
     description="An Open Source Package For Climate Analysis",
     long_description=open("README.md").read(),
@@ -0,0 +1,81 @@
+"""
+Tests of the base period standard deviations computed from a small monthly cube store.
+"""
+
+import threading
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+import pyclimo.cache as cache
+import pyclimo.normals as normals
+from pyclimo.prism_store import append_to_prism_store
+from pyclimo.anomaly import get_standard_deviation
+
+def affine_is_sequence():
+
+    from rasterio.transform import Affine
+
+    try:
+        return len(tuple(Affine.identity())) == 9
+    except TypeError:
+        return False
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(cache, 'connections', threading.local())
+    normals.packed.clear()
+
+    yield tmp_path
+
+    normals.packed.clear()
+
+
+def fill_store(dates, seed=0):
+
+    rng = np.random.default_rng(seed)
+    lat = 40 - 0.5 * np.arange(3)
+    lon = -120 + 0.5 * np.arange(4)
+
+    grids = {}
+    for date in dates:
+        values = rng.normal(15, 3, size=(3, 4)).astype('float32')
+        da = xr.DataArray(values, coords={'lat':lat, 'lon':lon}, dims=('lat', 'lon'), name='tmax')
+        da.attrs['transform'] = (0.5, 0.0, -120.25, 0.0, -0.5, 40.25)
+        append_to_prism_store(da, 'monthly', date)
+        grids[date] = values
+
+    return grids
+
+
+def test_standard_deviation_without_store(workdir):
+
+    with pytest.raises(ValueError, match='update_prism_store'):
+        get_standard_deviation('tmax', 'monthly', '07')
+
+
+def test_standard_deviation_with_partial_store(workdir):
+
+    fill_store(pd.date_range('1991-01-01', '1995-12-01', freq='MS'))
+
+    with pytest.raises(ValueError, match='update_prism_store'):
+        get_standard_deviation('tmax', 'monthly', '07')
+
+
+@pytest.mark.skipif(not affine_is_sequence(), reason='the installed affine cannot be converted to a tuple')
+def test_standard_deviation_matches_numpy(workdir):
+
+    grids = fill_store(pd.date_range('1991-01-01', '2020-12-01', freq='MS'))
+
+    std = get_standard_deviation('tmax', 'monthly', '07')
+    july = np.stack([values for date, values in grids.items() if date.month == 7]).astype('f8')
+
+    np.testing.assert_allclose(std.values, july.std(axis=0, ddof=1), rtol=1e-5)
+
+    # The standard deviation is kept in the packed normals and read back from them
+    values, transform = normals.get_packed_normal('tmax_monthly_std_07_1991_2020')
+    np.testing.assert_array_equal(values, std.values)
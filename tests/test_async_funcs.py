@@ -0,0 +1,44 @@
+"""
+Tests of the per event loop request limit of the async entry points.
+"""
+
+import asyncio
+import gc
+
+import pyclimo.async_funcs as async_funcs
+
+async def contend(requests):
+
+    active = []
+    peak = []
+
+    async def request():
+        async with async_funcs.get_semaphore():
+            active.append(1)
+            peak.append(len(active))
+            await asyncio.sleep(0.001)
+            active.pop()
+
+    await asyncio.gather(*[request() for i in range(requests)])
+
+    return max(peak)
+
+
+def test_semaphore_limits_requests_and_is_pruned():
+
+    async_funcs.set_max_concurrency(max_requests=3, max_workers=1)
+
+    try:
+        for i in range(5):
+            assert asyncio.run(contend(10)) == 3
+            gc.collect()
+            # Only the semaphore of the loop that ran last is left, and it is dropped as soon as another loop asks for one
+            assert len(async_funcs.semaphores) <= 1
+
+        async def count():
+            async_funcs.get_semaphore()
+            return len(async_funcs.semaphores)
+
+        assert asyncio.run(count()) == 1
+    finally:
+        async_funcs.set_max_concurrency()
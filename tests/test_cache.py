@@ -0,0 +1,91 @@
+"""
+Tests of the cache manifest in a temporary working directory.
+"""
+
+import os
+import threading
+import pytest
+
+import pyclimo.cache as cache
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    # The manifest connections are per thread and per working directory
+    monkeypatch.setattr(cache, 'connections', threading.local())
+
+    yield tmp_path
+
+
+def write(path, size):
+
+    if os.path.dirname(path) != '':
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'\0' * size)
+
+    return path
+
+
+def test_evict_cache_keeps_pinned_assets(workdir):
+
+    store = write('PRISM Store/daily/tmax.nc', 4096)
+    cache.register_cached_asset('store/daily/tmax', store, None, 'store/daily', 'tmax', 'all', checksum=False, pinned=True)
+
+    grids = []
+    for i in range(3):
+        path = write(f"{cache.cache_directory}/objects/0{i}/grid{i}.zip", 1024)
+        sidecar = write(f"{path}.2x.npy", 256)
+        cache.register_cached_asset(f"daily/tmax/2024070{i}/none/4km", path, None, 'daily', 'tmax', f"2024070{i}")
+        cache.register_cached_asset(f"overview/grid{i}.zip/2x", sidecar, path, 'overview', 'tmax', f"grid{i}.zip", checksum=False)
+        grids.append((path, sidecar))
+
+    freed = cache.evict_cache(max_size=1)
+
+    assert freed == 3 * (1024 + 256)
+    assert os.path.exists(store)
+    for path, sidecar in grids:
+        assert not os.path.exists(path)
+        assert not os.path.exists(sidecar)
+
+    keys = [row[0] for row in cache.get_connection().execute("SELECT key FROM assets").fetchall()]
+    assert keys == ['store/daily/tmax']
+
+
+def test_evict_cache_by_age_keeps_pinned_assets(workdir):
+
+    store = write('PRISM Store/daily/ppt.nc', 64)
+    cache.register_cached_asset('store/daily/ppt', store, None, 'store/daily', 'ppt', 'all', checksum=False, pinned=True)
+    path = write(f"{cache.cache_directory}/objects/aa/grid.zip", 64)
+    cache.register_cached_asset('daily/ppt/20240701/none/4km', path, None, 'daily', 'ppt', '20240701')
+
+    connection = cache.get_connection()
+    with connection:
+        connection.execute("UPDATE assets SET last_access = '2000-01-01 00:00:00'")
+
+    cache.evict_cache(max_age_days=1)
+
+    assert os.path.exists(store)
+    assert not os.path.exists(path)
+
+
+def test_delete_cached_file_removes_sidecar_rows(workdir):
+
+    # A zip file downloaded with use_cache=False is not in the manifest but its overviews are
+    zip_path = write('prism_tmax_us_25m_20240701.zip', 512)
+    for factor in [2, 4]:
+        overview = write(f"{zip_path}.{factor}x.npy", 64)
+        write(f"{zip_path}.{factor}x.json", 8)
+        cache.register_cached_asset(f"overview/{zip_path}/{factor}x", overview, zip_path, 'overview', 'tmax', zip_path, checksum=False)
+    other = write('prism_tmax_us_25m_20240702.zip.2x.npy', 64)
+    cache.register_cached_asset('overview/prism_tmax_us_25m_20240702.zip/2x', other, None, 'overview', 'tmax', 'other', checksum=False)
+
+    connection = cache.get_connection()
+    with cache.manifest_lock:
+        freed = cache.delete_cached_file(connection, zip_path)
+
+    assert freed == 512 + 2 * (64 + 8)
+    assert sorted(os.listdir(workdir)) == [cache.cache_directory, 'prism_tmax_us_25m_20240702.zip.2x.npy']
+    keys = [row[0] for row in connection.execute("SELECT key FROM assets").fetchall()]
+    assert keys == ['overview/prism_tmax_us_25m_20240702.zip/2x']
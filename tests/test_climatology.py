@@ -0,0 +1,84 @@
+"""
+Tests of the sort-based percentiles used by the percentile climatology against np.nanpercentile.
+"""
+
+import numpy as np
+import pytest
+
+from pyclimo.climatology import nan_percentiles
+
+@pytest.mark.filterwarnings('ignore::RuntimeWarning')
+@pytest.mark.parametrize('samples', [1, 2, 7, 211])
+def test_nan_percentiles_match_numpy(samples):
+
+    rng = np.random.default_rng(samples)
+    values = rng.gamma(2.0, 5.0, size=(samples, 8, 9)).astype('float32')
+    values[rng.random(values.shape) < 0.3] = np.nan
+    values[:, 0, 0] = np.nan
+
+    percentiles = [0, 10, 50, 90, 97, 100]
+    result = nan_percentiles(values, percentiles)
+    expected = np.nanpercentile(values.astype('f8'), percentiles, axis=0)
+
+    assert result.shape == (len(percentiles), 8, 9)
+    assert result.dtype == np.float32
+    np.testing.assert_allclose(result, expected, rtol=1e-6, equal_nan=True)
+    assert np.isnan(result[:, 0, 0]).all()
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+
+    import threading
+    import pyclimo.cache as cache
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(cache, 'connections', threading.local())
+
+    yield tmp_path
+
+
+@pytest.mark.filterwarnings('ignore::RuntimeWarning')
+def test_build_percentile_climatology_matches_numpy(workdir):
+
+    import pandas as pd
+    import xarray as xr
+    from pyclimo.prism_store import append_to_prism_store
+    from pyclimo.climatology import build_percentile_climatology, get_day_of_year
+
+    rng = np.random.default_rng(7)
+    lat = 40 - 0.5 * np.arange(10)
+    lon = -120 + 0.5 * np.arange(12)
+    dates = list(pd.date_range('1980-12-20', '1981-02-10')) + list(pd.date_range('1981-12-25', '1982-01-20')) + list(pd.date_range('1983-01-01', '1983-01-05'))
+    # Appending out of order leaves the days of the base period in several runs along the time axis of the store
+    order = rng.permutation(len(dates))
+
+    grids = {}
+    for i in order:
+        values = rng.normal(10, 5, size=(10, 12)).astype('float32')
+        values[rng.random(values.shape) < 0.1] = np.nan
+        values[:, -1] = np.nan
+        da = xr.DataArray(values, coords={'lat':lat, 'lon':lon}, dims=('lat', 'lon'), name='tmax')
+        da.attrs['transform'] = (0.5, 0.0, -120.25, 0.0, -0.5, 40.25)
+        append_to_prism_store(da, 'daily', dates[i], spatial_chunk=4)
+        grids[dates[i]] = values
+
+    percentiles = [10, 90]
+    path = build_percentile_climatology('tmax', percentiles=percentiles, start_year=1981, end_year=1982, day_window=3, tile_size=3, time_batch=5)
+
+    in_period = [date for date in grids if 1981 <= date.year <= 1982]
+    doys = np.array([get_day_of_year(date.month, date.day) for date in in_period])
+    stack = np.stack([grids[date] for date in in_period])
+
+    with xr.open_dataset(path) as ds:
+        result = ds['tmax'].values
+
+    for doy in [1, 15, 40, 200, 360, 366]:
+        distance = np.abs(doys - doy)
+        distance = np.minimum(distance, 366 - distance)
+        sample = stack[distance <= 3]
+        if len(sample) == 0:
+            assert np.isnan(result[doy - 1]).all()
+        else:
+            expected = np.nanpercentile(sample.astype('f8'), percentiles, axis=0)
+            np.testing.assert_allclose(result[doy - 1], expected, rtol=1e-5, equal_nan=True)
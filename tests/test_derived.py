@@ -0,0 +1,101 @@
+"""
+Tests of the derived variable kernels against the NWS heat index chart and the NWS heat index algorithm.
+"""
+
+import math
+import numpy as np
+import pytest
+
+from pyclimo.derived import heat_index_kernel, relative_humidity_kernel
+
+# (°F, %RH, heat index °F) from the NWS heat index chart
+nws_chart = [
+    (80, 40, 80), (80, 60, 82), (80, 80, 84),
+    (86, 40, 85), (86, 60, 91), (86, 80, 100), (86, 90, 105),
+    (90, 40, 91), (90, 50, 95), (90, 60, 100), (90, 70, 106), (90, 80, 113),
+    (96, 40, 101), (96, 50, 107), (96, 60, 116), (96, 65, 121),
+    (100, 40, 109), (100, 50, 118), (100, 55, 124),
+    (104, 40, 119), (104, 45, 124), (104, 50, 131),
+    (110, 40, 136),
+]
+
+def nws_heat_index(T, RH):
+
+    """
+    The NWS heat index algorithm (https://www.wpc.ncep.noaa.gov/html/heatindex_equation.shtml) one value at a time.
+    """
+
+    HI = 0.5 * (T + 61.0 + ((T - 68.0) * 1.2) + (RH * 0.094))
+    if (HI + T) / 2 < 80:
+        return HI
+
+    HI = (-42.379 + 2.04901523 * T + 10.14333127 * RH - 0.22475541 * T * RH - 0.00683783 * T * T
+          - 0.05481717 * RH * RH + 0.00122874 * T * T * RH + 0.00085282 * T * RH * RH - 0.00000199 * T * T * RH * RH)
+    if RH < 13 and 80 <= T <= 112:
+        HI -= ((13 - RH) / 4) * math.sqrt((17 - abs(T - 95)) / 17)
+    if RH > 85 and 80 <= T <= 87:
+        HI += ((RH - 85) / 10) * ((87 - T) / 5)
+
+    return HI
+
+
+def to_inputs(T, RH):
+
+    """
+    The temperature and dew point [°C] that give T [°F] and RH [%] with the relative humidity kernel.
+    """
+
+    t = (np.asarray(T, dtype='f8') - 32) / 1.8
+    x = np.log(np.asarray(RH, dtype='f8') / 100) + 17.67 * t / (t + 243.5)
+    td = 243.5 * x / (17.67 - x)
+
+    return t.astype('float32'), td.astype('float32')
+
+
+def run(T, RH):
+
+    t, td = to_inputs(T, RH)
+    out = np.empty(t.shape, dtype='float32')
+    scratch = [np.empty(t.shape, dtype='float32') for i in range(3)]
+    heat_index_kernel((t, td), out, scratch)
+
+    return out
+
+
+def test_relative_humidity_kernel_round_trip():
+
+    T, RH = np.meshgrid(np.arange(40, 111, 5), np.arange(5, 101, 5))
+    t, td = to_inputs(T, RH)
+    out = np.empty(t.shape, dtype='float32')
+    relative_humidity_kernel((t, td), out, [np.empty(t.shape, dtype='float32')])
+
+    np.testing.assert_allclose(out, RH, rtol=1e-4)
+
+
+def test_heat_index_matches_nws_chart():
+
+    T, RH, expected = np.array(nws_chart, dtype='f8').T
+    result = run(T, RH)
+
+    # The chart values are rounded to whole degrees
+    np.testing.assert_allclose(result, expected, atol=1.0)
+
+
+def test_heat_index_matches_nws_algorithm():
+
+    T, RH = np.meshgrid(np.arange(60, 116, 0.5), np.arange(2, 101, 1.0))
+    result = run(T, RH)
+    expected = np.vectorize(nws_heat_index)(T, RH)
+
+    np.testing.assert_allclose(result, expected, atol=0.02)
+
+
+@pytest.mark.parametrize('T, RH', [(81, 5), (81.5, 2), (82, 1)])
+def test_heat_index_uses_regression_where_the_average_reaches_80(T, RH):
+
+    # The Steadman estimate is below 80°F here but its average with the temperature is not,
+    # so the NWS algorithm switches to the Rothfusz regression
+    steadman = 0.5 * (T + 61.0 + ((T - 68.0) * 1.2) + (RH * 0.094))
+    assert steadman < 80 and (steadman + T) / 2 >= 80
+
+    np.testing.assert_allclose(run(np.array([T]), np.array([RH])), [nws_heat_index(T, RH)], atol=0.02)
@@ -0,0 +1,157 @@
+"""
+Tests of the shared download layer against a local HTTP server standing in for the PRISM server.
+"""
+
+import io
+import gzip
+import os
+import threading
+import zipfile
+import pytest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pyclimo.download import download_file, DownloadError
+
+def make_zip():
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as zObject:
+        zObject.writestr('prism_tmax_us_25m_20240701.tif', bytes(range(256)) * 64)
+
+    return buffer.getvalue()
+
+
+payload = make_zip()
+
+corrupt = bytearray(payload)
+corrupt[len(corrupt) // 2] ^= 0xFF
+corrupt = bytes(corrupt)
+
+text = b'GEOGCS["GCS_North_American_1983",DATUM["D_North_American_1983"]]' * 20
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, body, status=200, headers={}):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, dict(self.headers)))
+        count = len([path for path, headers in server.requests if path == self.path])
+
+        if self.path == '/truncated.zip':
+            byte_range = self.headers.get('Range')
+            if byte_range == None:
+                # Promise the whole file and hang up halfway through
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload[:len(payload) // 2])
+                self.wfile.flush()
+                self.close_connection = True
+            else:
+                start = int(byte_range.split('=')[1].split('-')[0])
+                self.send_body(payload[start:], 206, {'Content-Range':f"bytes {start}-{len(payload) - 1}/{len(payload)}"})
+
+        elif self.path == '/flaky.zip':
+            if count == 1:
+                self.send_body(b'Service Unavailable', 503)
+            else:
+                self.send_body(payload)
+
+        elif self.path == '/corrupt.zip':
+            self.send_body(corrupt)
+
+        elif self.path == '/shape.prj':
+            # Compress the response whenever the client allows it
+            if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                self.send_body(gzip.compress(text), 200, {'Content-Encoding':'gzip'})
+            else:
+                self.send_body(text)
+
+        else:
+            self.send_body(b'Not Found', 404)
+
+
+@pytest.fixture
+def server():
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    yield httpd
+
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def get_url(server, path):
+
+    return f"http://127.0.0.1:{server.server_address[1]}{path}"
+
+
+def test_resume_after_truncation(server, tmp_path):
+
+    file_path = str(tmp_path / 'truncated.zip')
+
+    assert download_file(get_url(server, '/truncated.zip'), file_path, backoff=0) == file_path
+
+    with open(file_path, 'rb') as f:
+        assert f.read() == payload
+    assert os.path.exists(f"{file_path}.part") == False
+
+    ranges = [headers.get('Range') for path, headers in server.requests]
+    assert ranges == [None, f"bytes={len(payload) // 2}-"]
+
+
+def test_retry_after_server_error(server, tmp_path):
+
+    file_path = str(tmp_path / 'flaky.zip')
+
+    download_file(get_url(server, '/flaky.zip'), file_path, backoff=0)
+
+    with open(file_path, 'rb') as f:
+        assert f.read() == payload
+    assert len(server.requests) == 2
+
+
+def test_crc_rejection(server, tmp_path):
+
+    file_path = str(tmp_path / 'corrupt.zip')
+
+    with pytest.raises(DownloadError):
+        download_file(get_url(server, '/corrupt.zip'), file_path, retries=2, backoff=0)
+
+    assert os.path.exists(file_path) == False
+    assert os.path.exists(f"{file_path}.part") == False
+    assert len(server.requests) == 3
+
+
+def test_not_found_is_not_retried(server, tmp_path):
+
+    with pytest.raises(DownloadError):
+        download_file(get_url(server, '/missing.zip'), str(tmp_path / 'missing.zip'), backoff=0)
+
+    assert len(server.requests) == 1
+
+
+def test_identity_encoding(server, tmp_path):
+
+    file_path = str(tmp_path / 'shape.prj')
+
+    download_file(get_url(server, '/shape.prj'), file_path, retries=0)
+
+    with open(file_path, 'rb') as f:
+        assert f.read() == text
+    assert server.requests[0][1].get('Accept-Encoding') == 'identity'
@@ -0,0 +1,86 @@
+"""
+Tests of the NOAA PSL THREDDS Server health check with stand-in backends.
+"""
+
+import time
+import requests
+import pytest
+
+import pyclimo.noaa_psl_data as noaa_psl_data
+from pyclimo.backends import set_backend
+
+class ProbeBackend:
+
+    def __init__(self, server, results):
+
+        self.server = server
+        self.results = list(results)
+        self.probes = 0
+
+    def psl_location(self, path):
+
+        return f"{self.server}/{path}"
+
+    def probe(self, location, timeout=None):
+
+        self.probes += 1
+        result = self.results[min(self.probes, len(self.results)) - 1]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+@pytest.fixture
+def backend(monkeypatch):
+
+    monkeypatch.setattr(noaa_psl_data, 'health', {'checked':{}, 'failed':{}, 'probes':{}, 'failures':{}, 'open_until':{}})
+
+    def use(server, results):
+        new = ProbeBackend(server, results)
+        previous = set_backend(new)
+        backends.append(previous)
+        return new
+
+    backends = []
+    yield use
+
+    set_backend(backends[0])
+
+
+def test_breaker_is_per_server(backend):
+
+    down = backend('http://down.example', [503])
+    for i in range(3):
+        with pytest.raises(noaa_psl_data.PSLServerError):
+            noaa_psl_data.check_psl_server(down.psl_location('dataset'), retries=0, failure_threshold=3)
+
+    # The breaker of the failing server is open, so it is not probed again
+    with pytest.raises(noaa_psl_data.PSLServerError, match='retrying in'):
+        noaa_psl_data.check_psl_server(down.psl_location('dataset'), retries=0, failure_threshold=3)
+    assert down.probes == 3
+
+    # Another server is unaffected
+    mirror = backend('/mirror', [200])
+    noaa_psl_data.check_psl_server(mirror.psl_location('dataset'), retries=0, failure_threshold=3)
+    assert mirror.probes == 1
+
+
+def test_request_errors_are_server_errors(backend):
+
+    server = backend('http://flaky.example', [requests.exceptions.TooManyRedirects(), requests.exceptions.SSLError(), 200])
+
+    with pytest.raises(noaa_psl_data.PSLServerError):
+        noaa_psl_data.check_psl_server(server.psl_location('dataset'), retries=1, backoff=0)
+
+    # The failed check is not cached, so a later check probes again and succeeds
+    time.sleep(0.01)
+    noaa_psl_data.check_psl_server(server.psl_location('dataset'), retries=0)
+    assert server.probes == 3
+
+
+def test_missing_dataset(backend):
+
+    server = backend('http://up.example', [404])
+
+    with pytest.raises(noaa_psl_data.PSLServerError, match='does not exist'):
+        noaa_psl_data.check_psl_server(server.psl_location('missing'), retries=0)
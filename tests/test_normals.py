@@ -0,0 +1,101 @@
+"""
+Tests of the packed normals store with a stand-in for the PRISM normals.
+"""
+
+import threading
+import numpy as np
+import xarray as xr
+import pytest
+
+import pyclimo.cache as cache
+import pyclimo.normals as normals
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(cache, 'connections', threading.local())
+    normals.packed.clear()
+
+    fetched = []
+
+    def get_prism_dataarray(dtype, variable, year, month, day, normal_type):
+        fetched.append(normals.get_normal_key(variable, normal_type, month, day))
+        value = {'tmax':100, 'tmin':200}[variable] + int(month) + (int(day) if day != None else 0) / 100
+        da = xr.DataArray(np.full((3, 4), value, dtype='float32'), dims=('lat', 'lon'), name=variable)
+        da.attrs['transform'] = (0.5, 0.0, -120.25, 0.0, -0.5, 40.25)
+        return da
+
+    monkeypatch.setattr(normals, 'get_prism_dataarray', get_prism_dataarray)
+
+    yield fetched
+
+    normals.packed.clear()
+
+
+def test_pack_prism_normals_keeps_earlier_packs(workdir):
+
+    normals.pack_prism_normals(['tmax'], normal_types=['monthly'])
+    normals.pack_prism_normals(['tmin'], normal_types=['monthly'])
+
+    for variable, base in [('tmax', 100), ('tmin', 200)]:
+        for month in range(1, 13):
+            values, transform = normals.get_packed_normal(f"{variable}_monthly_{month:02d}")
+            assert values.shape == (3, 4)
+            assert (values == base + month).all()
+            assert (transform.a, transform.b, transform.c, transform.d, transform.e, transform.f) == (0.5, 0.0, -120.25, 0.0, -0.5, 40.25)
+
+    values, index, transform = normals.open_packed_normals()
+    assert len(index) == 24
+    assert values.shape == (24, 3, 4)
+
+
+def test_add_packed_normals_skips_packed_normals(workdir):
+
+    normals.add_packed_normals([('tmax', 'daily', '02', '29')], replace=False)
+    normals.add_packed_normals([('tmax', 'daily', '02', '29'), ('tmax', 'daily', '03', '01')], replace=False)
+
+    assert workdir == ['tmax_daily_0229', 'tmax_daily_0301']
+    values, transform = normals.get_packed_normal('tmax_daily_0301')
+    np.testing.assert_allclose(values, 103.01)
+
+
+def test_add_packed_grid(workdir):
+
+    normals.add_packed_normals([('tmax', 'monthly', '07', None)])
+
+    da = xr.DataArray(np.arange(12, dtype='float32').reshape(3, 4), dims=('lat', 'lon'), name='tmax')
+    da.attrs['transform'] = (0.5, 0.0, -120.25, 0.0, -0.5, 40.25)
+    normals.add_packed_grid('tmax_monthly_std_07_1991_2020', da)
+
+    values, transform = normals.get_packed_normal('tmax_monthly_std_07_1991_2020')
+    np.testing.assert_array_equal(values, da.values)
+    values, transform = normals.get_packed_normal('tmax_monthly_07')
+    assert (values == 107).all()
+
+    other = xr.DataArray(np.zeros((5, 5), dtype='float32'), dims=('lat', 'lon'), name='tmax')
+    other.attrs['transform'] = da.attrs['transform']
+    with pytest.raises(ValueError):
+        normals.add_packed_grid('other', other)
+
+
+def test_open_packed_normals_reopens_changed_pack(workdir):
+
+    normals.add_packed_normals([('tmax', 'monthly', '07', None)])
+    values, index, transform = normals.open_packed_normals()
+    stale = dict(normals.packed)
+
+    # Another process adds a grid: the index is replaced behind the mapping of this process
+    da = xr.DataArray(np.ones((3, 4), dtype='float32'), dims=('lat', 'lon'), name='tmax')
+    da.attrs['transform'] = (0.5, 0.0, -120.25, 0.0, -0.5, 40.25)
+    normals.add_packed_grid('tmax_monthly_std_07_1991_2020', da)
+    normals.packed.clear()
+    normals.packed.update(stale)
+
+    values, transform = normals.get_packed_normal('tmax_monthly_std_07_1991_2020')
+    assert (values == 1).all()
+
+    # An unchanged pack is not reopened
+    mapping = normals.packed['values']
+    normals.get_packed_normal('tmax_monthly_07')
+    assert normals.packed['values'] is mapping
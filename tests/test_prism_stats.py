@@ -0,0 +1,70 @@
+"""
+Tests of the running per-pixel statistics against the NumPy reductions of the whole stack.
+"""
+
+import numpy as np
+import xarray as xr
+import pytest
+
+from pyclimo.prism_stats import RunningStats
+
+def make_stack():
+
+    rng = np.random.default_rng(0)
+    # A large offset makes the naive sum-of-squares variance lose precision, Welford's algorithm does not
+    values = (1.0e4 + rng.normal(0, 3, size=(40, 6, 5))).astype('float32')
+    values[rng.random(values.shape) < 0.2] = np.nan
+    # One pixel that never has data and one pixel with a single value
+    values[:, 0, 0] = np.nan
+    values[1:, 0, 1] = np.nan
+
+    return values
+
+
+def run(values):
+
+    stats = RunningStats()
+    for grid in values:
+        stats.update(xr.DataArray(grid, dims=('lat', 'lon'), name='tmax'))
+
+    return stats
+
+
+@pytest.mark.filterwarnings('ignore::RuntimeWarning')
+def test_running_stats_match_numpy():
+
+    values = make_stack()
+    stats = run(values)
+    expected = values.astype('f8')
+
+    np.testing.assert_array_equal(stats.result('count').values, np.count_nonzero(~np.isnan(values), axis=0))
+    np.testing.assert_allclose(stats.result('mean').values, np.nanmean(expected, axis=0), rtol=1e-12)
+    np.testing.assert_allclose(stats.result('sum').values[1:], np.nansum(expected, axis=0)[1:], rtol=1e-12)
+    np.testing.assert_allclose(stats.result('variance').values, np.nanvar(expected, axis=0, ddof=1), rtol=1e-9)
+    np.testing.assert_allclose(stats.result('std').values, np.nanstd(expected, axis=0, ddof=1), rtol=1e-9)
+    np.testing.assert_array_equal(stats.result('min').values, np.nanmin(values, axis=0))
+    np.testing.assert_array_equal(stats.result('max').values, np.nanmax(values, axis=0))
+
+
+def test_running_stats_pixels_without_data():
+
+    stats = run(make_stack())
+
+    assert stats.result('count').values[0, 0] == 0
+    assert np.isnan(stats.result('mean').values[0, 0])
+    assert np.isnan(stats.result('sum').values[0, 0])
+    assert np.isnan(stats.result('min').values[0, 0])
+    # The sample variance needs at least two values
+    assert stats.result('count').values[0, 1] == 1
+    assert np.isnan(stats.result('variance').values[0, 1])
+
+
+def test_running_stats_errors():
+
+    stats = RunningStats()
+    with pytest.raises(ValueError):
+        stats.result('mean')
+
+    stats = run(make_stack())
+    with pytest.raises(ValueError):
+        stats.result('median')
@@ -0,0 +1,67 @@
+"""
+Tests of the cube store with grids appended directly and with a stand-in for the PRISM downloads.
+"""
+
+import threading
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+import pyclimo.cache as cache
+import pyclimo.prism_store as prism_store
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(cache, 'connections', threading.local())
+
+    yield tmp_path
+
+
+def make_grid(value):
+
+    da = xr.DataArray(np.full((3, 4), value, dtype='float32'), coords={'lat':40 - 0.5 * np.arange(3), 'lon':-120 + 0.5 * np.arange(4)}, dims=('lat', 'lon'), name='tmax')
+    da.attrs['transform'] = (0.5, 0.0, -120.25, 0.0, -0.5, 40.25)
+
+    return da
+
+
+def test_open_prism_store_empty_selection(workdir):
+
+    prism_store.append_to_prism_store(make_grid(1), 'daily', '2024-07-01')
+
+    with pytest.raises(ValueError, match='no data for the selection'):
+        prism_store.open_prism_store('tmax', 'daily', start_date='2020-01-01', end_date='2020-01-31')
+
+    with pytest.raises(ValueError, match='no data for the selection'):
+        prism_store.open_prism_store('tmax', 'daily', western_bound=-100, eastern_bound=-90, southern_bound=30, northern_bound=35)
+
+
+def test_update_prism_store_registers_once(workdir, monkeypatch):
+
+    def get_prism_range(variable, start_date, end_date, dtype, max_download_workers=4, max_decode_workers=2):
+        dates = pd.date_range(start_date, end_date)
+        return xr.concat([make_grid(date.day) for date in dates], dim=pd.Index(dates, name='time'))
+
+    registered = []
+    register_cached_asset = prism_store.register_cached_asset
+
+    def register(*args, **kwargs):
+        registered.append(args[0])
+        return register_cached_asset(*args, **kwargs)
+
+    monkeypatch.setattr(prism_store, 'get_prism_range', get_prism_range)
+    monkeypatch.setattr(prism_store, 'register_cached_asset', register)
+
+    prism_store.update_prism_store('tmax', '2024-07-01', '2024-07-10', 'daily', batch_size=4)
+
+    assert registered == ['store/daily/tmax']
+    assert len(prism_store.get_store_dates('daily', 'tmax')) == 10
+    row = cache.get_connection().execute("SELECT pinned FROM assets WHERE key = 'store/daily/tmax'").fetchone()
+    assert row == (1,)
+
+    # Nothing is missing, so nothing is fetched or registered again
+    prism_store.update_prism_store('tmax', '2024-07-01', '2024-07-10', 'daily')
+    assert registered == ['store/daily/tmax']
@@ -0,0 +1,31 @@
+"""
+Tests of the label-indexed zonal reduction against a per-zone loop.
+"""
+
+import numpy as np
+
+from pyclimo.zonal import reduce_by_labels
+
+def test_reduce_by_labels_matches_per_zone_loop():
+
+    rng = np.random.default_rng(3)
+    values = rng.normal(20, 4, size=(30, 40))
+    values[rng.random(values.shape) < 0.1] = np.nan
+    labels = rng.integers(0, 5, size=(30, 40)).astype('int32')
+    # Zone 5 has no valid pixels and zone 6 has no pixels at all
+    labels[:2] = 5
+    values[:2] = np.nan
+
+    stats = reduce_by_labels(values, labels, 6, percentiles=[10, 50, 97])
+
+    for zone in range(1, 7):
+        x = values[(labels == zone) & np.isfinite(values)]
+        i = zone - 1
+        assert stats['count'][i] == x.size
+        if x.size == 0:
+            assert np.isnan([stats[k][i] for k in ('mean', 'min', 'max', 'p10', 'p50', 'p97')]).all()
+        else:
+            np.testing.assert_allclose(stats['mean'][i], x.mean())
+            assert stats['min'][i] == x.min()
+            assert stats['max'][i] == x.max()
+            np.testing.assert_allclose([stats['p10'][i], stats['p50'][i], stats['p97'][i]], np.percentile(x, [10, 50, 97]))